@@ -2,16 +2,18 @@ import streamlit as st
 import traceback
 import pandas as pd
 from db import (
-    get_clientes,
-    get_produtos,
     get_ultimas_reunioes,
     add_cliente,
     add_produto,
     add_reuniao,
+    add_reunioes_batch,
     get_max_cliente,
 )
 import re
 
+from diretorio import diretorio_produtos, seletor_cliente, seletor_produto
+from importacao import importar
+
 
 tipo_cliente_options = [
     "Distribuição",
@@ -70,10 +72,8 @@ st.markdown(
 tab1, tab2 = st.tabs(["Gestão de Clientes", "Adicionar Clientes/Produtos"])
 
 with tab1:
-    clientes = get_clientes()
-    nomes_clientes = [c[1] for c in clientes]
-    # Selecionar cliente
-    cliente_selecionado_nome = st.selectbox("Selecione um cliente:", nomes_clientes)
+    # Selecionar cliente (pesquisa no servidor; devolve o id, mesmo com nomes repetidos)
+    cliente_id_selecionado = seletor_cliente(chave="cliente_vendas")
 
     # ---------------------------------Obter numero máximo de cliente para sugerir-----------------------------
     lista_numeros_clientes = get_max_cliente()
@@ -88,12 +88,6 @@ with tab1:
     # Se houver números válidos, retorna o maior +1; senão, começa em 1
     ultimo_numero_cliente = str(max(numeros_validos) + 1) if numeros_validos else "1"
 
-    cliente_id_selecionado = None
-    for cliente in clientes:
-        if cliente[1] == cliente_selecionado_nome:
-            cliente_id_selecionado = cliente[0]
-            break
-
     # ----------------------------TABELA DE REUNIOES-----------------------------------------------------------
     reunioes = get_ultimas_reunioes(cliente_id_selecionado)
 
@@ -160,10 +154,8 @@ with tab1:
     descricao_reuniao = st.text_area("Descrição da Reunião")
 
     if st.session_state["houve_venda"] == "Sim":
-        produtos = get_produtos()
-        nomes_produtos = [p[1] for p in produtos]
-        produto_selecionado = st.selectbox("Selecione um produto:", nomes_produtos)
-        produto_id = next(p[0] for p in produtos if p[1] == produto_selecionado)
+        produto_id = seletor_produto(chave="produto_vendas")
+        produto_selecionado = diretorio_produtos().nome(produto_id)
         quantidade = st.number_input("Quantidade vendida", min_value=1, step=1)
         preco_unitario = st.number_input("Preço unitário (€)", min_value=0.01)
         valor_total = quantidade * preco_unitario
@@ -173,7 +165,7 @@ with tab1:
         )
 
         # Botão para adicionar produto à lista de produtos vendidos
-        if st.button("Adicionar Produto"):
+        if st.button("Adicionar Produto", disabled=produto_id is None):
             st.session_state["produtos_venda"].append(
                 {
                     "Produto_id": produto_id,
@@ -236,30 +228,29 @@ with tab1:
                         "Adicione pelo menos um produto antes de registar a venda!"
                     )
                 else:
-                    for produto in st.session_state["produtos_venda"]:
-                        add_reuniao(
+                    registada = add_reunioes_batch(
+                        [
                             {
                                 "cliente_id": cliente_id_selecionado,
                                 "data_reuniao": str(data_reuniao),
                                 "descricao": descricao_reuniao,
                                 "houve_venda": "Sim",
-                                "produto_id": produto[
-                                    "Produto_id"
-                                ],  # Corrigido para usar o produto correto
-                                "quantidade_vendida": produto[
-                                    "Quantidade"
-                                ],  # Corrigido para usar a quantidade correta
-                                "preco_vendido": produto[
-                                    "Preço Unitário"
-                                ],  # Corrigido para usar o preço correto
+                                "produto_id": produto["Produto_id"],
+                                "quantidade_vendida": produto["Quantidade"],
+                                "preco_vendido": produto["Preço Unitário"],
                                 "razao_nao_venda": None,
                             }
-                        )
+                            for produto in st.session_state["produtos_venda"]
+                        ]
+                    )
 
-                    st.success("Reunião e vendas registadas com sucesso!", icon="✅")
+                    if registada:
+                        st.success(
+                            "Reunião e vendas registadas com sucesso!", icon="✅"
+                        )
 
-                    # Limpar a lista de produtos
-                    st.session_state["produtos_venda"] = []
+                        # Limpar a lista de produtos
+                        st.session_state["produtos_venda"] = []
 
             elif st.session_state["houve_venda"] == "Não":
                 if not razao_nao_venda.strip():
@@ -351,6 +342,36 @@ with tab2:
                 st.success("Produto adicionado com sucesso!")
                 st.rerun()  # Atualiza a página imediatamente
 
+    with st.expander("Importar ficheiro (CSV/Excel)"):
+        with st.form("importar_ficheiro_form", enter_to_submit=False):
+            entidade_importar = st.selectbox(
+                "Tipo de dados", ["reunioes", "clientes", "produtos", "vendas"]
+            )
+            ficheiro_importar = st.file_uploader(
+                "Ficheiro", type=["csv", "xlsx", "xlsm"]
+            )
+            submeter_importacao = st.form_submit_button("Importar")
+
+            if submeter_importacao and ficheiro_importar is not None:
+                progresso = st.empty()
+                try:
+                    resultado = importar(
+                        entidade_importar,
+                        ficheiro_importar,
+                        nome=ficheiro_importar.name,
+                        progresso=lambda n: progresso.text(f"{n} linhas lidas…"),
+                    )
+                    st.success(
+                        f"{resultado['inseridas']} linhas importadas "
+                        f"({resultado['lidas']} lidas, {resultado['n_erros']} com erros)."
+                    )
+                    if resultado["erros"]:
+                        st.text_area("Linhas rejeitadas", "\n".join(resultado["erros"]))
+                except Exception as e:
+                    st.error(f"Erro ao importar ficheiro: {e}")
+                    st.text_area("Detalhes do erro", traceback.format_exc())
+
+
 
 # if st.button("Clear cache from connection"):
 #     # Clears all st.cache_resource caches:
@@ -7,6 +7,8 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 
+from analitica import consultar
+
 # # Display vendas_a_distribuidores_2024_relatorio_vendas
 # st.header("Vendas a Distribuidores em 2024 (Relatório Fiscal)")
 # distribuidores_2024_data = vendas_a_distribuidores_2024_relatorio_vendas()
@@ -42,20 +44,26 @@ df_meet = pd.DataFrame(
     columns=["Distribuidor", "Vendas_a_Distribuidores"],
 )
 
-
-df = df_meet.merge(df_far, on="Distribuidor", how="outer").fillna(
-    {"Vendas_a_Agricultores": 0}
-)
-
-# Calcular Métricas
-df["Diferença"] = df["Vendas_a_Agricultores"] - df["Vendas_a_Distribuidores"]
-df["Razão"] = df.apply(
-    lambda x: (
-        x.Vendas_a_Agricultores / x.Vendas_a_Distribuidores
-        if x.Vendas_a_Distribuidores > 0
-        else 0
-    ),
-    axis=1,
+# Juntar as duas fontes e calcular as métricas numa só consulta (DuckDB)
+df = consultar(
+    """
+    SELECT
+        COALESCE(m.Distribuidor, f.Distribuidor) AS Distribuidor,
+        m.Vendas_a_Distribuidores,
+        f.ID_Distribuidor,
+        COALESCE(f.Vendas_a_Agricultores, 0) AS Vendas_a_Agricultores,
+        COALESCE(f.Vendas_a_Agricultores, 0) - m.Vendas_a_Distribuidores AS "Diferença",
+        CASE
+            WHEN m.Vendas_a_Distribuidores > 0
+            THEN COALESCE(f.Vendas_a_Agricultores, 0) / m.Vendas_a_Distribuidores
+            ELSE 0
+        END AS "Razão"
+    FROM df_meet m
+    FULL OUTER JOIN df_far f ON f.Distribuidor = m.Distribuidor
+    ORDER BY 1
+    """,
+    df_meet=df_meet,
+    df_far=df_far,
 )
 
 col1, col2 = st.columns([2, 2])
@@ -0,0 +1,63 @@
+"""
+Motor analítico embutido (DuckDB) para as métricas do dashboard e dos distribuidores.
+
+As agregações são SQL vetorizado, executado em paralelo pelos núcleos disponíveis,
+sobre DataFrames em memória (expostos à consulta pelo nome, sem cópia, via Arrow)
+ou diretamente sobre os snapshots Parquet (`snapshot(tabela)`), dos quais só são
+lidas as colunas e partições mensais de que a consulta precisa.
+
+Cada thread (sessão Streamlit, worker) usa o seu cursor da mesma base em memória,
+pelo que os nomes registados por uma consulta não são vistos pelas outras.
+"""
+
+import os
+import threading
+
+import duckdb
+
+import snapshots
+
+_base = duckdb.connect(database=":memory:")
+_local = threading.local()
+
+
+def _cursor():
+    cursor = getattr(_local, "cursor", None)
+    if cursor is None:
+        cursor = _local.cursor = _base.cursor()
+    return cursor
+
+
+def consultar(sql, params=None, **tabelas):
+    """
+    Executa `sql` e devolve o resultado como DataFrame.
+
+    Cada argumento `nome=DataFrame` fica disponível na consulta como a tabela `nome`
+    (só durante esta consulta). `params` são os parâmetros posicionais (`?`).
+    """
+    cursor = _cursor()
+    for nome, df in tabelas.items():
+        cursor.register(nome, df)
+    try:
+        return cursor.execute(sql, params or []).df()
+    finally:
+        for nome in tabelas:
+            cursor.unregister(nome)
+
+
+def snapshot(tabela):
+    """
+    Expressão FROM que lê o snapshot Parquet de `tabela` (ver snapshots.py).
+
+    Nas tabelas particionadas a coluna `mes` ('AAAA-MM') vem do caminho; filtrar
+    por ela evita abrir as restantes partições.
+    """
+    if not snapshots.disponivel(tabela):
+        raise FileNotFoundError(f"Sem snapshot de {tabela} em {snapshots.SNAPSHOT_DIR}")
+    pasta = os.path.join(snapshots.SNAPSHOT_DIR, tabela).replace("'", "''")
+    if snapshots.TABELAS[tabela] is None:
+        return f"read_parquet('{pasta}/dados.parquet')"
+    return (
+        f"read_parquet('{pasta}/*/dados.parquet', hive_partitioning = true, "
+        f"hive_types = {{'{snapshots.COLUNA_PARTICAO}': VARCHAR}})"
+    )
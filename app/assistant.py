@@ -1,23 +1,17 @@
-import json
 import streamlit as st
 import pandas as pd
 
-from llm import (
-    fetch_reunioes,
-    get_segments_report,
-    aggregate_reports,
-    fetch_reunioes_por_distrito,
-    analyze_districts,
-    preprocess_sentiment,
-)
 from db import (
-    insert_llm_general_report,
-    insert_llm_regional_report,
     get_last_general_report,
     get_last_regional_report,
+    get_last_report,
+    get_progresso_tarefa,
+    obter_tarefa,
 )
 
-from chunker import reunioes_to_json_chunks
+from chunker import COMPACT, JSON
+from diretorio import seletor_cliente
+from tarefas import ativa, enfileirar, tipo_relatorio
 
 
 # ─── Configuration ─────────────────────────────────────────────────────────────
@@ -26,18 +20,8 @@ MODEL_OPTIONS = {
     "DeepSeek - 70B (128K)": "deepseek-r1-distill-llama-70b",
 }
 
-
-# ─── Caching DB calls ──────────────────────────────────────────────────────────
-
-
-@st.cache_data(show_spinner=False)
-def load_general_data():
-    return fetch_reunioes()
-
-
-@st.cache_data(show_spinner=False)
-def load_regional_data():
-    return fetch_reunioes_por_distrito()
+# Seconds between progress checks while a report job is running
+POLL_SECS = 2
 
 
 # ─── Shared UI helpers ─────────────────────────────────────────────────────────
@@ -52,6 +36,58 @@ def show_last_report(getter_fn, empty_msg: str):
         st.markdown(df.loc[0, "report"])
 
 
+def follow_job(session_key: str, empty_msg: str):
+    """
+    Show the progress of the report job stored in st.session_state[session_key].
+
+    The job runs in the worker process (`python manutencao.py worker`); this only
+    polls its progress rows, so closing the tab or rerunning loses nothing. While
+    the job is active the panel refreshes itself every POLL_SECS.
+    """
+    job_id = st.session_state.get(session_key)
+    if job_id is None:
+        return
+
+    @st.fragment(run_every=POLL_SECS if ativa(obter_tarefa(job_id)) else None)
+    def panel():
+        job = obter_tarefa(job_id)
+        if job is None:
+            return
+        progress = get_progresso_tarefa(job_id)
+        last = progress[-1] if progress else None
+
+        if job["estado"] == "pendente":
+            label, state = "⏳ Na fila, à espera do worker…", "running"
+        elif job["estado"] == "em_curso":
+            label, state = f"⚙️ {last['mensagem'] if last else 'Em curso'}…", "running"
+            if last and last["total"]:
+                label += f" ({last['feitos']}/{last['total']})"
+        elif job["estado"] == "concluido":
+            label, state = "✅ Relatório gerado", "complete"
+        else:
+            label, state = f"❗ Falhou: {job['erro']}", "error"
+
+        with st.status(label, state=state, expanded=ativa(job)):
+            for row in progress:
+                if row["conteudo"]:
+                    st.markdown(f"**{row['titulo']}**\n\n{row['conteudo']}")
+            # Text still streaming in from the LLM, as of the worker's last write
+            if job["estado"] == "em_curso":
+                for title, text in (job["parcial"] or {}).items():
+                    st.markdown(f"**{title}** ✍️\n\n{text}")
+
+        if job["estado"] == "concluido":
+            show_last_report(lambda: get_last_report(tipo_relatorio(job)), empty_msg)
+
+        # Finished while polling: rerun the page so the panel stops refreshing
+        if not ativa(job) and st.session_state.get(f"{session_key}_active"):
+            st.session_state[f"{session_key}_active"] = False
+            st.rerun()
+        st.session_state[f"{session_key}_active"] = ativa(job)
+
+    panel()
+
+
 # ─── App entrypoint ────────────────────────────────────────────────────────────
 st.title("🔎 Análise de Reuniões com Clientes")
 
@@ -64,7 +100,18 @@ model_name = st.selectbox(
 )
 model_id = MODEL_OPTIONS[model_name]
 
-tab1, tab2 = st.tabs(["📝 Relatório Geral", "🌐 Relatório por Região"])
+# — Payload format —
+compacto = st.toggle(
+    "Formato compacto",
+    value=True,
+    help="Envia os dados em tabelas (clientes + reuniões) em vez de JSON: "
+    "menos tokens, menos pedidos ao LLM e relatórios mais rápidos.",
+)
+formato = COMPACT if compacto else JSON
+
+tab1, tab2, tab3 = st.tabs(
+    ["📝 Relatório Geral", "🌐 Relatório por Região", "👤 Relatório por Cliente"]
+)
 
 # ── Tab 1: General Report ────────────────────────────────────────────────
 with tab1:
@@ -73,35 +120,19 @@ with tab1:
         fetch_last = st.form_submit_button("Obter Último Relatório Geral")
 
     if generate:
-        with st.spinner("A gerar relatório geral…"):
-            try:
-                # 1) Load & preprocess
-                data = load_general_data()
-                df = pd.DataFrame(data)
-                df = preprocess_sentiment(df)
-
-                # 2) Chunk & LLM (auto‑sized per model)
-                records = df.to_dict(orient="records")
-
-                json_chunks = reunioes_to_json_chunks(records)
-
-                segment_reports = get_segments_report(json_chunks)
-
-                # 3) Aggregate & persist
-                final_report = aggregate_reports(segment_reports)
-                insert_llm_general_report(final_report)
-
-                st.success("✅ Relatório gerado com sucesso!")
-                st.markdown(final_report)
-
-            except Exception as e:
-                st.error(f"❗ Erro ao gerar relatório geral: {e}")
+        # Only segments with new/changed meetings go to the LLM; an identical
+        # job already queued or running is joined instead of started again
+        st.session_state["general_job"] = enfileirar(
+            "geral", modelo=model_id, formato=formato
+        )
 
     if fetch_last:
         with st.spinner("⏳ Carregando último relatório…"):
             show_last_report(
                 get_last_general_report, "Nenhum relatório geral disponível."
             )
+    else:
+        follow_job("general_job", "Nenhum relatório geral disponível.")
 
 # ── Tab 2: Regional Report ───────────────────────────────────────────────
 with tab2:
@@ -110,27 +141,40 @@ with tab2:
         fetch_last_r = st.form_submit_button("Obter Último Relatório Regional")
 
     if generate_r:
-        with st.spinner("A gerar relatório regional…"):
-            try:
-                # 1) Load per-district data
-                reg_data = load_regional_data()
-
-                # 2) Analyze & persists
-                district_reports = analyze_districts(reg_data)
-                # Save to db
-                insert_llm_regional_report(district_reports)
-
-                # 3) Display each district
-                for district, report in district_reports.items():
-                    st.subheader(f"📍 Região: {district}")
-                    st.markdown(report)
-                    st.divider()
-
-            except Exception as e:
-                st.error(f"❗ Erro ao gerar relatório regional: {e}")
+        # Only districts with new/changed meetings go to the LLM; each district
+        # shows up in the progress panel as soon as its analysis is ready
+        st.session_state["regional_job"] = enfileirar(
+            "regional", modelo=model_id, formato=formato
+        )
 
     if fetch_last_r:
         with st.spinner("⏳ Carregando último relatório regional…"):
             show_last_report(
                 get_last_regional_report, "Nenhum relatório regional disponível."
             )
+    else:
+        follow_job("regional_job", "Nenhum relatório regional disponível.")
+
+# ── Tab 3: Client Report ─────────────────────────────────────────────────
+with tab3:
+    # The search box must rerun as the user types, so it stays outside the form
+    cliente_id = seletor_cliente(chave="cliente_relatorio")
+    with st.form("client_report_form"):
+        generate_c = st.form_submit_button("Gerar Relatório do Cliente")
+        fetch_last_c = st.form_submit_button("Obter Último Relatório do Cliente")
+
+    if (generate_c or fetch_last_c) and cliente_id is None:
+        st.warning("Selecione um cliente.")
+    elif generate_c:
+        st.session_state["client_job"] = enfileirar(
+            "cliente", cliente_id=cliente_id, modelo=model_id, formato=formato
+        )
+
+    if fetch_last_c and cliente_id is not None:
+        with st.spinner("⏳ Carregando último relatório do cliente…"):
+            show_last_report(
+                lambda: get_last_report(f"cliente:{cliente_id}"),
+                "Nenhum relatório disponível para este cliente.",
+            )
+    else:
+        follow_job("client_job", "Nenhum relatório disponível para este cliente.")
@@ -0,0 +1,127 @@
+"""
+Cache em memória para as funções de leitura de db.py.
+
+Cada função decorada tem o seu TTL e um conjunto de etiquetas (fixas ou
+calculadas a partir dos argumentos). As funções de escrita chamam
+`invalidate(...)` com as etiquetas que tornam obsoletas, depois do commit,
+para que ninguém veja dados antigos a seguir à sua própria escrita.
+
+O cache é partilhado por todas as sessões do processo Streamlit. Os valores
+devolvidos são partilhados: quem os recebe não os deve alterar.
+
+O cache (e por isso `invalidate`) é só deste processo: as escritas feitas noutro
+(o worker e a CLI de `manutencao.py`) não o invalidam, e o Streamlit continua a
+servir os valores antigos até o TTL expirar. As leituras de dados escritos por
+esses processos não devem ser decoradas, ou devem ter TTLs curtos.
+
+Tem no máximo MAX_ENTRADAS entradas: ao gravar, as expiradas são removidas (no
+máximo a cada INTERVALO_LIMPEZA segundos) e, acima do limite, as usadas há mais
+tempo.
+"""
+
+import functools
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+MAX_ENTRADAS = int(os.getenv("CACHE_MAX_ENTRADAS", 2048))
+INTERVALO_LIMPEZA = 60
+
+_lock = threading.Lock()
+_entradas = OrderedDict()  # chave -> (expira_em, valor, etiquetas), usada há mais tempo primeiro
+_limpo_em = 0.0
+_chaves_por_etiqueta = defaultdict(set)  # etiqueta -> {chave}
+_versoes = defaultdict(int)  # etiqueta -> nº de invalidações
+_geracao = 0  # incrementada por clear()
+
+
+def _remover(chave):
+    """Tira a entrada do cache e dos índices das suas etiquetas (chamar com o lock)."""
+    entrada = _entradas.pop(chave, None)
+    if entrada is None:
+        return
+    for e in entrada[2]:
+        chaves = _chaves_por_etiqueta.get(e)
+        if chaves is not None:
+            chaves.discard(chave)
+            if not chaves:
+                del _chaves_por_etiqueta[e]
+
+
+def _limitar(agora):
+    """Remove as entradas expiradas e, acima de MAX_ENTRADAS, as menos usadas (com o lock)."""
+    global _limpo_em
+    if agora - _limpo_em >= INTERVALO_LIMPEZA:
+        _limpo_em = agora
+        for chave in [c for c, entrada in _entradas.items() if entrada[0] <= agora]:
+            _remover(chave)
+    while len(_entradas) > MAX_ENTRADAS:
+        _remover(next(iter(_entradas)))
+
+
+def _etiquetas_de(tags, args, kwargs):
+    return tuple(tags(*args, **kwargs)) if callable(tags) else tuple(tags)
+
+
+def cached(ttl, tags=()):
+    """
+    Decora uma função de leitura com cache por argumentos.
+
+    `ttl` em segundos. `tags` é um tuplo de etiquetas ou uma função que recebe os
+    mesmos argumentos da função decorada e devolve as etiquetas da entrada.
+    Resultados `None` (erro já reportado pela função) não ficam em cache.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            chave = (func.__module__, func.__qualname__, args, tuple(sorted(kwargs.items())))
+            etiquetas = _etiquetas_de(tags, args, kwargs)
+            with _lock:
+                entrada = _entradas.get(chave)
+                if entrada is not None and entrada[0] > time.monotonic():
+                    _entradas.move_to_end(chave)
+                    return entrada[1]
+                versoes = (_geracao, [_versoes[e] for e in etiquetas])
+
+            valor = func(*args, **kwargs)
+            if valor is None:
+                return valor
+
+            with _lock:
+                # Se houve uma escrita durante a leitura, o valor pode já estar obsoleto
+                if versoes == (_geracao, [_versoes[e] for e in etiquetas]):
+                    agora = time.monotonic()
+                    _remover(chave)
+                    _entradas[chave] = (agora + ttl, valor, etiquetas)
+                    for e in etiquetas:
+                        _chaves_por_etiqueta[e].add(chave)
+                    _limitar(agora)
+            return valor
+
+        return wrapper
+
+    return decorator
+
+
+def invalidate(*etiquetas):
+    """
+    Remove do cache todas as entradas com alguma das etiquetas indicadas.
+
+    Só neste processo (ver o início do módulo).
+    """
+    with _lock:
+        for e in etiquetas:
+            _versoes[e] += 1
+            for chave in list(_chaves_por_etiqueta.get(e, ())):
+                _remover(chave)
+
+
+def clear():
+    """Esvazia o cache por completo."""
+    global _geracao
+    with _lock:
+        _geracao += 1
+        _entradas.clear()
+        _chaves_por_etiqueta.clear()
@@ -1,36 +1,298 @@
-import json, math
-from typing import List, Dict, Any
+import json
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Union
+
 import tiktoken
 
 ENC = tiktoken.get_encoding("cl100k_base")
-CHUNK_TARGET = 2_000  # a third of the token budget
 
+# Packing strategies
+SEQUENTIAL = "sequential"  # keep record order (contiguous id ranges)
+GROUPED = "grouped"  # keep records sharing a key (cliente_id, distrito, ...) together
+BINPACK = "binpack"  # first-fit decreasing: fewest chunks, hence fewest LLM calls
+STRATEGIES = (SEQUENTIAL, GROUPED, BINPACK)
+
+# Payload formats
+JSON = "json"  # a JSON array of objects
+COMPACT = "compact"  # header + tab-separated rows, client attributes in a lookup table
+FORMATS = (JSON, COMPACT)
+
+# In the compact format these per-client fields are written once per client
+CLIENT_KEY = "cliente_id"
+CLIENT_FIELDS = ("client_name", "distrito", "cultura", "area_culturas")
+
+# json.dumps(list) == "[" + ", ".join(items) + "]"
+_SEPARATOR = ", "
+_SEPARATOR_TOKENS = len(ENC.encode(_SEPARATOR))
+_BRACKET_TOKENS = len(ENC.encode("[]"))
+
+
+def _count(texts: Sequence[str]) -> List[int]:
+    return [len(tokens) for tokens in ENC.encode_batch(list(texts))] if texts else []
+
+
+class Chunk(NamedTuple):
+    indices: List[int]  # positions in the input records
+    text: str  # the payload sent to the model
+    tokens: int  # exact token count of `text`
+
+
+class _Group:
+    """A chunk being packed: its records, its token total and the clients it lists."""
+
+    __slots__ = ("members", "tokens", "clients")
+
+    def __init__(self, base: int):
+        self.members: List[int] = []
+        self.tokens = base
+        self.clients = set()
+
+    def copy(self) -> "_Group":
+        other = _Group(self.tokens)
+        other.members = list(self.members)
+        other.clients = set(self.clients)
+        return other
 
-def reunioes_to_json_chunks(records: List[Dict[str, Any]]) -> List[str]:
+
+class _JsonLayout:
+    """Records as a JSON array; each record is serialized once."""
+
+    def __init__(self, records: Sequence[Dict[str, Any]]):
+        self.texts = [
+            json.dumps(rec, default=str, ensure_ascii=False) for rec in records
+        ]
+        self.counts = _count(self.texts)
+        self.base = _BRACKET_TOKENS
+
+    def size(self, i: int) -> int:
+        return self.counts[i]
+
+    def delta(self, group: _Group, i: int) -> int:
+        return self.counts[i] + (_SEPARATOR_TOKENS if group.members else 0)
+
+    def add(self, group: _Group, i: int) -> None:
+        group.tokens += self.delta(group, i)
+        group.members.append(i)
+
+    def render(self, members: Sequence[int]) -> str:
+        return "[" + _SEPARATOR.join(self.texts[i] for i in members) + "]"
+
+
+def _cell(value: Any) -> str:
+    if value is None or (isinstance(value, float) and value != value):
+        return ""
+    if isinstance(value, bool):
+        return "yes" if value else "no"
+    return str(value).replace("\t", " ").replace("\r", " ").replace("\n", " ").strip()
+
+
+def _line(values: Sequence[Any]) -> str:
+    return "\t".join(_cell(v) for v in values) + "\n"
+
+
+class _CompactLayout:
     """
-    Split list of dicts into JSON strings, each ≤ CHUNK_TARGET tokens.
+    Records as tab-separated tables: a `clients` lookup (one row per client with
+    CLIENT_FIELDS) and a `meetings` table referencing it by cliente_id. Columns
+    that are null in every record are dropped; null cells are left empty.
     """
-    chunks, current, cur_tok = [], [], 0
-
-    for rec in records:
-        j = json.dumps(rec, default=str, ensure_ascii=False)
-        t = len(ENC.encode(j))
-
-        # if the record alone is bigger than target, flush current & keep as single
-        if t > CHUNK_TARGET:
-            if current:
-                chunks.append(json.dumps(current, default=str, ensure_ascii=False))
-                current, cur_tok = [], 0
-            chunks.append(json.dumps([rec], default=str, ensure_ascii=False))
+
+    def __init__(self, records: Sequence[Dict[str, Any]]):
+        columns = list(dict.fromkeys(k for rec in records for k in rec))
+        filled = {k for rec in records for k, v in rec.items() if _cell(v) != ""}
+        columns = [k for k in columns if k in filled or k == CLIENT_KEY]
+
+        self.by_client = CLIENT_KEY in columns
+        client_cols = (
+            [CLIENT_KEY] + [k for k in CLIENT_FIELDS if k in columns]
+            if self.by_client
+            else []
+        )
+        row_cols = [k for k in columns if k not in client_cols[1:]]
+
+        self.client_of = [rec.get(CLIENT_KEY) for rec in records]
+        self.rows = [_line([rec.get(k) for k in row_cols]) for rec in records]
+        self.client_rows = {}
+        if self.by_client:
+            for rec in records:
+                c = rec.get(CLIENT_KEY)
+                if c not in self.client_rows:
+                    self.client_rows[c] = _line([rec.get(k) for k in client_cols])
+
+        self.clients_head = "clients\n" + _line(client_cols) if self.by_client else ""
+        self.rows_head = "meetings\n" + _line(row_cols)
+
+        client_keys = list(self.client_rows)
+        counts = _count(
+            self.rows
+            + [self.client_rows[c] for c in client_keys]
+            + [self.clients_head, self.rows_head]
+        )
+        n = len(self.rows)
+        self.counts = counts[:n]
+        self.client_counts = dict(zip(client_keys, counts[n : n + len(client_keys)]))
+        self.base = sum(counts[n + len(client_keys) :])
+
+    def size(self, i: int) -> int:
+        return self.counts[i] + self.client_counts.get(self.client_of[i], 0)
+
+    def delta(self, group: _Group, i: int) -> int:
+        c = self.client_of[i]
+        if not self.by_client or c in group.clients:
+            return self.counts[i]
+        return self.counts[i] + self.client_counts[c]
+
+    def add(self, group: _Group, i: int) -> None:
+        group.tokens += self.delta(group, i)
+        group.members.append(i)
+        if self.by_client:
+            group.clients.add(self.client_of[i])
+
+    def render(self, members: Sequence[int]) -> str:
+        clients = (
+            dict.fromkeys(self.client_of[i] for i in members) if self.by_client else {}
+        )
+        return (
+            self.clients_head
+            + "".join(self.client_rows[c] for c in clients)
+            + self.rows_head
+            + "".join(self.rows[i] for i in members)
+        )
+
+
+_LAYOUTS = {JSON: _JsonLayout, COMPACT: _CompactLayout}
+
+
+def _pack_sequential(layout, order: Sequence[int], budget: int):
+    groups, current = [], _Group(layout.base)
+    for i in order:
+        if current.members and current.tokens + layout.delta(current, i) > budget:
+            groups.append(current.members)
+            current = _Group(layout.base)
+        # A record bigger than the budget on its own still gets a group of its own
+        layout.add(current, i)
+    if current.members:
+        groups.append(current.members)
+    return groups
+
+
+def _pack_grouped(
+    layout, keys: Sequence[Any], budget: int, max_keys: Optional[int] = None
+):
+    by_key = defaultdict(list)
+    for i, k in enumerate(keys):
+        by_key[k].append(i)
+
+    groups, current, n_keys = [], _Group(layout.base), 0
+    for members in by_key.values():
+        alone = _Group(layout.base)
+        for i in members:
+            layout.add(alone, i)
+        if alone.tokens > budget:
+            # Too big for one chunk: split it on its own, without mixing in other keys
+            groups += _pack_sequential(layout, members, budget)
             continue
+        merged = current.copy()
+        for i in members:
+            layout.add(merged, i)
+        if current.members and (
+            merged.tokens > budget or (max_keys is not None and n_keys >= max_keys)
+        ):
+            groups.append(current.members)
+            current, n_keys = alone, 1
+        else:
+            current, n_keys = merged, n_keys + 1
+    if current.members:
+        groups.append(current.members)
+    return groups
+
+
+def _pack_binpack(layout, n: int, budget: int):
+    bins: List[_Group] = []
+    for i in sorted(range(n), key=lambda i: -layout.size(i)):
+        for group in bins:
+            if group.tokens + layout.delta(group, i) <= budget:
+                layout.add(group, i)
+                break
+        else:
+            group = _Group(layout.base)
+            layout.add(group, i)
+            bins.append(group)
+    # Records keep their original relative order inside each chunk
+    return [sorted(group.members) for group in bins]
 
-        if cur_tok + t > CHUNK_TARGET:
-            chunks.append(json.dumps(current, default=str, ensure_ascii=False))
-            current, cur_tok = [], 0
 
-        current.append(rec)
-        cur_tok += t
+def chunk_records(
+    records: Sequence[Dict[str, Any]],
+    budget: int,
+    *,
+    strategy: str = SEQUENTIAL,
+    key: Optional[Union[str, Callable[[Dict[str, Any]], Any]]] = None,
+    max_keys: Optional[int] = None,
+    fmt: str = JSON,
+) -> List[Chunk]:
+    """
+    Pack records into chunks of at most `budget` tokens each.
+
+    • `strategy` is one of SEQUENTIAL, GROUPED (needs `key`: a field name or a
+      callable; `max_keys` caps the distinct keys per chunk) or BINPACK.
+    • `fmt` is JSON (byte-identical to json.dumps of the chunk's records) or
+      COMPACT (see `_CompactLayout`); packing is measured in that format.
+    • Every record is serialized exactly once; the chunk text is assembled from
+      those pieces.
+    • `Chunk.tokens` is the exact count of the assembled text. A multi-record
+      chunk whose exact count still exceeds the budget (token merges across
+      record boundaries) is split further. A single record bigger than the
+      budget is returned on its own.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown chunking strategy: {strategy!r}")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown payload format: {fmt!r}")
+    if not records:
+        return []
 
-    if current:
-        chunks.append(json.dumps(current, default=str, ensure_ascii=False))
+    layout = _LAYOUTS[fmt](records)
+    if strategy == SEQUENTIAL:
+        groups = _pack_sequential(layout, range(len(records)), budget)
+    elif strategy == GROUPED:
+        if key is None:
+            raise ValueError("The grouped strategy needs a key")
+        get_key = key if callable(key) else (lambda rec: rec.get(key))
+        groups = _pack_grouped(
+            layout, [get_key(rec) for rec in records], budget, max_keys
+        )
+    else:
+        groups = _pack_binpack(layout, len(records), budget)
+
+    # (position in packing order, split path) keeps split halves in place
+    done = []
+    pending = [((n,), group) for n, group in enumerate(groups)]
+    while pending:
+        chunk_texts = [layout.render(group) for _, group in pending]
+        exact = _count(chunk_texts)
+        retry = []
+        for (rank, group), text, tokens in zip(pending, chunk_texts, exact):
+            if tokens > budget and len(group) > 1:
+                half = len(group) // 2
+                retry += [(rank + (0,), group[:half]), (rank + (1,), group[half:])]
+            else:
+                done.append((rank, Chunk(list(group), text, tokens)))
+        pending = retry
+
+    chunks = [chunk for _, chunk in sorted(done, key=lambda item: item[0])]
     return chunks
+
+
+def chunk_indices(
+    records: Sequence[Dict[str, Any]], budget: int, **kwargs
+) -> List[List[int]]:
+    """Record positions of each chunk (see `chunk_records`)."""
+    return [c.indices for c in chunk_records(records, budget, **kwargs)]
+
+
+def encode_records(records: Sequence[Dict[str, Any]], fmt: str = JSON) -> str:
+    """The whole list as a single payload in the given format."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown payload format: {fmt!r}")
+    return _LAYOUTS[fmt](records).render(range(len(records)))
@@ -1,11 +1,18 @@
 import streamlit as st
 import psycopg2
 from psycopg2 import pool
+from psycopg2.extras import execute_values
 import pandas as pd
 from dotenv import load_dotenv
 import os
+import itertools
+import json
+import threading
 import time
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+from cache import cached, invalidate
 
 # Carregar variáveis do .env
 load_dotenv()
@@ -22,107 +29,496 @@ DB_NAME = os.getenv("DB_NAME")
 DSN = f"dbname={DB_NAME} user={DB_USER} password={DB_PASSWORD} host={DB_HOST} port={DB_PORT}"
 
 
-# Criar um pool de conexões (min=1, max=10)
+# Tabelas auxiliares mantidas pela aplicação (criadas se ainda não existirem)
+_SCHEMA_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS resumo_vendas_mensal (
+        mes date,
+        cliente_id integer NOT NULL,
+        produto_id integer,
+        distrito text,
+        supplier_id integer,
+        visitas integer NOT NULL,
+        conversoes integer NOT NULL,
+        receita numeric NOT NULL
+    )
+    """,
+    # `mes` nulo: as reuniões sem data, que também contam nos totais
+    "ALTER TABLE resumo_vendas_mensal ALTER COLUMN mes DROP NOT NULL",
+    "CREATE INDEX IF NOT EXISTS resumo_vendas_mensal_cliente_mes_idx ON resumo_vendas_mensal (cliente_id, mes)",
+    "CREATE INDEX IF NOT EXISTS resumo_vendas_mensal_mes_idx ON resumo_vendas_mensal (mes)",
+    """
+    CREATE TABLE IF NOT EXISTS llm_analises_parciais (
+        tipo text NOT NULL,
+        contexto text NOT NULL,
+        chave text NOT NULL,
+        marca text,
+        n_reunioes integer NOT NULL,
+        analise text NOT NULL,
+        atualizado_em timestamptz NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (tipo, contexto, chave)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS reunioes_sentimento (
+        reuniao_id integer PRIMARY KEY,
+        marca text,
+        sentimento text NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS llm_tarefas (
+        id bigserial PRIMARY KEY,
+        tipo text NOT NULL,
+        parametros jsonb NOT NULL DEFAULT '{}'::jsonb,
+        chave text NOT NULL,
+        estado text NOT NULL DEFAULT 'pendente',
+        resultado jsonb,
+        erro text,
+        criado_em timestamptz NOT NULL DEFAULT NOW(),
+        iniciado_em timestamptz,
+        atualizado_em timestamptz NOT NULL DEFAULT NOW(),
+        terminado_em timestamptz
+    )
+    """,
+    # Texto que ainda está a chegar do LLM (título → texto), enquanto a tarefa corre
+    "ALTER TABLE llm_tarefas ADD COLUMN IF NOT EXISTS parcial jsonb",
+    # Uma só tarefa pendente/em curso por (tipo, parâmetros): pedidos repetidos juntam-se a ela
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS llm_tarefas_ativas_uq ON llm_tarefas (chave)
+    WHERE estado IN ('pendente', 'em_curso')
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS llm_tarefas_progresso (
+        id bigserial PRIMARY KEY,
+        tarefa_id bigint NOT NULL REFERENCES llm_tarefas (id) ON DELETE CASCADE,
+        criado_em timestamptz NOT NULL DEFAULT NOW(),
+        mensagem text NOT NULL,
+        feitos integer,
+        total integer,
+        titulo text,
+        conteudo text
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS llm_tarefas_progresso_tarefa_idx ON llm_tarefas_progresso (tarefa_id, id)",
+    # Chave de cliente normalizada (sem as plicas vindas do Excel) e indexada nas sugestões
+    """
+    DO $$
+    BEGIN
+        IF to_regclass('sugestoes_para_clientes_by_llm') IS NOT NULL THEN
+            ALTER TABLE sugestoes_para_clientes_by_llm
+                ADD COLUMN IF NOT EXISTS numero_cliente_norm text
+                GENERATED ALWAYS AS (REPLACE(numero_cliente, '''', '')) STORED;
+            CREATE INDEX IF NOT EXISTS sugestoes_numero_cliente_norm_idx
+                ON sugestoes_para_clientes_by_llm (numero_cliente_norm, id);
+        END IF;
+    END $$
+    """,
+    "CREATE INDEX IF NOT EXISTS clientes_numero_cliente_idx ON clientes (numero_cliente)",
+    # Índices de trigramas para a pesquisa de clientes/produtos por nome (ILIKE '%texto%');
+    # sem permissões para a extensão a pesquisa continua a funcionar, só sem índice
+    """
+    DO $$
+    BEGIN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    EXCEPTION WHEN OTHERS THEN
+        RAISE NOTICE 'pg_trgm indisponível: %', SQLERRM;
+    END $$
+    """,
+    """
+    DO $$
+    BEGIN
+        IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+            CREATE INDEX IF NOT EXISTS clientes_name_trgm_idx
+                ON clientes USING gin (name gin_trgm_ops);
+            CREATE INDEX IF NOT EXISTS produtos_ref_trgm_idx
+                ON produtos USING gin (ref gin_trgm_ops);
+        END IF;
+    END $$
+    """,
+]
+
+
+def _ensure_schema(conn):
+    """Cria as tabelas auxiliares e preenche o resumo mensal se estiver vazio."""
+    try:
+        with conn.cursor() as cur:
+            for ddl in _SCHEMA_DDL:
+                cur.execute(ddl)
+            cur.execute(
+                """SELECT NOT EXISTS (SELECT 1 FROM resumo_vendas_mensal)
+                          AND EXISTS (SELECT 1 FROM reunioes)"""
+            )
+            if cur.fetchone()[0]:
+                cur.execute(_RESUMO_MENSAL_INSERT)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+# Limites do pool (configuráveis no .env)
+POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+# Segundos à espera de uma conexão livre antes de desistir
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+# Conexões mais antigas do que isto são fechadas e substituídas
+POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", 1800))
+# Conexões paradas há mais do que isto são testadas (SELECT 1) antes de sair do pool
+POOL_CHECK_AFTER_IDLE = float(os.getenv("DB_POOL_CHECK_AFTER_IDLE", 30))
+
+
+class PoolTimeout(pool.PoolError):
+    """Nenhuma conexão ficou livre dentro do tempo de espera."""
+
+
+class ConnectionPool:
+    """
+    Pool de conexões thread-safe.
+
+    • `getconn` espera (até `timeout` segundos) por uma conexão livre em vez de
+      falhar quando as `maxconn` estão ocupadas;
+    • à saída, uma conexão parada há mais de `check_after_idle` segundos é testada
+      com `SELECT 1`, e uma com mais de `max_lifetime` segundos é substituída;
+    • `putconn` termina a transação deixada aberta e descarta (fecha) a conexão se
+      estiver fechada, num estado desconhecido, ou se `discard=True`.
+    """
+
+    def __init__(
+        self,
+        minconn,
+        maxconn,
+        dsn,
+        timeout=POOL_TIMEOUT,
+        max_lifetime=POOL_MAX_LIFETIME,
+        check_after_idle=POOL_CHECK_AFTER_IDLE,
+    ):
+        self.maxconn = maxconn
+        self.dsn = dsn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_after_idle = check_after_idle
+        self._cond = threading.Condition()
+        self._idle = []  # [(conn, devolvida_em)], a mais recente no fim
+        self._created = {}  # id(conn) -> criada_em, das conexões abertas
+        self._opening = 0  # lugares reservados para conexões a abrir
+        self._closed = False
+        for _ in range(minconn):
+            self._opening += 1
+            self._idle.append((self._open(), time.monotonic()))
+
+    def _discard(self, conn):
+        """Fecha a conexão e liberta o seu lugar (chamar com o lock)."""
+        self._created.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._cond.notify()
+
+    def _expired(self, conn, now):
+        return now - self._created.get(id(conn), now) > self.max_lifetime
+
+    def _alive(self, conn):
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _open(self):
+        """Abre uma conexão no lugar reservado (em `_opening`) por quem a pediu."""
+        try:
+            conn = psycopg2.connect(dsn=self.dsn)
+        except Exception:
+            with self._cond:
+                self._opening -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._opening -= 1
+            self._created[id(conn)] = time.monotonic()
+        return conn
+
+    def getconn(self, timeout=None):
+        """Obtém uma conexão válida, esperando até `timeout` segundos por uma livre."""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                if self._closed:
+                    raise pool.PoolError("connection pool is closed")
+                while (
+                    not self._idle
+                    and len(self._created) + self._opening >= self.maxconn
+                ):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(
+                            f"sem conexões livres ao fim de {timeout:g}s "
+                            f"({self.maxconn} ocupadas)"
+                        )
+                    self._cond.wait(remaining)
+                    if self._closed:
+                        raise pool.PoolError("connection pool is closed")
+                if not self._idle:
+                    self._opening += 1
+                    conn = None
+                else:
+                    conn, returned_at = self._idle.pop()
+                    now = time.monotonic()
+                    if conn.closed or self._expired(conn, now):
+                        self._discard(conn)
+                        continue
+                    check = now - returned_at > self.check_after_idle
+
+            if conn is None:
+                return self._open()
+            if not check or self._alive(conn):
+                return conn
+            with self._cond:
+                self._discard(conn)
+
+    def putconn(self, conn, discard=False):
+        """Devolve a conexão ao pool, ou fecha-a se estiver inutilizável."""
+        if not discard and not conn.closed:
+            try:
+                status = conn.info.transaction_status
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    discard = True
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        with self._cond:
+            if (
+                discard
+                or conn.closed
+                or self._closed
+                or self._expired(conn, time.monotonic())
+            ):
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def closeall(self):
+        """Fecha as conexões livres; as emprestadas são fechadas ao ser devolvidas."""
+        with self._cond:
+            self._closed = True
+            for conn, _ in self._idle:
+                self._discard(conn)
+            self._idle = []
+            self._cond.notify_all()
+
+
+# Um único pool por processo, partilhado pelas sessões e pelas threads do dashboard
 @st.cache_resource
 def get_connection_pool():
-    """Cria um pool de conexões reutilizáveis."""
-    return pool.SimpleConnectionPool(1, 10, dsn=DSN)
+    """Cria o pool de conexões e garante as tabelas auxiliares."""
+    connection_pool = ConnectionPool(POOL_MIN, POOL_MAX, dsn=DSN)
+    conn = connection_pool.getconn()
+    try:
+        _ensure_schema(conn)
+    finally:
+        connection_pool.putconn(conn)
+    return connection_pool
 
 
-def get_connection():
-    """Obtém uma conexão do pool."""
+@contextmanager
+def conexao(timeout=None):
+    """
+    Empresta uma conexão do pool durante o bloco `with` e devolve-a no fim.
+
+    Uma transação deixada aberta é revertida ao devolver; se o bloco falhar com
+    OperationalError/InterfaceError (conexão perdida), a conexão é descartada.
+    """
     connection_pool = get_connection_pool()
-    return connection_pool.getconn()
+    conn = connection_pool.getconn(timeout)
+    descartar = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        descartar = True
+        raise
+    finally:
+        connection_pool.putconn(conn, discard=descartar)
 
 
-def release_connection(conn):
-    """Devolve a conexão de volta ao pool."""
-    connection_pool = get_connection_pool()
-    connection_pool.putconn(conn)
+# Linhas por ida ao servidor nas leituras em streaming
+LOTE_STREAMING = 2000
+FORMATOS_LOTE = ("linhas", "registos", "dataframe")
+_cursores_servidor = itertools.count()
+
+
+def iterar_lotes(sql, params=None, lote=LOTE_STREAMING, formato="linhas"):
+    """
+    Executa `sql` num cursor do lado do servidor e devolve o resultado aos lotes.
+
+    Só `lote` linhas de cada vez passam para o cliente. `formato` é "linhas"
+    (listas de tuplos), "registos" (listas de dicts) ou "dataframe" (DataFrames).
+    A conexão fica ocupada até o iterador se esgotar ou ser fechado.
+
+    A memória só fica limitada a um lote se quem consome também o for: os
+    snapshots escrevem lote a lote, mas o dashboard (`painel.base_resumo`, já
+    reduzido aos tipos finais), o relatório geral e as sugestões juntam o
+    resultado inteiro, porque precisam dele todo antes de partir os segmentos.
+    """
+    if formato not in FORMATOS_LOTE:
+        raise ValueError(f"Formato de lote inválido: {formato}")
+    with conexao() as conn:
+        try:
+            # Cursor com nome = cursor no servidor (DECLARE ... CURSOR), dentro da transação
+            with conn.cursor(name=f"streaming_{next(_cursores_servidor)}") as cur:
+                cur.itersize = lote
+                cur.execute(sql, params)
+                while True:
+                    linhas = cur.fetchmany(lote)
+                    if not linhas:
+                        break
+                    if formato == "linhas":
+                        yield linhas
+                        continue
+                    colunas = [desc[0] for desc in cur.description]
+                    if formato == "registos":
+                        yield [dict(zip(colunas, linha)) for linha in linhas]
+                    else:
+                        yield pd.DataFrame(linhas, columns=colunas)
+        finally:
+            # Só leitura: termina a transação do cursor antes de devolver a conexão
+            conn.rollback()
 
 
 # ---------------------------- Funções de leitura ---------------------------------
+@cached(ttl=600, tags=("clientes",))
 def get_clientes():
     """Obtém a lista de clientes."""
-    conn = get_connection()
-    try:
+    with conexao() as conn:
         with conn.cursor() as cur:
             cur.execute("SELECT * FROM clientes ORDER BY name;")
             return cur.fetchall()
-    finally:
-        release_connection(conn)
 
 
 def get_max_cliente():
     """Obtém o maior número de cliente."""
-    conn = get_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("SELECT numero_cliente FROM clientes;")
-            return cur.fetchall()
-    except psycopg2.InterfaceError:
-        st.error("Erro: Conexão com a base de dados foi fechada inesperadamente.")
-        return "Erro"
-    except Exception as e:
-        st.error(f"Erro ao obter número máximo de cliente: {e}")
-        return "Erro"
-    finally:
-        release_connection(conn)
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT numero_cliente FROM clientes;")
+                return cur.fetchall()
+        except psycopg2.InterfaceError:
+            st.error("Erro: Conexão com a base de dados foi fechada inesperadamente.")
+            return "Erro"
+        except Exception as e:
+            st.error(f"Erro ao obter número máximo de cliente: {e}")
+            return "Erro"
 
 
+@cached(ttl=600, tags=("produtos",))
 def get_produtos():
     """Obtém a lista de produtos."""
-    conn = get_connection()
-    try:
+    with conexao() as conn:
         with conn.cursor() as cur:
             cur.execute("SELECT produto_id, ref FROM produtos ORDER BY ref;")
             return cur.fetchall()
-    finally:
-        release_connection(conn)
 
 
+@cached(ttl=600, tags=("produtos",))
 def get_all_produtos():
     """Obtém todos os produtos."""
-    conn = get_connection()
-    try:
+    with conexao() as conn:
         with conn.cursor() as cur:
             cur.execute("SELECT * FROM produtos ORDER BY ref;")
             return cur.fetchall()
-    finally:
-        release_connection(conn)
 
 
+@cached(ttl=600, tags=("clientes",))
+def get_diretorio_clientes():
+    """Obtém (id, nome, número de cliente, distrito) de todos os clientes."""
+    with conexao() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT id, name, numero_cliente, distrito FROM clientes ORDER BY name, id;"
+            )
+            return cur.fetchall()
+
+
+def _padrao_pesquisa(texto):
+    """Texto escapado para ILIKE: '%texto%' (contém) e 'texto%' (começa por)."""
+    texto = texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{texto}%", f"{texto}%"
+
+
+@cached(ttl=120, tags=("clientes",))
+def procurar_clientes(texto, limite=20):
+    """
+    Ids dos clientes cujo nome contém `texto` ou cujo número começa por `texto`.
+
+    Os nomes que começam por `texto` vêm primeiro; sem texto devolve os primeiros
+    `limite` clientes por nome.
+    """
+    contem, comeca = _padrao_pesquisa(texto.strip())
+    with conexao() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT id FROM clientes
+                WHERE name ILIKE %(contem)s OR numero_cliente::text ILIKE %(comeca)s
+                ORDER BY name ILIKE %(comeca)s DESC, name, id
+                LIMIT %(limite)s;
+                """,
+                {"contem": contem, "comeca": comeca, "limite": limite},
+            )
+            return [row[0] for row in cur.fetchall()]
+
+
+@cached(ttl=120, tags=("produtos",))
+def procurar_produtos(texto, limite=20):
+    """Ids dos produtos cuja referência contém `texto` (as que começam por ele primeiro)."""
+    contem, comeca = _padrao_pesquisa(texto.strip())
+    with conexao() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT produto_id FROM produtos
+                WHERE ref ILIKE %(contem)s
+                ORDER BY ref ILIKE %(comeca)s DESC, ref, produto_id
+                LIMIT %(limite)s;
+                """,
+                {"contem": contem, "comeca": comeca, "limite": limite},
+            )
+            return [row[0] for row in cur.fetchall()]
+
+
+@cached(ttl=300, tags=lambda cliente_id: (f"reunioes:cliente:{cliente_id}",))
 def get_ultimas_reunioes(cliente_id):
     """Obtém as últimas reuniões de um cliente."""
-    conn = get_connection()
-    try:
+    with conexao() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 "SELECT * FROM reunioes WHERE cliente_id = %s ORDER BY data_reuniao DESC LIMIT 5;",
                 (cliente_id,),
             )
             return cur.fetchall() or []
-    finally:
-        release_connection(conn)
 
 
+@cached(ttl=300, tags=("reunioes",))
 def get_ultimas_reunioes_geral():
     """Obtém as últimas reuniões de todos os clientes por ordem de criação"""
-    conn = get_connection()
-    try:
+    with conexao() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 "SELECT * FROM reunioes ORDER BY data_criacao_linha DESC LIMIT 20;"
             )
             return cur.fetchall() or []
-    finally:
-        release_connection(conn)
 
 
+@cached(ttl=300, tags=("reunioes",))
 def get_all_reunioes():
     """Obtém todas as reuniões de todos os clientes por ordem de criação"""
-    conn = get_connection()
-    try:
+    with conexao() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """SELECT 
@@ -135,64 +531,61 @@ def get_all_reunioes():
                 """
             )
             return cur.fetchall() or []
-    finally:
-        release_connection(conn)
-
-
-def get_all_reunioes_para_vizualizacao():
-    """Obtém todas as reuniões de todos os clientes"""
-    conn = get_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                """SELECT *
-                    FROM reunioes r
-                    JOIN clientes c ON c.id = r.cliente_id
-                """
-            )
-            return cur.fetchall() or []
-    finally:
-        release_connection(conn)
 
 
 def get_last_general_report():
     """Obtém o último general report gerado por LLM"""
-    conn = get_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                """SELECT *
-                    FROM llm_reports
-                    WHERE type = 'general'
-                    ORDER BY created_at DESC
-                    LIMIT 1
-                """
-            )
-            return cur.fetchall() or []
-    except:
-        st.error("Não existem relatório disponíveis")
-    finally:
-        release_connection(conn)
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """SELECT *
+                        FROM llm_reports
+                        WHERE type = 'general'
+                        ORDER BY created_at DESC
+                        LIMIT 1
+                    """
+                )
+                return cur.fetchall() or []
+        except:
+            st.error("Não existem relatório disponíveis")
+
+
+def get_last_report(report_type):
+    """Obtém o último report gerado por LLM de um tipo (ex.: 'cliente:42')"""
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """SELECT *
+                        FROM llm_reports
+                        WHERE type = %s
+                        ORDER BY created_at DESC
+                        LIMIT 1
+                    """,
+                    (report_type,),
+                )
+                return cur.fetchall() or []
+        except:
+            st.error("Não existem relatório disponíveis")
 
 
 def get_last_regional_report():
     """Obtém o último regional report gerado por LLM"""
-    conn = get_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute(
-                """SELECT *
-                    FROM llm_reports
-                    WHERE TYPE = 'regional'
-                    ORDER BY created_at DESC
-                    LIMIT 1
-                """
-            )
-            return cur.fetchall() or []
-    except:
-        st.error("Não existem relatório disponíveis")
-    finally:
-        release_connection(conn)
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """SELECT *
+                        FROM llm_reports
+                        WHERE TYPE = 'regional'
+                        ORDER BY created_at DESC
+                        LIMIT 1
+                    """
+                )
+                return cur.fetchall() or []
+        except:
+            st.error("Não existem relatório disponíveis")
 
 
 # ---------------------------- Funções de escrita ---------------------------------
@@ -200,209 +593,733 @@ def get_last_regional_report():
 
 def add_cliente(cliente_data):
     """Adiciona um novo cliente com transação."""
-    conn = get_connection()
-    try:
-        with conn.cursor() as cur:
-            cur.execute("BEGIN;")  # Iniciar transação
-            cur.execute(
-                """
-                INSERT INTO clientes (name, numero_cliente, cod_postal, tipo_cliente, distrito, latitude, longitude, data_criacao_linha,supplier_id)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, NOW(), %s)
-                RETURNING id;
-                """,
-                (
-                    cliente_data["name"],
-                    cliente_data["numero_cliente"],
-                    cliente_data["cod_postal"],
-                    cliente_data["tipo_cliente"],
-                    cliente_data["distrito"],
-                    cliente_data["latitude"],
-                    cliente_data["longitude"],
-                    cliente_data["distribuidor"],
-                ),
-            )
-            cliente_id = cur.fetchone()[0]
-            conn.commit()  # Confirmar transação
-            return cliente_id
-    except Exception as e:
-        conn.rollback()  # Reverter em caso de erro
-        st.error(f"Erro ao adicionar cliente: {e}")
-    finally:
-        release_connection(conn)
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("BEGIN;")  # Iniciar transação
+                cur.execute(
+                    """
+                    INSERT INTO clientes (name, numero_cliente, cod_postal, tipo_cliente, distrito, latitude, longitude, data_criacao_linha,supplier_id)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, NOW(), %s)
+                    RETURNING id;
+                    """,
+                    (
+                        cliente_data["name"],
+                        cliente_data["numero_cliente"],
+                        cliente_data["cod_postal"],
+                        cliente_data["tipo_cliente"],
+                        cliente_data["distrito"],
+                        cliente_data["latitude"],
+                        cliente_data["longitude"],
+                        cliente_data["distribuidor"],
+                    ),
+                )
+                cliente_id = cur.fetchone()[0]
+                conn.commit()  # Confirmar transação
+                invalidate("clientes")
+                return cliente_id
+        except Exception as e:
+            conn.rollback()  # Reverter em caso de erro
+            st.error(f"Erro ao adicionar cliente: {e}")
 
 
 def add_produto(ref):
     """Adiciona um novo produto com transação."""
-    conn = get_connection()
-    try:
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("BEGIN;")
+                cur.execute(
+                    "INSERT INTO produtos (ref, data_criacao_linha) VALUES (%s, NOW()) RETURNING produto_id;",
+                    (ref,),
+                )
+                produto_id = cur.fetchone()[0]
+                conn.commit()
+                invalidate("produtos")
+                return produto_id
+        except Exception as e:
+            conn.rollback()
+            st.error(f"Erro ao adicionar produto: {e}")
+
+
+def add_reuniao(reuniao):
+    """Registra uma nova reunião com transação."""
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("BEGIN;")
+                cur.execute(
+                    """
+                    INSERT INTO reunioes (cliente_id, data_reuniao, descricao, houve_venda, produto_id, 
+                    quantidade_vendida, preco_vendido, razao_nao_venda, data_criacao_linha, ultima_atualizacao)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+                    RETURNING cliente_id, data_reuniao
+                    """,
+                    (
+                        reuniao["cliente_id"],
+                        reuniao["data_reuniao"],
+                        reuniao["descricao"],
+                        reuniao["houve_venda"],
+                        reuniao["produto_id"],
+                        reuniao["quantidade_vendida"],
+                        reuniao["preco_vendido"],
+                        reuniao["razao_nao_venda"],
+                    ),
+                )
+                chave = cur.fetchone()
+                atualizar_resumo_mensal(cur, [chave])
+                conn.commit()
+                invalidate("reunioes", f"reunioes:cliente:{chave[0]}")
+                st.success("Reunião registada com sucesso!", icon="✅")
+        except Exception as e:
+            conn.rollback()
+            st.error(f"Erro ao registrar reunião: {e}")
+
+
+def add_reunioes_batch(reunioes):
+    """
+    Regista todas as linhas de uma reunião (uma por produto) numa só transação.
+
+    As linhas são inseridas com um único INSERT multi-linha (execute_values); se
+    alguma falhar, nenhuma fica registada. Devolve True em caso de sucesso.
+    """
+    if not reunioes:
+        return True
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("BEGIN;")
+                chaves = execute_values(
+                    cur,
+                    """
+                    INSERT INTO reunioes (cliente_id, data_reuniao, descricao, houve_venda, produto_id,
+                    quantidade_vendida, preco_vendido, razao_nao_venda, data_criacao_linha, ultima_atualizacao)
+                    VALUES %s
+                    RETURNING cliente_id, data_reuniao
+                    """,
+                    [
+                        (
+                            reuniao["cliente_id"],
+                            reuniao["data_reuniao"],
+                            reuniao["descricao"],
+                            reuniao["houve_venda"],
+                            reuniao["produto_id"],
+                            reuniao["quantidade_vendida"],
+                            reuniao["preco_vendido"],
+                            reuniao["razao_nao_venda"],
+                        )
+                        for reuniao in reunioes
+                    ],
+                    template="(%s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())",
+                    page_size=len(reunioes),
+                    fetch=True,
+                )
+                atualizar_resumo_mensal(cur, chaves)
+                conn.commit()
+                invalidate("reunioes", *{f"reunioes:cliente:{c}" for c, _ in chaves})
+                return True
+        except Exception as e:
+            conn.rollback()
+            st.error(f"Erro ao registrar reunião: {e}")
+            return False
+
+
+def update_reuniao(
+    reuniao_id, descricao, houve_venda, razao_nao_venda, produto_id, quantidade, preco
+):
+    """Atualiza os detalhes de uma reunião existente com transação."""
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("BEGIN;")
+                cur.execute(
+                    """
+                    UPDATE reunioes
+                    SET descricao = %s, houve_venda = %s, razao_nao_venda = %s,
+                        produto_id = %s, quantidade_vendida = %s, preco_vendido = %s,
+                        ultima_atualizacao = NOW()
+                    WHERE id = %s
+                    RETURNING cliente_id, data_reuniao
+                    """,
+                    (
+                        descricao,
+                        houve_venda,
+                        razao_nao_venda,
+                        int(produto_id) if pd.notna(produto_id) else None,
+                        int(quantidade) if pd.notna(quantidade) else None,
+                        float(preco) if pd.notna(preco) else None,
+                        int(reuniao_id),
+                    ),
+                )
+                chaves = cur.fetchall()
+                atualizar_resumo_mensal(cur, chaves)
+                conn.commit()
+                invalidate("reunioes", *(f"reunioes:cliente:{c}" for c, _ in chaves))
+                st.success("Reunião atualizada com sucesso!", icon="✅")
+        except Exception as e:
+            conn.rollback()
+            st.error(f"Erro ao atualizar reunião: {e}")
+
+
+def insert_llm_general_report(final_report: str, report_type: str = "general"):
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("BEGIN;")
+                cur.execute(
+                    """
+                    INSERT INTO llm_reports (created_at, type, report)
+                    VALUES (%s, %s, %s)
+                    """,
+                    (datetime.now(), report_type, final_report),
+                )
+                conn.commit()
+        except Exception as e:
+            conn.rollback()
+            st.error(f"Erro ao registrar report: {e}")
+
+
+def insert_llm_regional_report(final_report: str, report_type: str = "regional"):
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("BEGIN;")
+                cur.execute(
+                    """
+                    INSERT INTO llm_reports (created_at, type, report)
+                    VALUES (%s, %s, %s)
+                    """,
+                    (datetime.now(), report_type, final_report),
+                )
+                conn.commit()
+                st.success("Report registado com sucesso!", icon="✅")
+        except Exception as e:
+            conn.rollback()
+            st.error(f"Erro ao registrar report: {e}")
+
+
+def get_analises_parciais(tipo, contexto):
+    """
+    Obtém as análises parciais guardadas (segmentos ou distritos) de um relatório LLM.
+
+    Devolve {chave: (marca, n_reunioes, analise)}; `contexto` identifica o modelo e
+    formato com que foram geradas, para não reutilizar análises de outra configuração.
+    """
+    with conexao() as conn:
         with conn.cursor() as cur:
-            cur.execute("BEGIN;")
             cur.execute(
-                "INSERT INTO produtos (ref, data_criacao_linha) VALUES (%s, NOW()) RETURNING produto_id;",
-                (ref,),
+                """SELECT chave, marca, n_reunioes, analise
+                    FROM llm_analises_parciais
+                    WHERE tipo = %s AND contexto = %s
+                """,
+                (tipo, contexto),
             )
-            produto_id = cur.fetchone()[0]
-            conn.commit()
-            return produto_id
-    except Exception as e:
-        conn.rollback()
-        st.error(f"Erro ao adicionar produto: {e}")
-    finally:
-        release_connection(conn)
+            return {chave: (marca, n, analise) for chave, marca, n, analise in cur.fetchall()}
 
 
-def add_reuniao(reuniao):
-    """Registra uma nova reunião com transação."""
-    conn = get_connection()
-    try:
+def guardar_analises_parciais(tipo, contexto, linhas, remover=()):
+    """
+    Grava (upsert) análises parciais e remove as chaves em `remover`, numa transação.
+
+    `linhas` é uma lista de (chave, marca, n_reunioes, analise).
+    """
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("BEGIN;")
+                if remover:
+                    cur.execute(
+                        """DELETE FROM llm_analises_parciais
+                            WHERE tipo = %s AND contexto = %s AND chave = ANY(%s)
+                        """,
+                        (tipo, contexto, list(remover)),
+                    )
+                if linhas:
+                    execute_values(
+                        cur,
+                        """
+                        INSERT INTO llm_analises_parciais (tipo, contexto, chave, marca, n_reunioes, analise)
+                        VALUES %s
+                        ON CONFLICT (tipo, contexto, chave) DO UPDATE
+                        SET marca = EXCLUDED.marca, n_reunioes = EXCLUDED.n_reunioes,
+                            analise = EXCLUDED.analise, atualizado_em = NOW()
+                        """,
+                        [(tipo, contexto, *linha) for linha in linhas],
+                    )
+                conn.commit()
+        except Exception as e:
+            conn.rollback()
+            st.error(f"Erro ao guardar análises parciais: {e}")
+
+
+def get_sentimentos(reuniao_ids):
+    """Obtém as classificações de sentimento guardadas: {reuniao_id: (marca, sentimento)}."""
+    if not reuniao_ids:
+        return {}
+    with conexao() as conn:
         with conn.cursor() as cur:
-            cur.execute("BEGIN;")
             cur.execute(
-                """
-                INSERT INTO reunioes (cliente_id, data_reuniao, descricao, houve_venda, produto_id, 
-                quantidade_vendida, preco_vendido, razao_nao_venda, data_criacao_linha, ultima_atualizacao)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
+                """SELECT reuniao_id, marca, sentimento
+                    FROM reunioes_sentimento
+                    WHERE reuniao_id = ANY(%s)
                 """,
-                (
-                    reuniao["cliente_id"],
-                    reuniao["data_reuniao"],
-                    reuniao["descricao"],
-                    reuniao["houve_venda"],
-                    reuniao["produto_id"],
-                    reuniao["quantidade_vendida"],
-                    reuniao["preco_vendido"],
-                    reuniao["razao_nao_venda"],
-                ),
+                (list(reuniao_ids),),
             )
-            conn.commit()
-            st.success("Reunião registada com sucesso!", icon="✅")
-    except Exception as e:
-        conn.rollback()
-        st.error(f"Erro ao registrar reunião: {e}")
-    finally:
-        release_connection(conn)
+            return {rid: (marca, sentimento) for rid, marca, sentimento in cur.fetchall()}
 
 
-def update_reuniao(
-    reuniao_id, descricao, houve_venda, razao_nao_venda, produto_id, quantidade, preco
-):
-    """Atualiza os detalhes de uma reunião existente com transação."""
-    conn = get_connection()
-    try:
+def guardar_sentimentos(linhas):
+    """Grava (upsert) classificações de sentimento: lista de (reuniao_id, marca, sentimento)."""
+    if not linhas:
+        return
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("BEGIN;")
+                execute_values(
+                    cur,
+                    """
+                    INSERT INTO reunioes_sentimento (reuniao_id, marca, sentimento)
+                    VALUES %s
+                    ON CONFLICT (reuniao_id) DO UPDATE
+                    SET marca = EXCLUDED.marca, sentimento = EXCLUDED.sentimento
+                    """,
+                    linhas,
+                    page_size=1000,
+                )
+                conn.commit()
+        except Exception as e:
+            conn.rollback()
+            st.error(f"Erro ao guardar sentimentos: {e}")
+
+
+# ---------------------------- Tarefas LLM em segundo plano ---------------------------------
+
+TAREFA_ATIVA = ("pendente", "em_curso")
+
+
+def _chave_tarefa(tipo, parametros):
+    return f"{tipo}:{json.dumps(parametros, sort_keys=True, default=str)}"
+
+
+def enfileirar_tarefa(tipo, parametros):
+    """
+    Enfileira uma tarefa LLM e devolve o seu id. Se já existir uma tarefa igual
+    pendente ou em curso, não cria outra e devolve o id dessa.
+    """
+    chave = _chave_tarefa(tipo, parametros)
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("BEGIN;")
+                cur.execute(
+                    """
+                    INSERT INTO llm_tarefas (tipo, parametros, chave)
+                    VALUES (%s, %s, %s)
+                    ON CONFLICT (chave) WHERE estado IN ('pendente', 'em_curso') DO NOTHING
+                    RETURNING id
+                    """,
+                    (tipo, json.dumps(parametros, default=str), chave),
+                )
+                row = cur.fetchone()
+                if row is None:
+                    cur.execute(
+                        """SELECT id FROM llm_tarefas
+                            WHERE chave = %s AND estado IN ('pendente', 'em_curso')
+                        """,
+                        (chave,),
+                    )
+                    row = cur.fetchone()
+                conn.commit()
+                # Se a tarefa igual terminou entretanto, cria-se uma nova
+                return row[0] if row is not None else enfileirar_tarefa(tipo, parametros)
+        except Exception as e:
+            conn.rollback()
+            st.error(f"Erro ao enfileirar tarefa: {e}")
+
+
+def obter_tarefa(tarefa_id):
+    """Obtém o estado de uma tarefa LLM (dict), ou None se não existir."""
+    with conexao() as conn:
         with conn.cursor() as cur:
-            cur.execute("BEGIN;")
             cur.execute(
-                """
-                UPDATE reunioes
-                SET descricao = %s, houve_venda = %s, razao_nao_venda = %s,
-                    produto_id = %s, quantidade_vendida = %s, preco_vendido = %s,
-                    ultima_atualizacao = NOW()
-                WHERE id = %s
+                """SELECT id, tipo, parametros, estado, resultado, erro, parcial,
+                          criado_em, iniciado_em, atualizado_em, terminado_em
+                    FROM llm_tarefas
+                    WHERE id = %s
                 """,
-                (
-                    descricao,
-                    houve_venda,
-                    razao_nao_venda,
-                    int(produto_id) if pd.notna(produto_id) else None,
-                    int(quantidade) if pd.notna(quantidade) else None,
-                    float(preco) if pd.notna(preco) else None,
-                    int(reuniao_id),
-                ),
+                (tarefa_id,),
             )
-            conn.commit()
-            st.success("Reunião atualizada com sucesso!", icon="✅")
-    except Exception as e:
-        conn.rollback()
-        st.error(f"Erro ao atualizar reunião: {e}")
-    finally:
-        release_connection(conn)
+            row = cur.fetchone()
+            if row is None:
+                return None
+            return dict(zip([d[0] for d in cur.description], row))
 
 
-def insert_llm_general_report(final_report: str, report_type: str = "general"):
-    conn = get_connection()
-    try:
+def get_progresso_tarefa(tarefa_id):
+    """Obtém as linhas de progresso de uma tarefa LLM, pela ordem em que foram escritas."""
+    with conexao() as conn:
         with conn.cursor() as cur:
-            cur.execute("BEGIN;")
             cur.execute(
-                """
-                INSERT INTO llm_reports (created_at, type, report)
-                VALUES (%s, %s, %s)
+                """SELECT id, criado_em, mensagem, feitos, total, titulo, conteudo
+                    FROM llm_tarefas_progresso
+                    WHERE tarefa_id = %s
+                    ORDER BY id
                 """,
-                (datetime.now(), report_type, final_report),
+                (tarefa_id,),
             )
-            conn.commit()
-    except Exception as e:
-        conn.rollback()
-        st.error(f"Erro ao registrar report: {e}")
-    finally:
-        release_connection(conn)
+            cols = [d[0] for d in cur.description]
+            return [dict(zip(cols, row)) for row in cur.fetchall()]
 
 
-def insert_llm_regional_report(final_report: str, report_type: str = "regional"):
-    conn = get_connection()
-    try:
+def get_tarefas_recentes(limite=20):
+    """Obtém as últimas tarefas LLM."""
+    with conexao() as conn:
         with conn.cursor() as cur:
-            cur.execute("BEGIN;")
             cur.execute(
-                """
-                INSERT INTO llm_reports (created_at, type, report)
-                VALUES (%s, %s, %s)
+                """SELECT id, tipo, parametros, estado, erro, criado_em, terminado_em
+                    FROM llm_tarefas
+                    ORDER BY id DESC
+                    LIMIT %s
                 """,
-                (datetime.now(), report_type, final_report),
+                (limite,),
             )
-            conn.commit()
-            st.success("Report registado com sucesso!", icon="✅")
-    except Exception as e:
-        conn.rollback()
-        st.error(f"Erro ao registrar report: {e}")
+            cols = [d[0] for d in cur.description]
+            return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+
+def reservar_tarefa(prazo_minutos):
+    """
+    Reserva a tarefa pendente mais antiga para o worker e devolve (id, tipo, parametros),
+    ou None. Uma tarefa em curso sem sinal de vida há mais de `prazo_minutos`
+    (worker que morreu) volta a ser reservável.
+    """
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("BEGIN;")
+                cur.execute(
+                    """
+                    UPDATE llm_tarefas
+                    SET estado = 'em_curso', iniciado_em = NOW(), atualizado_em = NOW()
+                    WHERE id = (
+                        SELECT id FROM llm_tarefas
+                        WHERE estado = 'pendente'
+                           OR (estado = 'em_curso'
+                               AND atualizado_em < NOW() - %s * INTERVAL '1 minute')
+                        ORDER BY id
+                        FOR UPDATE SKIP LOCKED
+                        LIMIT 1
+                    )
+                    RETURNING id, tipo, parametros
+                    """,
+                    (prazo_minutos,),
+                )
+                row = cur.fetchone()
+                conn.commit()
+                return row
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def registar_progresso(
+    tarefa_id, mensagem, feitos=None, total=None, titulo=None, conteudo=None
+):
+    """Acrescenta uma linha de progresso a uma tarefa (e conta como sinal de vida)."""
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("BEGIN;")
+                cur.execute(
+                    """
+                    INSERT INTO llm_tarefas_progresso
+                        (tarefa_id, mensagem, feitos, total, titulo, conteudo)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    """,
+                    (tarefa_id, mensagem, feitos, total, titulo, conteudo),
+                )
+                cur.execute(
+                    "UPDATE llm_tarefas SET atualizado_em = NOW() WHERE id = %s",
+                    (tarefa_id,),
+                )
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def registar_parcial(tarefa_id, parcial):
+    """Substitui o texto parcial ({título: texto}) de uma tarefa (e conta como sinal de vida)."""
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("BEGIN;")
+                cur.execute(
+                    """
+                    UPDATE llm_tarefas SET parcial = %s, atualizado_em = NOW()
+                    WHERE id = %s
+                    """,
+                    (json.dumps(parcial) if parcial else None, tarefa_id),
+                )
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def concluir_tarefa(tarefa_id, resultado=None, erro=None):
+    """Marca uma tarefa como concluída (ou falhada, se houver `erro`)."""
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("BEGIN;")
+                cur.execute(
+                    """
+                    UPDATE llm_tarefas
+                    SET estado = %s, resultado = %s, erro = %s, parcial = NULL,
+                        terminado_em = NOW(), atualizado_em = NOW()
+                    WHERE id = %s
+                    """,
+                    (
+                        "falhado" if erro is not None else "concluido",
+                        json.dumps(resultado, default=str) if resultado is not None else None,
+                        erro,
+                        tarefa_id,
+                    ),
+                )
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+def manter_tarefa_viva(tarefa_id, parar, intervalo=60, log=print):
+    """
+    Atualiza o sinal de vida de uma tarefa a cada `intervalo` segundos até `parar`
+    (threading.Event) ser ativado. Corre numa thread com ligação própria, fora do pool.
+
+    Uma falha (ligação perdida, base indisponível) não termina a thread: a ligação
+    é reaberta no ciclo seguinte. Sem sinal de vida durante o prazo de reserva, a
+    tarefa voltaria à fila e seria executada duas vezes.
+    """
+    conn = None
+    try:
+        while not parar.wait(intervalo):
+            try:
+                if conn is None or conn.closed:
+                    conn = psycopg2.connect(dsn=DSN)
+                with conn.cursor() as cur:
+                    cur.execute(
+                        "UPDATE llm_tarefas SET atualizado_em = NOW() WHERE id = %s",
+                        (tarefa_id,),
+                    )
+                conn.commit()
+            except psycopg2.Error as e:
+                log(f"Tarefa {tarefa_id}: falha no sinal de vida ({e}); nova tentativa.")
+                if conn is not None:
+                    conn.close()
+                conn = None
     finally:
-        release_connection(conn)
+        if conn is not None:
+            conn.close()
+
+
+# ---------------------------- Resumo mensal de vendas ---------------------------------
+# Agregado por mês × cliente × produto × distrito × distribuidor, mantido em
+# incremental por add_reuniao/update_reuniao e reconstruível com rebuild_resumo_mensal.
+
+_RESUMO_MENSAL_INSERT = """
+    INSERT INTO resumo_vendas_mensal
+        (mes, cliente_id, produto_id, distrito, supplier_id, visitas, conversoes, receita)
+    SELECT
+        date_trunc('month', r.data_reuniao)::date AS mes,
+        r.cliente_id,
+        r.produto_id,
+        c.distrito,
+        r.supplier_id,
+        COUNT(r.houve_venda) AS visitas,
+        COUNT(*) FILTER (WHERE r.houve_venda = 'Sim') AS conversoes,
+        COALESCE(SUM(r.quantidade_vendida * r.preco_vendido), 0) AS receita
+    FROM reunioes r
+    JOIN clientes c ON c.id = r.cliente_id
+    WHERE TRUE {filtro}
+    GROUP BY 1, 2, 3, 4, 5
+"""
+
+
+def atualizar_resumo_mensal(cur, chaves):
+    """
+    Recalcula as linhas do resumo mensal para os pares (cliente_id, data_reuniao) dados.
+
+    Corre no cursor (e transação) de quem escreveu em `reunioes`, para que o resumo
+    nunca fique dessincronizado da tabela de factos. Uma data nula refere-se às
+    reuniões sem data do cliente (a linha com `mes` nulo).
+    """
+    chaves = set(chaves)
+    if not chaves:
+        return
+    clientes_ids = [cliente_id for cliente_id, _ in chaves]
+    datas = [data for _, data in chaves]
+    filtro = """
+        AND EXISTS (
+            SELECT 1
+            FROM unnest(%(clientes)s::int[], %(datas)s::date[]) AS k(cliente_id, data)
+            WHERE k.cliente_id = r.cliente_id
+              AND date_trunc('month', k.data)::date
+                  IS NOT DISTINCT FROM date_trunc('month', r.data_reuniao)::date
+        )
+    """
+    params = {"clientes": clientes_ids, "datas": datas}
+    # Serializa as escritas concorrentes no mesmo (cliente, mês): sem isto, duas
+    # transações podem não ver a linha agregada uma da outra e ambas ficam.
+    # Bloqueios pedidos por ordem, para não haver deadlocks entre lotes.
+    cur.execute(
+        """
+        SELECT pg_advisory_xact_lock(k.cliente_id, k.mes)
+        FROM (
+            SELECT DISTINCT
+                k.cliente_id,
+                COALESCE(
+                    (extract(year FROM k.data) * 100 + extract(month FROM k.data))::int, 0
+                ) AS mes
+            FROM unnest(%(clientes)s::int[], %(datas)s::date[]) AS k(cliente_id, data)
+            ORDER BY 1, 2
+        ) k
+        """,
+        params,
+    )
+    cur.execute(
+        """
+        DELETE FROM resumo_vendas_mensal s
+        WHERE EXISTS (
+            SELECT 1
+            FROM unnest(%(clientes)s::int[], %(datas)s::date[]) AS k(cliente_id, data)
+            WHERE k.cliente_id = s.cliente_id
+              AND date_trunc('month', k.data)::date IS NOT DISTINCT FROM s.mes
+        )
+        """,
+        params,
+    )
+    cur.execute(_RESUMO_MENSAL_INSERT.format(filtro=filtro), params)
+
+
+def rebuild_resumo_mensal():
+    """Reconstrói todo o resumo mensal a partir de `reunioes` (para backfills)."""
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("BEGIN;")
+                cur.execute("TRUNCATE resumo_vendas_mensal;")
+                cur.execute(_RESUMO_MENSAL_INSERT.format(filtro=""))
+                linhas = cur.rowcount
+                conn.commit()
+                invalidate("reunioes")
+                return linhas
+        except Exception:
+            conn.rollback()
+            raise
 
 
 # ---------------------------- Funções para Métricas ---------------------------------
-def get_taxa_de_conversao():
-    """Obtém as taxas de conversão de todas as vendas por distrito"""
-    conn = get_connection()
-    try:
+def iterar_resumo_mensal(lote=LOTE_STREAMING):
+    """
+    Obtém o resumo mensal de vendas com os atributos do cliente e do produto, em
+    DataFrames de `lote` linhas.
+
+    Colunas: mes, cliente_id, name, produto_id, ref, distrito, cultura,
+    responsavel_principal, visitas, conversoes, receita. `distrito` é o do resumo;
+    cultura e responsável vêm do cliente.
+    """
+    return iterar_lotes(
+        """
+        SELECT
+            s.mes,
+            s.cliente_id,
+            c.name,
+            s.produto_id,
+            p.ref,
+            s.distrito,
+            c.cultura,
+            c.responsavel_principal,
+            s.visitas,
+            s.conversoes,
+            s.receita::float8 AS receita
+        FROM resumo_vendas_mensal s
+        LEFT JOIN clientes c ON c.id = s.cliente_id
+        LEFT JOIN produtos p ON p.produto_id = s.produto_id
+        """,
+        lote=lote,
+        formato="dataframe",
+    )
+
+
+@cached(ttl=300, tags=("reunioes",))
+def get_metricas_mes_a_mes(ano, mes, dia):
+    """
+    Obtém as métricas do mês indicado e do mês anterior numa só consulta.
+
+    Lê diretamente de `reunioes` (o corte ao dia não existe no resumo mensal), mas
+    apenas o intervalo de dois meses, que o filtro em data_reuniao delimita.
+
+    Devolve (receita_atual, receita_anterior, visitas_atual, convertidas_atual,
+    visitas_anterior, convertidas_anterior). As receitas consideram o mês inteiro;
+    as visitas consideram apenas os dias até `dia`, para comparar períodos equivalentes.
+    """
+    inicio_atual = date(ano, mes, 1)
+    inicio_anterior = date(ano - 1, 12, 1) if mes == 1 else date(ano, mes - 1, 1)
+    inicio_seguinte = date(ano + 1, 1, 1) if mes == 12 else date(ano, mes + 1, 1)
+    corte_atual = min(inicio_atual + timedelta(days=dia), inicio_seguinte)
+    corte_anterior = min(inicio_anterior + timedelta(days=dia), inicio_atual)
+
+    with conexao() as conn:
         with conn.cursor() as cur:
             cur.execute(
-                """ with cte1 as (
-                    SELECT c.distrito, count(*) as numero_de_visitas_convertidas
-                    FROM reunioes r
-                    JOIN clientes c ON c.id = r.cliente_id
-                    where houve_venda = 'Sim'
-                    group by c.distrito
-                ), cte2 as (
-                SELECT c.distrito, count(*) as numero_de_visitas
+                """
+                SELECT
+                    COALESCE(SUM(r.quantidade_vendida * r.preco_vendido)
+                        FILTER (WHERE r.data_reuniao >= %(inicio_atual)s), 0)::float8,
+                    COALESCE(SUM(r.quantidade_vendida * r.preco_vendido)
+                        FILTER (WHERE r.data_reuniao < %(inicio_atual)s), 0)::float8,
+                    COUNT(r.houve_venda)
+                        FILTER (WHERE r.data_reuniao >= %(inicio_atual)s AND r.data_reuniao < %(corte_atual)s),
+                    COUNT(*)
+                        FILTER (WHERE r.data_reuniao >= %(inicio_atual)s AND r.data_reuniao < %(corte_atual)s
+                                AND r.houve_venda = 'Sim'),
+                    COUNT(r.houve_venda)
+                        FILTER (WHERE r.data_reuniao < %(corte_anterior)s),
+                    COUNT(*)
+                        FILTER (WHERE r.data_reuniao < %(corte_anterior)s AND r.houve_venda = 'Sim')
                 FROM reunioes r
                 JOIN clientes c ON c.id = r.cliente_id
-                group by c.distrito
-                )
-
-            SELECT cte1.distrito, cte2.numero_de_visitas, cte1.numero_de_visitas_convertidas
-            from cte1
-            join cte2 on cte1.distrito = cte2.distrito
-                """
+                WHERE r.data_reuniao >= %(inicio_anterior)s
+                  AND r.data_reuniao < %(inicio_seguinte)s
+                """,
+                {
+                    "inicio_anterior": inicio_anterior,
+                    "inicio_atual": inicio_atual,
+                    "inicio_seguinte": inicio_seguinte,
+                    "corte_atual": corte_atual,
+                    "corte_anterior": corte_anterior,
+                },
             )
-            return cur.fetchall() or []
-    finally:
-        release_connection(conn)
+            return cur.fetchone()
 
 
 # ---------------------------- Funções para leitura de métricas para fornecedores ---------------------------------
 
 
+@cached(ttl=300, tags=("reunioes",))
 def vendas_a_agricultores_para_distribuidores():
     """Quanto é que foi vendido a agricultores e que foi parar a estes distribuidores"""
-    conn = get_connection()
-    try:
+    with conexao() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
                 SELECT 
                     distribuidor,
                     d.distribuidor_id,
-                    COALESCE(SUM((quantidade_vendida*preco_vendido)),0) AS total_vendas
+                    COALESCE(SUM((quantidade_vendida*preco_vendido)),0)::float8 AS total_vendas
                 FROM reunioes r
                 full JOIN distribuidores d ON r.supplier_id = d.distribuidor_id
                 where distribuidor is not null
@@ -410,14 +1327,12 @@ def vendas_a_agricultores_para_distribuidores():
                 """
             )
             return cur.fetchall() or []
-    finally:
-        release_connection(conn)
 
 
+@cached(ttl=3600, tags=("vendas",))
 def vendas_a_distribuidores_2024_relatorio_vendas():
     """Quanto é que foi vendido a distribuidores em 2024. Informação vai ser proveniente do relatório fiscal de vendas a distribuidores"""
-    conn = get_connection()
-    try:
+    with conexao() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -433,14 +1348,12 @@ def vendas_a_distribuidores_2024_relatorio_vendas():
                 """
             )
             return cur.fetchall() or []
-    finally:
-        release_connection(conn)
 
 
+@cached(ttl=300, tags=("reunioes",))
 def vendas_a_distribuidores_relatorio_reunioes():
     """Quanto é que foi vendido a distribuidores. Informação vai ser proveniente doa tabela de registo de reuniões"""
-    conn = get_connection()
-    try:
+    with conexao() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -470,7 +1383,7 @@ def vendas_a_distribuidores_relatorio_reunioes():
                                         )
                                         SELECT
                                         l.name,
-                                        COALESCE(v.total_vendas, 0) AS total_vendas
+                                        COALESCE(v.total_vendas, 0)::float8 AS total_vendas
                                         FROM lista l
                                         LEFT JOIN vendas_por_cliente v
                                         ON v.name = l.name
@@ -478,24 +1391,129 @@ def vendas_a_distribuidores_relatorio_reunioes():
                 """
             )
             return cur.fetchall() or []
-    finally:
-        release_connection(conn)
 
 
-def get_sugestao_de_vendas():
-    """Obtém o último regional report gerado por LLM"""
-    conn = get_connection()
-    try:
+def _filtro_sugestoes(clientes=None, distritos=None):
+    condicoes, params = [], {}
+    if clientes:
+        condicoes.append("c.id = ANY(%(clientes)s)")
+        params["clientes"] = list(clientes)
+    if distritos:
+        condicoes.append("c.distrito = ANY(%(distritos)s)")
+        params["distritos"] = list(distritos)
+    return condicoes, params
+
+
+def get_sugestoes(clientes=None, distritos=None, antes_de=None, limite=20):
+    """
+    Obtém uma página de sugestões de venda, uma linha por sugestão, das mais recentes
+    para as mais antigas. Paginação por keyset: `antes_de` é o id da última sugestão
+    da página anterior.
+    """
+    condicoes, params = _filtro_sugestoes(clientes, distritos)
+    if antes_de is not None:
+        condicoes.append("s.id < %(antes_de)s")
+        params["antes_de"] = antes_de
+    where = ("WHERE " + " AND ".join(condicoes)) if condicoes else ""
+    limit = ""
+    if limite is not None:
+        limit = "LIMIT %(limite)s"
+        params["limite"] = limite
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""SELECT s.id, s.created_at, c.name, c.distrito, c.cultura, c.area_culturas,
+                               s.sugestao_de_venda
+                        FROM sugestoes_para_clientes_by_llm s
+                        JOIN clientes c ON c.numero_cliente::text = s.numero_cliente_norm
+                        {where}
+                        ORDER BY s.id DESC
+                        {limit}
+                    """,
+                    params,
+                )
+                return cur.fetchall() or []
+        except psycopg2.Error as e:
+            st.error(f"Erro ao obter sugestões: {e}")
+            return []
+
+
+def contar_sugestoes(clientes=None, distritos=None):
+    """Conta as sugestões de venda que passam os filtros."""
+    condicoes, params = _filtro_sugestoes(clientes, distritos)
+    where = ("WHERE " + " AND ".join(condicoes)) if condicoes else ""
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"""SELECT COUNT(*)
+                        FROM sugestoes_para_clientes_by_llm s
+                        JOIN clientes c ON c.numero_cliente::text = s.numero_cliente_norm
+                        {where}
+                    """,
+                    params,
+                )
+                return cur.fetchone()[0]
+        except psycopg2.Error as e:
+            st.error(f"Erro ao contar sugestões: {e}")
+            return 0
+
+
+def get_filtros_sugestoes():
+    """
+    Clientes (id, nome) e distritos que têm sugestões de venda, para os filtros.
+
+    Sem cache: as sugestões são gravadas pelo worker (outro processo), cujo
+    `invalidate` não chega ao cache desta aplicação.
+    """
+    with conexao() as conn:
         with conn.cursor() as cur:
             cur.execute(
-                """SELECT s.id , s.created_at, c.name, c.distrito,c.cultura,c.area_culturas,s.sugestao_de_venda
-                    FROM reunioes r
-                    JOIN clientes c ON c.id = r.cliente_id
-                    JOIN sugestoes_para_clientes_by_llm s ON REPLACE(s.numero_cliente, '''', '') = c.numero_cliente
+                """SELECT DISTINCT c.id, c.name, c.distrito
+                    FROM sugestoes_para_clientes_by_llm s
+                    JOIN clientes c ON c.numero_cliente::text = s.numero_cliente_norm
+                    ORDER BY c.name
                 """
             )
-            return cur.fetchall() or []
-    except:
-        st.error("Não existem sugestões disponíveis")
-    finally:
-        release_connection(conn)
+            rows = cur.fetchall()
+            clientes = [(cid, nome) for cid, nome, _ in rows]
+            distritos = sorted({d for _, _, d in rows if d is not None})
+            return clientes, distritos
+
+
+def guardar_sugestoes(linhas):
+    """
+    Substitui, numa só transação, as sugestões dos clientes indicados:
+    lista de (numero_cliente, sugestao). Devolve o nº de sugestões gravadas.
+    """
+    if not linhas:
+        return 0
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("BEGIN;")
+                cur.execute(
+                    """DELETE FROM sugestoes_para_clientes_by_llm
+                        WHERE numero_cliente_norm = ANY(%s)
+                    """,
+                    ([str(numero) for numero, _ in linhas],),
+                )
+                execute_values(
+                    cur,
+                    """
+                    INSERT INTO sugestoes_para_clientes_by_llm
+                        (created_at, numero_cliente, sugestao_de_venda)
+                    VALUES %s
+                    """,
+                    [(str(numero), sugestao) for numero, sugestao in linhas],
+                    template="(NOW(), %s, %s)",
+                    page_size=1000,
+                )
+                conn.commit()
+                invalidate("sugestoes")
+                return len(linhas)
+        except Exception as e:
+            conn.rollback()
+            st.error(f"Erro ao guardar sugestões: {e}")
+            return 0
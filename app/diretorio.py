@@ -0,0 +1,152 @@
+"""
+Diretório de clientes e produtos e seletores com pesquisa.
+
+`diretorio_clientes()` / `diretorio_produtos()` devolvem um `Diretorio` em cache
+(partilhado pelas sessões e invalidado pelas escritas em clientes/produtos),
+indexado por id e com o índice nome → ids, para resolver ids e rótulos sem
+percorrer a lista. Nomes repetidos ficam distinguíveis no rótulo.
+
+`seletor_cliente` / `seletor_produto` pesquisam no servidor (ILIKE sobre índices
+de trigramas) e só enviam ao browser os `LIMITE_RESULTADOS` primeiros resultados,
+nunca a lista completa.
+"""
+
+from collections import defaultdict
+
+import streamlit as st
+
+from cache import cached
+from db import (
+    get_diretorio_clientes,
+    get_produtos,
+    procurar_clientes,
+    procurar_produtos,
+)
+
+LIMITE_RESULTADOS = 20
+
+
+def _normalizar(nome):
+    return " ".join(str(nome or "").split()).casefold()
+
+
+class Diretorio:
+    """Entradas {id: (nome, detalhe)} com o índice nome normalizado → [ids]."""
+
+    def __init__(self, linhas):
+        """`linhas`: iterável de (id, nome, detalhe); `detalhe` distingue nomes repetidos."""
+        self.por_id = {}
+        self.ids_por_nome = defaultdict(list)
+        for id_, nome, detalhe in linhas:
+            self.por_id[id_] = (nome, detalhe)
+            self.ids_por_nome[_normalizar(nome)].append(id_)
+
+    def __contains__(self, id_):
+        return id_ in self.por_id
+
+    def __len__(self):
+        return len(self.por_id)
+
+    def nome(self, id_):
+        entrada = self.por_id.get(id_)
+        return entrada[0] if entrada else None
+
+    def ids(self, nome):
+        """Todos os ids com este nome (sem distinguir maiúsculas nem espaços)."""
+        return list(self.ids_por_nome.get(_normalizar(nome), ()))
+
+    def id_unico(self, nome):
+        """O id com este nome, ou None se não existir ou for ambíguo."""
+        ids = self.ids(nome)
+        return ids[0] if len(ids) == 1 else None
+
+    def rotulo(self, id_):
+        """Nome para mostrar; com o detalhe quando há outro registo com o mesmo nome."""
+        entrada = self.por_id.get(id_)
+        if entrada is None:
+            return f"#{id_}"
+        nome, detalhe = entrada
+        if len(self.ids_por_nome[_normalizar(nome)]) > 1:
+            return f"{nome} ({detalhe or f'#{id_}'})"
+        return nome
+
+
+@cached(ttl=600, tags=("clientes",))
+def diretorio_clientes():
+    """Diretório de clientes; o detalhe é o nº de cliente e o distrito."""
+    return Diretorio(
+        (
+            id_,
+            nome,
+            " · ".join(
+                str(v) for v in (f"nº {numero}" if numero else None, distrito) if v
+            ),
+        )
+        for id_, nome, numero, distrito in get_diretorio_clientes()
+    )
+
+
+@cached(ttl=600, tags=("produtos",))
+def diretorio_produtos():
+    """Diretório de produtos (referência)."""
+    return Diretorio((id_, ref, f"#{id_}") for id_, ref in get_produtos())
+
+
+def _seletor(diretorio, procurar, rotulo, chave, pesquisa, placeholder, limite):
+    """
+    Caixa de pesquisa + selectbox com os resultados de `procurar(texto, limite)`.
+
+    A escolha fica em st.session_state, pelo que se mantém quando o texto muda.
+    Devolve o id escolhido, ou None se não houver resultados.
+    """
+    escolha = f"seletor_{chave}"
+    texto = st.text_input(pesquisa, key=f"{escolha}_texto", placeholder=placeholder)
+    ids = [i for i in procurar(texto, limite) if i in diretorio]
+    atual = st.session_state.get(escolha)
+    if atual in diretorio and atual not in ids:
+        ids.insert(0, atual)
+    if not ids:
+        st.info("Nenhum resultado para a pesquisa.")
+        st.session_state.pop(escolha, None)
+        return None
+
+    if len(ids) >= limite:
+        st.caption(f"A mostrar os primeiros {limite} resultados; refine a pesquisa.")
+    selecionado = st.selectbox(
+        rotulo,
+        ids,
+        index=ids.index(atual) if atual in ids else 0,
+        format_func=diretorio.rotulo,
+    )
+    st.session_state[escolha] = selecionado
+    return selecionado
+
+
+def seletor_cliente(
+    rotulo="Selecione um cliente:", chave="cliente", limite=LIMITE_RESULTADOS
+):
+    """Seletor de cliente com pesquisa por nome ou nº de cliente; devolve o id."""
+    return _seletor(
+        diretorio_clientes(),
+        procurar_clientes,
+        rotulo,
+        chave,
+        "Procurar cliente",
+        "Nome ou nº de cliente",
+        limite,
+    )
+
+
+def seletor_produto(
+    rotulo="Selecione um produto:", chave="produto", limite=LIMITE_RESULTADOS
+):
+    """Seletor de produto com pesquisa pela referência; devolve o id."""
+    return _seletor(
+        diretorio_produtos(),
+        procurar_produtos,
+        rotulo,
+        chave,
+        "Procurar produto",
+        "Referência",
+        limite,
+    )
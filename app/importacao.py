@@ -0,0 +1,360 @@
+"""
+Importação em massa de clientes, produtos, reuniões e vendas a partir de CSV/Excel.
+
+O ficheiro é lido em blocos (memória limitada seja qual for o tamanho), cada bloco
+é validado e os números de cliente / referências de produto são resolvidos para
+ids com mapas em memória carregados uma única vez. As linhas válidas seguem por
+`COPY FROM STDIN` para uma tabela temporária e, no fim, um único INSERT ... SELECT
+faz a fusão com a tabela de destino. Tudo corre numa só transação.
+
+Uso pela linha de comandos:
+    python manutencao.py importar reunioes historico.csv
+"""
+
+import io
+import os
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from cache import invalidate
+from db import atualizar_resumo_mensal, conexao
+
+TAMANHO_BLOCO = 5_000
+MAX_ERROS_REPORTADOS = 50
+
+
+def _converter_datas(serie):
+    """Aceita datas ISO (AAAA-MM-DD, também vindas do Excel) e no formato português DD/MM/AAAA."""
+    datas = pd.to_datetime(serie, errors="coerce", format="ISO8601")
+    em_falta = datas.isna() & serie.notna()
+    if em_falta.any():
+        datas[em_falta] = pd.to_datetime(serie[em_falta], errors="coerce", dayfirst=True)
+    return datas.dt.date
+
+
+def _limpar_numero_cliente(serie):
+    # O Excel guarda muitas vezes os números de cliente como texto com apóstrofo
+    return serie.astype("string").str.strip().str.lstrip("'")
+
+
+# ---------------------------- Definição das entidades ---------------------------------
+# Para cada entidade: colunas obrigatórias no ficheiro, colunas opcionais, colunas da
+# tabela temporária (pela ordem do COPY) e a fusão set-based com a tabela de destino.
+
+ENTIDADES = {
+    "clientes": {
+        "obrigatorias": ["name", "numero_cliente", "distrito"],
+        "opcionais": [
+            "cod_postal",
+            "tipo_cliente",
+            "latitude",
+            "longitude",
+            "supplier_id",
+        ],
+        "staging": """
+            name text, numero_cliente text, cod_postal text, tipo_cliente text,
+            distrito text, latitude double precision, longitude double precision,
+            supplier_id integer
+        """,
+        "colunas": [
+            "name",
+            "numero_cliente",
+            "cod_postal",
+            "tipo_cliente",
+            "distrito",
+            "latitude",
+            "longitude",
+            "supplier_id",
+        ],
+        "merge": """
+            INSERT INTO clientes (name, numero_cliente, cod_postal, tipo_cliente, distrito,
+                                  latitude, longitude, data_criacao_linha, supplier_id)
+            SELECT DISTINCT ON (s.numero_cliente)
+                   s.name, s.numero_cliente, s.cod_postal, s.tipo_cliente, s.distrito,
+                   s.latitude, s.longitude, NOW(), s.supplier_id
+            FROM stg_importacao s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM clientes c WHERE c.numero_cliente = s.numero_cliente
+            )
+            ORDER BY s.numero_cliente
+        """,
+        "invalidar": ["clientes"],
+    },
+    "produtos": {
+        "obrigatorias": ["ref"],
+        "opcionais": [],
+        "staging": "ref text",
+        "colunas": ["ref"],
+        "merge": """
+            INSERT INTO produtos (ref, data_criacao_linha)
+            SELECT DISTINCT s.ref, NOW()
+            FROM stg_importacao s
+            WHERE NOT EXISTS (SELECT 1 FROM produtos p WHERE p.ref = s.ref)
+        """,
+        "invalidar": ["produtos"],
+    },
+    "reunioes": {
+        "obrigatorias": ["numero_cliente", "data_reuniao", "houve_venda"],
+        "opcionais": [
+            "descricao",
+            "ref",
+            "quantidade_vendida",
+            "preco_vendido",
+            "razao_nao_venda",
+            "supplier_id",
+        ],
+        "staging": """
+            cliente_id integer, data_reuniao date, descricao text, houve_venda text,
+            produto_id integer, quantidade_vendida numeric, preco_vendido numeric,
+            razao_nao_venda text, supplier_id integer
+        """,
+        "colunas": [
+            "cliente_id",
+            "data_reuniao",
+            "descricao",
+            "houve_venda",
+            "produto_id",
+            "quantidade_vendida",
+            "preco_vendido",
+            "razao_nao_venda",
+            "supplier_id",
+        ],
+        # Linhas já existentes (mesmo cliente, data, produto e descrição) são ignoradas,
+        # para que reimportar o mesmo ficheiro não duplique reuniões
+        "merge": """
+            INSERT INTO reunioes (cliente_id, data_reuniao, descricao, houve_venda, produto_id,
+                                  quantidade_vendida, preco_vendido, razao_nao_venda, supplier_id,
+                                  data_criacao_linha, ultima_atualizacao)
+            SELECT s.cliente_id, s.data_reuniao, s.descricao, s.houve_venda, s.produto_id,
+                   s.quantidade_vendida, s.preco_vendido, s.razao_nao_venda, s.supplier_id,
+                   NOW(), NOW()
+            FROM stg_importacao s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM reunioes r
+                WHERE r.cliente_id = s.cliente_id
+                  AND r.data_reuniao = s.data_reuniao
+                  AND r.produto_id IS NOT DISTINCT FROM s.produto_id
+                  AND r.descricao IS NOT DISTINCT FROM s.descricao
+            )
+        """,
+        "invalidar": ["reunioes"],
+    },
+    "vendas": {
+        "obrigatorias": ["nome", "data", "eur"],
+        "opcionais": [],
+        "staging": "nome text, data date, eur numeric",
+        "colunas": ["nome", "data", "eur"],
+        # Como nas reuniões: vendas já existentes (mesmo nome, data e valor) são
+        # ignoradas, para que reimportar o mesmo ficheiro não as duplique
+        "merge": """
+            INSERT INTO vendas (nome, data, eur)
+            SELECT s.nome, s.data, s.eur
+            FROM stg_importacao s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM vendas v
+                WHERE v.nome IS NOT DISTINCT FROM s.nome
+                  AND v.data IS NOT DISTINCT FROM s.data
+                  AND v.eur IS NOT DISTINCT FROM s.eur
+            )
+        """,
+        "invalidar": ["vendas"],
+    },
+}
+
+
+# ---------------------------- Leitura em blocos ---------------------------------
+
+
+def ler_em_blocos(ficheiro, nome=None, tamanho_bloco=TAMANHO_BLOCO):
+    """
+    Lê um CSV ou Excel em DataFrames de no máximo `tamanho_bloco` linhas (tudo como texto).
+
+    `ficheiro` pode ser um caminho ou um objeto tipo ficheiro (ex.: upload do Streamlit);
+    nesse caso `nome` indica a extensão.
+    """
+    nome = nome or str(ficheiro)
+    extensao = os.path.splitext(nome)[1].lower()
+
+    if extensao in (".xlsx", ".xlsm"):
+        livro = load_workbook(ficheiro, read_only=True, data_only=True)
+        try:
+            linhas = livro.active.iter_rows(values_only=True)
+            cabecalho = [str(c).strip() if c is not None else "" for c in next(linhas)]
+            bloco = []
+            for linha in linhas:
+                bloco.append(linha)
+                if len(bloco) >= tamanho_bloco:
+                    yield pd.DataFrame(bloco, columns=cabecalho, dtype="string")
+                    bloco = []
+            if bloco:
+                yield pd.DataFrame(bloco, columns=cabecalho, dtype="string")
+        finally:
+            livro.close()
+    else:
+        for bloco in pd.read_csv(
+            ficheiro,
+            chunksize=tamanho_bloco,
+            dtype="string",
+            sep=None,
+            engine="python",
+        ):
+            bloco.columns = [c.strip() for c in bloco.columns]
+            yield bloco
+
+
+# ---------------------------- Validação ---------------------------------
+
+
+def _carregar_mapas(cur):
+    """Mapas numero_cliente -> id e ref -> produto_id, carregados uma vez por importação."""
+    cur.execute("SELECT numero_cliente, id FROM clientes WHERE numero_cliente IS NOT NULL;")
+    clientes = {str(numero).strip().lstrip("'"): id_ for numero, id_ in cur.fetchall()}
+    cur.execute("SELECT ref, produto_id FROM produtos;")
+    produtos = {ref: id_ for ref, id_ in cur.fetchall()}
+    return clientes, produtos
+
+
+def _validar_bloco(entidade, bloco, mapas, inicio):
+    """
+    Valida e converte um bloco. Devolve (DataFrame pronto para COPY, lista de erros).
+
+    `inicio` é o número da primeira linha do bloco no ficheiro, para mensagens de erro.
+    """
+    spec = ENTIDADES[entidade]
+    bloco = bloco.reset_index(drop=True)
+    for coluna in spec["opcionais"]:
+        if coluna not in bloco.columns:
+            bloco[coluna] = pd.NA
+
+    invalidas = pd.Series(False, index=bloco.index)
+    motivos = pd.Series("", index=bloco.index, dtype="object")
+
+    def marcar(mascara, motivo):
+        novas = mascara & ~invalidas
+        motivos[novas] = motivo
+        invalidas[novas] = True
+
+    for coluna in spec["obrigatorias"]:
+        bloco[coluna] = bloco[coluna].str.strip()
+        marcar(bloco[coluna].isna() | (bloco[coluna] == ""), f"'{coluna}' em falta")
+
+    if entidade == "clientes":
+        bloco["numero_cliente"] = _limpar_numero_cliente(bloco["numero_cliente"])
+        for coluna in ("latitude", "longitude", "supplier_id"):
+            valor = pd.to_numeric(bloco[coluna], errors="coerce")
+            marcar(bloco[coluna].notna() & valor.isna(), f"'{coluna}' inválido")
+            bloco[coluna] = valor
+        bloco["supplier_id"] = bloco["supplier_id"].astype("Int64")
+
+    elif entidade == "reunioes":
+        clientes, produtos = mapas
+        numero = _limpar_numero_cliente(bloco["numero_cliente"])
+        bloco["cliente_id"] = numero.map(clientes).astype("Int64")
+        marcar(bloco["cliente_id"].isna(), "cliente desconhecido")
+
+        bloco["data_reuniao"] = _converter_datas(bloco["data_reuniao"])
+        marcar(bloco["data_reuniao"].isna(), "data inválida")
+
+        marcar(~bloco["houve_venda"].isin(["Sim", "Não"]), "houve_venda deve ser Sim/Não")
+
+        ref = bloco["ref"].str.strip()
+        bloco["produto_id"] = ref.map(produtos).astype("Int64")
+        marcar(ref.notna() & bloco["produto_id"].isna(), "produto desconhecido")
+        marcar(
+            (bloco["houve_venda"] == "Sim") & bloco["produto_id"].isna(),
+            "venda sem produto",
+        )
+
+        for coluna in ("quantidade_vendida", "preco_vendido", "supplier_id"):
+            valor = pd.to_numeric(bloco[coluna], errors="coerce")
+            marcar(bloco[coluna].notna() & valor.isna(), f"'{coluna}' inválido")
+            bloco[coluna] = valor
+        bloco["supplier_id"] = bloco["supplier_id"].astype("Int64")
+
+    elif entidade == "vendas":
+        bloco["data"] = _converter_datas(bloco["data"])
+        marcar(bloco["data"].isna(), "data inválida")
+        bloco["eur"] = pd.to_numeric(bloco["eur"], errors="coerce")
+        marcar(bloco["eur"].isna(), "'eur' inválido")
+
+    erros = [
+        f"Linha {inicio + i + 2}: {motivos[i]}"  # +2: cabeçalho e numeração a partir de 1
+        for i in bloco.index[invalidas.to_numpy()]
+    ]
+    return bloco.loc[~invalidas, spec["colunas"]], erros
+
+
+# ---------------------------- Importação ---------------------------------
+
+
+def _copiar(cur, df, colunas):
+    """Envia um DataFrame para a tabela temporária via COPY FROM STDIN (CSV)."""
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, na_rep="")
+    buffer.seek(0)
+    cur.copy_expert(
+        f"COPY stg_importacao ({', '.join(colunas)}) FROM STDIN WITH (FORMAT csv)",
+        buffer,
+    )
+
+
+def importar(entidade, ficheiro, nome=None, tamanho_bloco=TAMANHO_BLOCO, progresso=None):
+    """
+    Importa um ficheiro CSV/Excel para a tabela `entidade` (clientes, produtos, reunioes, vendas).
+
+    Devolve um dicionário com linhas lidas, válidas, inseridas e as primeiras mensagens
+    de erro. Linhas inválidas são ignoradas; um erro de base de dados reverte tudo.
+    `progresso`, se indicado, é chamado com o nº de linhas lidas após cada bloco.
+    """
+    if entidade not in ENTIDADES:
+        raise ValueError(f"Entidade desconhecida: {entidade}")
+    spec = ENTIDADES[entidade]
+    resultado = {"lidas": 0, "validas": 0, "inseridas": 0, "erros": [], "n_erros": 0}
+    etiquetas = list(spec["invalidar"])
+
+    with conexao() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("BEGIN;")
+                cur.execute(
+                    f"CREATE TEMP TABLE stg_importacao ({spec['staging']}) ON COMMIT DROP;"
+                )
+                mapas = _carregar_mapas(cur) if entidade == "reunioes" else None
+
+                for bloco in ler_em_blocos(ficheiro, nome, tamanho_bloco):
+                    em_falta = [c for c in spec["obrigatorias"] if c not in bloco.columns]
+                    if em_falta:
+                        raise ValueError(f"Colunas obrigatórias em falta: {', '.join(em_falta)}")
+
+                    validas, erros = _validar_bloco(entidade, bloco, mapas, resultado["lidas"])
+                    resultado["lidas"] += len(bloco)
+                    resultado["validas"] += len(validas)
+                    resultado["n_erros"] += len(erros)
+                    espaco = MAX_ERROS_REPORTADOS - len(resultado["erros"])
+                    resultado["erros"].extend(erros[:espaco])
+
+                    if not validas.empty:
+                        _copiar(cur, validas, spec["colunas"])
+                    if progresso:
+                        progresso(resultado["lidas"])
+
+                cur.execute("ANALYZE stg_importacao;")
+                cur.execute(spec["merge"])
+                resultado["inseridas"] = cur.rowcount
+
+                if entidade == "reunioes":
+                    cur.execute(
+                        "SELECT DISTINCT cliente_id, date_trunc('month', data_reuniao)::date FROM stg_importacao;"
+                    )
+                    chaves = cur.fetchall()
+                    atualizar_resumo_mensal(cur, chaves)
+                    etiquetas += {f"reunioes:cliente:{c}" for c, _ in chaves}
+
+                conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    invalidate(*etiquetas)
+    return resultado
@@ -1,27 +1,31 @@
 import os
 import json
-import math
-import requests
+import time
 from dotenv import load_dotenv
-from groq import Groq, GroqError
+from groq import AsyncGroq, Groq, GroqError, RateLimitError
+import asyncio
 import concurrent.futures
 import streamlit as st
-from textblob import TextBlob
-import tiktoken
 
-import os, time
-from threading import Lock
-from typing import Optional
+from typing import Callable, Iterator, Optional, Union
+
+from rate_limiter import TokenBucketLimiter, parse_retry_after
+from llm_cache import make_key, response_cache
+
+# One encoder, shared with the chunker
+from chunker import COMPACT, ENC, JSON, chunk_indices, encode_records
 
 
 # Replace with your actual DB connection utilities
-from db import get_connection, release_connection
+from db import LOTE_STREAMING, conexao, iterar_lotes
 
 load_dotenv()
 
 
+# SDK retries are disabled so that every retry goes through our rate limiter
 client = Groq(
     api_key=os.environ.get("GROQ_API_KEY"),
+    max_retries=0,
 )
 
 MODEL_TOKEN_LIMIT = {
@@ -38,174 +42,500 @@ MODEL_TOKEN_LIMIT = {
 
 MODEL_ENCODINGS = {"deepseek-r1-distill-llama-70b": "cl100k_base"}
 
+DEFAULT_MODEL = "deepseek-r1-distill-llama-70b"
+
 
 # DeepSeek limits
 TOKENS_PER_MIN = 6_000
 REQS_PER_MIN = 30
 
-# Internal state for throttling
-_token_lock = Lock()
-_window_start_ts = time.time()
-_tokens_in_window: int = 0
-_reqs_in_window: int = 0
+# Upper bound on concurrent segment analyses (the rate limiter does the rest)
+MAX_SEGMENT_WORKERS = 8
 
-# One encoder, reused
-ENC = tiktoken.get_encoding("cl100k_base")
+# Concurrent district analyses on the asyncio engine (enough for every district at once)
+MAX_DISTRICT_CONCURRENCY = 18
 
+# Minimum seconds between on_delta callbacks while a completion streams in
+STREAM_UPDATE_INTERVAL = 0.25
 
-def _renew_window() -> None:
-    """Resets counters if 60s have elapsed since window start."""
-    global _window_start_ts, _tokens_in_window, _reqs_in_window
-    if time.time() - _window_start_ts >= 60:
-        _window_start_ts = time.time()
-        _tokens_in_window = 0
-        _reqs_in_window = 0
+# Sales suggestions: output reserved per client and clients packed per prompt
+SUGGESTION_TOKENS = 250
+MAX_CLIENTS_PER_PROMPT = 8
+
+# Aggregation tree: each intermediate merge answers in about a segment report's size,
+# so levels never grow; the final report gets up to FINAL_MAX_TOKENS (at least FINAL_MIN_TOKENS)
+MERGE_MAX_TOKENS = 1024
+FINAL_MAX_TOKENS = 4096
+FINAL_MIN_TOKENS = 2048
+
+# Shared by every thread (and the asyncio path) that talks to Groq
+_limiter = TokenBucketLimiter(TOKENS_PER_MIN, REQS_PER_MIN)
 
 
 def call_groq(
     prompt: str,
     *,
+    model: str = DEFAULT_MODEL,
     max_tokens: int = 1024,
     temperature: float = 0.3,
     retries: int = 3,
-) -> str:
+    use_cache: bool = True,
+    stream: bool = False,
+) -> Union[str, Iterator[str]]:
     """
     DeepSeek-specific Groq wrapper.
-    • Guarantees ≤30 calls/min  AND  ≤6 000 tokens/min
-    • Retries with exponential back-off.
+    • Keeps within ≤30 calls/min AND ≤6 000 tokens/min through the shared token bucket
+      (waits happen outside any lock; unused tokens are credited back from `usage`).
+    • Honours `retry-after` on 429s, otherwise retries with exponential back-off.
+    • Identical requests (prompt, model, temperature, max_tokens) are answered from
+      the local response cache without spending tokens or waiting on the limiter.
+    • With stream=True, returns an iterator over the answer's text as it arrives
+      (see `stream_groq`) instead of the whole answer.
     """
-    global _tokens_in_window, _reqs_in_window
+    if stream:
+        return stream_groq(
+            prompt,
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            retries=retries,
+            use_cache=use_cache,
+        )
+
+    cache_key = make_key(prompt, model, temperature, max_tokens)
+    if use_cache:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
     request_tokens = len(ENC.encode(prompt)) + max_tokens
 
     for attempt in range(retries):
-        with _token_lock:
-            _renew_window()
-
-            # If this request would exceed either limit, calculate wait
-            excess_tokens = max(0, _tokens_in_window + request_tokens - TOKENS_PER_MIN)
-            excess_reqs = max(0, _reqs_in_window + 1 - REQS_PER_MIN)
-
-            # time needed to clear excess (in seconds)
-            wait_secs = 0.0
-            if excess_tokens > 0:
-                wait_secs = max(wait_secs, 60 * excess_tokens / TOKENS_PER_MIN)
-            if excess_reqs > 0:
-                wait_secs = max(wait_secs, 60 * excess_reqs / REQS_PER_MIN)
-
-            if wait_secs:
-                time.sleep(wait_secs)
-                _renew_window()  # window may have rolled over while we slept
-
-            # book-keep
-            _tokens_in_window += request_tokens
-            _reqs_in_window += 1
+        reservation = _limiter.acquire(request_tokens)
+        used = None
 
         # ---- make the call --------------------------------------------------
         try:
             r = client.chat.completions.create(
                 messages=[{"role": "user", "content": prompt}],
-                model="deepseek-r1-distill-llama-70b",
+                model=model,
                 max_tokens=max_tokens,
                 temperature=temperature,
             )
-            return r.choices[0].message.content.strip()
+            used = r.usage.total_tokens if r.usage else None
+            answer = r.choices[0].message.content.strip()
+            if use_cache:
+                response_cache.put(cache_key, answer)
+            return answer
+
+        except RateLimitError as e:
+            retry_after = parse_retry_after(e.response.headers)
+            if attempt == retries - 1:
+                raise
+            _limiter.penalize(retry_after if retry_after is not None else 2**attempt)
 
         except GroqError as e:
+            used = 0  # failed without an answer: give the booking back
             if attempt == retries - 1:
                 raise
             backoff = 2**attempt
             time.sleep(backoff)
 
+        finally:
+            _limiter.reconcile(reservation, used)
+
+
+def _chunk_usage(chunk) -> Optional[int]:
+    """Total tokens reported by a stream chunk (Groq sends usage with the last one)."""
+    usage = chunk.usage or (chunk.x_groq.usage if chunk.x_groq else None)
+    return usage.total_tokens if usage else None
+
+
+def _chunk_text(chunk) -> str:
+    return (chunk.choices[0].delta.content or "") if chunk.choices else ""
 
-def fetch_reunioes():
-    sql = """
-    SELECT c.id, cliente_id, name AS client_name, data_reuniao, descricao, houve_venda,
+
+def stream_groq(
+    prompt: str,
+    *,
+    model: str = DEFAULT_MODEL,
+    max_tokens: int = 1024,
+    temperature: float = 0.3,
+    retries: int = 3,
+    use_cache: bool = True,
+) -> Iterator[str]:
+    """
+    Streaming twin of call_groq: yields the answer's text as it arrives.
+    Same limiter, cache and retry rules, except that a request is only retried
+    before its first token; afterwards the error is raised, so whatever the
+    caller already rendered stays on screen. A cached answer is yielded whole.
+    """
+    cache_key = make_key(prompt, model, temperature, max_tokens)
+    if use_cache:
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+    request_tokens = len(ENC.encode(prompt)) + max_tokens
+
+    for attempt in range(retries):
+        reservation = _limiter.acquire(request_tokens)
+        parts, used = [], None
+        try:
+            for chunk in client.chat.completions.create(
+                messages=[{"role": "user", "content": prompt}],
+                model=model,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True,
+            ):
+                used = _chunk_usage(chunk) or used
+                text = _chunk_text(chunk)
+                if text:
+                    parts.append(text)
+                    yield text
+            if use_cache:
+                response_cache.put(cache_key, "".join(parts).strip())
+            return
+
+        except RateLimitError as e:
+            retry_after = parse_retry_after(e.response.headers)
+            if parts or attempt == retries - 1:
+                raise
+            _limiter.penalize(retry_after if retry_after is not None else 2**attempt)
+
+        except GroqError:
+            if used is None and not parts:
+                used = 0  # failed before any output: give the booking back
+            if parts or attempt == retries - 1:
+                raise
+            time.sleep(2**attempt)
+
+        finally:
+            _limiter.reconcile(reservation, used)
+
+
+async def call_groq_async(
+    aclient: AsyncGroq,
+    prompt: str,
+    *,
+    model: str = DEFAULT_MODEL,
+    max_tokens: int = 1024,
+    temperature: float = 0.3,
+    retries: int = 3,
+    use_cache: bool = True,
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> str:
+    """
+    asyncio twin of call_groq on an AsyncGroq client.
+    Shares the token bucket and response cache with the threaded path.
+    With `on_delta`, the completion is streamed and `on_delta(text_so_far)` is
+    called as tokens arrive, at most every STREAM_UPDATE_INTERVAL seconds and
+    once more with the whole text (retries only happen before the first token).
+    The SQLite cache and the tokenizer run in worker threads, so they never stall
+    the other coroutines on the loop.
+    """
+    cache_key = make_key(prompt, model, temperature, max_tokens)
+    if use_cache:
+        cached = await asyncio.to_thread(response_cache.get, cache_key)
+        if cached is not None:
+            if on_delta is not None:
+                on_delta(cached)
+            return cached
+
+    request_tokens = len(await asyncio.to_thread(ENC.encode, prompt)) + max_tokens
+
+    for attempt in range(retries):
+        reservation = await _limiter.acquire_async(request_tokens)
+        parts, used = [], None
+        try:
+            if on_delta is None:
+                r = await aclient.chat.completions.create(
+                    messages=[{"role": "user", "content": prompt}],
+                    model=model,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                )
+                used = r.usage.total_tokens if r.usage else None
+                answer = r.choices[0].message.content.strip()
+            else:
+                shown, last_update = 0, 0.0
+                async for chunk in await aclient.chat.completions.create(
+                    messages=[{"role": "user", "content": prompt}],
+                    model=model,
+                    max_tokens=max_tokens,
+                    temperature=temperature,
+                    stream=True,
+                ):
+                    used = _chunk_usage(chunk) or used
+                    text = _chunk_text(chunk)
+                    if text:
+                        parts.append(text)
+                        now = time.monotonic()
+                        if now - last_update >= STREAM_UPDATE_INTERVAL:
+                            on_delta("".join(parts))
+                            shown, last_update = len(parts), now
+                if shown < len(parts):
+                    on_delta("".join(parts))
+                answer = "".join(parts).strip()
+            if use_cache:
+                await asyncio.to_thread(response_cache.put, cache_key, answer)
+            return answer
+
+        except RateLimitError as e:
+            retry_after = parse_retry_after(e.response.headers)
+            if parts or attempt == retries - 1:
+                raise
+            _limiter.penalize(retry_after if retry_after is not None else 2**attempt)
+
+        except GroqError:
+            if used is None and not parts:
+                used = 0  # failed before any output: give the booking back
+            if parts or attempt == retries - 1:
+                raise
+            await asyncio.sleep(2**attempt)
+
+        finally:
+            _limiter.reconcile(reservation, used)
+
+
+# Columns used for incremental bookkeeping only; never sent to the LLM
+INTERNAL_COLUMNS = ("reuniao_id", "marca")
+
+# Last change of a meeting row. Rendered as fixed-width text so that it is stored
+# and compared exactly, and so that Python's max() over it matches SQL's MAX()
+_MARCA_SQL = "GREATEST(r.data_criacao_linha, r.ultima_atualizacao)"
+_MARCA_FMT = "'YYYY-MM-DD HH24:MI:SS.US'"
+
+
+def iter_reunioes(intervalos=None, desde_id=None, lote=LOTE_STREAMING):
+    """
+    Meetings with client and product details, ordered by meeting id, streamed
+    from a server-side cursor as lists of at most `lote` dicts.
+
+    With `intervalos` (list of (first_id, last_id)) and/or `desde_id`, only the
+    meetings inside those id ranges or with id > desde_id are returned.
+    """
+    where, params = "", {}
+    if intervalos is not None or desde_id is not None:
+        conditions = ["FALSE"]
+        if intervalos:
+            conditions.append(
+                """EXISTS (SELECT 1 FROM unnest(%(ini)s::int[], %(fim)s::int[]) AS k(ini, fim)
+                           WHERE r.id BETWEEN k.ini AND k.fim)"""
+            )
+            params["ini"] = [ini for ini, _ in intervalos]
+            params["fim"] = [fim for _, fim in intervalos]
+        if desde_id is not None:
+            conditions.append("r.id > %(desde)s")
+            params["desde"] = desde_id
+        where = "WHERE " + " OR ".join(conditions)
+
+    sql = f"""
+    SELECT cliente_id, name AS client_name, data_reuniao, descricao, houve_venda,
            ref AS product_name, quantidade_vendida, preco_vendido AS preco_unitario,
-           razao_nao_venda, distrito, cultura, area_culturas
+           razao_nao_venda, distrito, cultura, area_culturas,
+           r.id AS reuniao_id, to_char({_MARCA_SQL}, {_MARCA_FMT}) AS marca
     FROM reunioes r
     JOIN clientes c ON c.id = r.cliente_id
     JOIN produtos p ON p.produto_id = r.produto_id
-    ORDER BY r.data_criacao_linha DESC;
+    {where}
+    ORDER BY r.id;
     """
-    conn = get_connection()
-    try:
+    return iterar_lotes(sql, params, lote=lote, formato="registos")
+
+
+def fetch_reunioes(intervalos=None, desde_id=None):
+    """All of `iter_reunioes` as a single list of dicts."""
+    return [reg for lote in iter_reunioes(intervalos, desde_id) for reg in lote]
+
+
+def fetch_marcas_intervalos(intervalos):
+    """{(first_id, last_id): (last change, meeting count)} for each id range."""
+    if not intervalos:
+        return {}
+    sql = f"""
+    SELECT k.ini, k.fim, to_char(MAX({_MARCA_SQL}), {_MARCA_FMT}), COUNT(r.id)
+    FROM unnest(%(ini)s::int[], %(fim)s::int[]) AS k(ini, fim)
+    LEFT JOIN (
+        reunioes r
+        JOIN clientes c ON c.id = r.cliente_id
+        JOIN produtos p ON p.produto_id = r.produto_id
+    ) ON r.id BETWEEN k.ini AND k.fim
+    GROUP BY k.ini, k.fim;
+    """
+    params = {
+        "ini": [ini for ini, _ in intervalos],
+        "fim": [fim for _, fim in intervalos],
+    }
+    with conexao() as conn:
         with conn.cursor() as cur:
-            cur.execute(sql)
-            cols = [desc[0] for desc in cur.description]
-            rows = cur.fetchall()
-            return [dict(zip(cols, row)) for row in rows]
-    finally:
-        release_connection(conn)
+            cur.execute(sql, params)
+            return {(ini, fim): (marca, n) for ini, fim, marca, n in cur.fetchall()}
+
+
+def _data_block(payload, fmt):
+    """Fenced payload for a prompt, with a reading guide for the compact format."""
+    if fmt == COMPACT:
+        return f"""The data is tab-separated: `clients` lists each client once and every `meetings` row refers to it by `cliente_id`. Empty cells are null.
+    ```tsv
+    {payload}
+    ```"""
+    return f"""```json
+    {payload}
+    ```"""
+
+
+def _segment_prompt(idx, chunk, fmt=JSON):
+    return f"""
+    You are a business insights assistant for an agricultural sales team (specializing in crop protection/fertilizers).
+
+    Given the following data segment - number {idx}:
+    {_data_block(chunk, fmt)}
+    Analyze this regional meeting data to help a field sales representative understand their client base and optimize their sales strategy. Structure your analysis into the following sections:
+
+    1. **Client Relationship (CRM) Analysis**
+    - Identify high-potential clients (e.g., multiple meetings, product interest, recent purchases).
+    - Detect churn-risk clients (e.g., frequent “no sale”, negative tone, objections).
+    - Quantify: number of clients per category with justification (include `cliente_id`).
+
+    2. **Strategic Product Opportunities**
+    - Identify cross-selling opportunities based on product patterns and client needs.
+    - Spot emerging demands or unaddressed problems from meeting descriptions.
+    - Highlight potential new markets or crops.
+
+    3. **Sales Team Effectiveness**
+    - Evaluate meeting productivity (e.g., % with successful sales).
+    - Identify effective behaviors (phrases, tone, product combos).
+    - Recommend areas of improvement.
+
+    4. **NLP & Sentiment Insights**
+    - Perform sentiment analysis on `descricao` fields (Positive, Neutral, Negative).
+    - Extract most common topics (e.g., pests, crop types, treatment concerns).
+    - Detect competitor mentions or rival product references.
+    - Summarize frequency metrics and patterns.
+
+    5. **Predictive Signals**
+    - Based on descriptions and behavior, infer next steps for top clients.
+    - Suggest personalized engagement strategies and timing.
+    - Highlight clients that may require urgent follow-up.
+
+    > Use markdown formatting with clear bullet points, tables, and subtitles. Write in professional, fluent English. Make results suitable for dashboards or client strategy reports.
 
+    """
 
-def preprocess_sentiment(df):
-    df["sentiment"] = df["descricao"].apply(
-        lambda x: (
-            "Positive"
-            if TextBlob(x).sentiment.polarity > 0.2
-            else "Negative" if TextBlob(x).sentiment.polarity < -0.2 else "Neutral"
-        )
-    )
-    return df
 
+def _request_window(model):
+    """Largest request (prompt + completion): the context window, capped by the per-minute budget."""
+    return min(MODEL_TOKEN_LIMIT.get(model, 8192), TOKENS_PER_MIN)
 
-def get_segments_report(json_chunks):
-    segment_reports = []
-    try:
-        for idx, chunk in enumerate(json_chunks, 1):
-            prompt = f"""
-            You are a business insights assistant for an agricultural sales team (specializing in crop protection/fertilizers).
 
-            Given the following data segment - number {idx}:
-            ```json
-            {chunk}
-            ```
-            Analyze this regional meeting data to help a field sales representative understand their client base and optimize their sales strategy. Structure your analysis into the following sections:
+def chunk_budget(
+    model: str = DEFAULT_MODEL, max_tokens: int = 1024, fmt: str = JSON
+) -> int:
+    """
+    Token budget for the data of one segment: what the model's context window
+    (capped by the per-minute budget, which a single request can't exceed)
+    leaves after the segment prompt and the reserved completion tokens.
+    """
+    window = _request_window(model)
+    prompt_tokens = len(ENC.encode(_segment_prompt(0, "", fmt)))
+    return max(1, window - prompt_tokens - max_tokens)
 
-            1. **Client Relationship (CRM) Analysis**
-            - Identify high-potential clients (e.g., multiple meetings, product interest, recent purchases).
-            - Detect churn-risk clients (e.g., frequent “no sale”, negative tone, objections).
-            - Quantify: number of clients per category with justification (include `cliente_id`).
 
-            2. **Strategic Product Opportunities**
-            - Identify cross-selling opportunities based on product patterns and client needs.
-            - Spot emerging demands or unaddressed problems from meeting descriptions.
-            - Highlight potential new markets or crops.
+def _segment_workers(prompts, max_tokens):
+    """How many segment calls can usefully run at once within the per-minute budget."""
+    tokens_per_call = max(len(ENC.encode(p)) + max_tokens for p in prompts)
+    by_tokens = max(1, TOKENS_PER_MIN // tokens_per_call)
+    return max(1, min(len(prompts), REQS_PER_MIN, by_tokens, MAX_SEGMENT_WORKERS))
 
-            3. **Sales Team Effectiveness**
-            - Evaluate meeting productivity (e.g., % with successful sales).
-            - Identify effective behaviors (phrases, tone, product combos).
-            - Recommend areas of improvement.
 
-            4. **NLP & Sentiment Insights**
-            - Perform sentiment analysis on `descricao` fields (Positive, Neutral, Negative).
-            - Extract most common topics (e.g., pests, crop types, treatment concerns).
-            - Detect competitor mentions or rival product references.
-            - Summarize frequency metrics and patterns.
+def analyze_segments(
+    json_chunks,
+    *,
+    model: str = DEFAULT_MODEL,
+    max_tokens: int = 1024,
+    fmt: str = JSON,
+    on_result=None,
+):
+    """
+    Analyze every chunk concurrently (bounded by the rate-limit budget).
+    `fmt` is the payload format the chunks were encoded in (JSON or COMPACT).
+    `on_result(index, report)` runs in the calling thread as each chunk finishes.
 
-            5. **Predictive Signals**
-            - Based on descriptions and behavior, infer next steps for top clients.
-            - Suggest personalized engagement strategies and timing.
-            - Highlight clients that may require urgent follow-up.
+    Returns one entry per chunk, in chunk order: the report, or None if that
+    chunk failed (the failure is reported with st.error).
+    """
+    prompts = [
+        _segment_prompt(idx, chunk, fmt) for idx, chunk in enumerate(json_chunks, 1)
+    ]
+    if not prompts:
+        return []
+
+    results = [None] * len(prompts)
+    errors = {}
+    workers = _segment_workers(prompts, max_tokens)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(call_groq, prompt, model=model, max_tokens=max_tokens): i
+            for i, prompt in enumerate(prompts)
+        }
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                errors[i] = e
+                continue
+            if on_result is not None:
+                on_result(i, results[i])
+
+    # st.* must be called from the script thread, not from the workers
+    for i, e in sorted(errors.items()):
+        st.error(f"Error fetching insights for segment {i + 1}: {e}")
+    return results
+
+
+def get_segments_report(
+    json_chunks, *, model: str = DEFAULT_MODEL, max_tokens: int = 1024, fmt: str = JSON
+):
+    """
+    Successful segment reports in chunk order; a failing chunk is skipped
+    instead of discarding the others.
+    """
+    return [
+        r
+        for r in analyze_segments(
+            json_chunks, model=model, max_tokens=max_tokens, fmt=fmt
+        )
+        if r is not None
+    ]
 
-            > Use markdown formatting with clear bullet points, tables, and subtitles. Write in professional, fluent English. Make results suitable for dashboards or client strategy reports.
 
-            """
+def _merge_prompt(reports_json):
+    return f"""
+    Partial Reports:
 
-            answer = call_groq(prompt)
-            segment_reports.append(answer)
-        return segment_reports
-    except Exception as e:
-        st.error(f"Error fetching insights for segment {idx}: {e}")
+    ```json
+    {reports_json}
+    ```
+
+    These are partial analyses of consecutive segments of the same CRM meeting data. Merge them into a single partial report with the same sections, to be merged again later:
+    - Deduplicate overlapping findings and combine their counts and percentages.
+    - Keep every quantity, `cliente_id`, product, crop and competitor reference that supports a finding.
+    - Drop repetition and filler, not facts.
+
+    > Use markdown with section headers and bullet points. Be dense and concise. Write in English.
+    """
 
 
-def aggregate_reports(results_for_aggregation):
-    prompt = f"""
+def _final_prompt(reports_json):
+    return f"""
     Comprehensive Final Report:
 
     ```json
-    {json.dumps(results_for_aggregation, ensure_ascii=False, indent=2)}
+    {reports_json}
     ```
 
     Produce a comprehensive and executive-level report that will be used by commercial managers. Organize the content as follows:
@@ -242,14 +572,109 @@ def aggregate_reports(results_for_aggregation):
     > Write concisely in bullet points and section headers. Use markdown formatting. Avoid redundancy. Deliver actionable insights ready to inform sales strategy. Write in professional, fluent Portuguese (PT-PT).
 
     """
-    return call_groq(prompt, max_tokens=4096)
+
+
+def _fit_report(report, budget):
+    """`report`, cut at the end if it encodes to more than `budget` tokens."""
+    size = len(ENC.encode(encode_records([report])))
+    while size > budget:
+        tokens = ENC.encode(report)
+        keep = max(0, len(tokens) * budget // size - 1)
+        report = ENC.decode(tokens[:keep]).rstrip() + "\n\n[…]"
+        size = len(ENC.encode(encode_records([report])))
+        if keep == 0:
+            break
+    return report
+
+
+def _merge_level(groups, *, model):
+    """
+    Merge each group of reports concurrently; single-report groups pass through.
+    A group whose merge fails keeps its reports, joined unmerged, so one failed
+    call never discards the segments already analysed (reported with st.error).
+    """
+    merged = [group[0] if len(group) == 1 else None for group in groups]
+    pending = {
+        i: _merge_prompt(encode_records(group))
+        for i, group in enumerate(groups)
+        if len(group) > 1
+    }
+    errors = {}
+    workers = _segment_workers(list(pending.values()), MERGE_MAX_TOKENS)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                call_groq, prompt, model=model, max_tokens=MERGE_MAX_TOKENS
+            ): i
+            for i, prompt in pending.items()
+        }
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            try:
+                merged[i] = future.result()
+            except Exception as e:
+                errors[i] = e
+                merged[i] = "\n\n".join(groups[i])
+
+    # st.* must be called from the script thread, not from the workers
+    for i, e in sorted(errors.items()):
+        st.error(f"Error merging reports (group {i + 1}), kept unmerged: {e}")
+    return merged
+
+
+def aggregate_reports(
+    results_for_aggregation, *, model: str = DEFAULT_MODEL, stream: bool = False
+):
+    """
+    Tree reduce of the segment reports into the final report.
+
+    While the reports don't fit in one final prompt, consecutive reports are
+    packed (by measured token count) into groups that fit a merge prompt and
+    each group is merged concurrently into one report; the fan-in of every
+    level follows from the request window left after the prompt and output.
+    With stream=True the merges still run to completion, and the final report
+    is returned as an iterator over its text (see `stream_groq`).
+
+    A report too large for half a merge prompt (so that the pairing fallback
+    below always fits) is cut at the end, as is a last report that still
+    exceeds the final prompt.
+    """
+    reports = list(results_for_aggregation)
+    window = _request_window(model)
+    final_budget = window - len(ENC.encode(_final_prompt(""))) - FINAL_MIN_TOKENS
+    merge_budget = window - len(ENC.encode(_merge_prompt(""))) - MERGE_MAX_TOKENS
+
+    while len(reports) > 1 and len(ENC.encode(encode_records(reports))) > final_budget:
+        reports = [_fit_report(r, merge_budget // 2) for r in reports]
+        groups = chunk_indices(reports, merge_budget)
+        if len(groups) == len(reports):
+            # Every report fills a merge prompt alone: merge pairs anyway so the tree shrinks
+            groups = [
+                list(range(i, min(i + 2, len(reports))))
+                for i in range(0, len(reports), 2)
+            ]
+        reports = _merge_level(
+            [[reports[i] for i in group] for group in groups], model=model
+        )
+
+    if len(reports) == 1:
+        reports = [_fit_report(reports[0], final_budget)]
+    prompt = _final_prompt(encode_records(reports))
+    max_tokens = min(FINAL_MAX_TOKENS, window - len(ENC.encode(prompt)))
+    return call_groq(
+        prompt,
+        model=model,
+        max_tokens=max(FINAL_MIN_TOKENS, max_tokens),
+        stream=stream,
+    )
 
 
 # ---------------------------------------------------------------------------------------------------------------------------------
 
 
-def fetch_reunioes_por_distrito():
-    sql = """
+def fetch_reunioes_por_distrito(distritos=None):
+    """{distrito: [meetings]}; restricted to `distritos` when given."""
+    sql = f"""
     SELECT distrito, json_agg(json_build_object(
         'cliente_id', cliente_id,
         'client_name', name,
@@ -266,16 +691,30 @@ def fetch_reunioes_por_distrito():
     FROM reunioes r
     JOIN clientes c ON c.id = r.cliente_id
     JOIN produtos p ON p.produto_id = r.produto_id
+    {"WHERE distrito = ANY(%(distritos)s)" if distritos is not None else ""}
     GROUP BY distrito;
     """
-    conn = get_connection()
-    try:
+    with conexao() as conn:
         with conn.cursor() as cur:
-            cur.execute(sql)
+            cur.execute(sql, {"distritos": list(distritos or [])})
             rows = cur.fetchall()
             return {row[0]: row[1] for row in rows}
-    finally:
-        release_connection(conn)
+
+
+def fetch_marcas_por_distrito():
+    """{distrito: (last change, meeting count)} over the same rows as fetch_reunioes_por_distrito."""
+    sql = f"""
+    SELECT distrito, to_char(MAX({_MARCA_SQL}), {_MARCA_FMT}), COUNT(*)
+    FROM reunioes r
+    JOIN clientes c ON c.id = r.cliente_id
+    JOIN produtos p ON p.produto_id = r.produto_id
+    WHERE distrito IS NOT NULL
+    GROUP BY distrito;
+    """
+    with conexao() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql)
+            return {distrito: (marca, n) for distrito, marca, n in cur.fetchall()}
 
 
 def fetch_reunioes_por_cliente(cliente_id):
@@ -296,65 +735,254 @@ def fetch_reunioes_por_cliente(cliente_id):
     FROM reunioes r
     JOIN clientes c ON c.id = r.cliente_id
     JOIN produtos p ON p.produto_id = r.produto_id
-    WHERE cliente_id = {cliente_id}
+    WHERE cliente_id = %(cliente_id)s
+    GROUP BY distrito;
     """
-    conn = get_connection()
-    try:
+    with conexao() as conn:
         with conn.cursor() as cur:
-            cur.execute(sql)
+            cur.execute(sql, {"cliente_id": cliente_id})
             rows = cur.fetchall()
             return {row[0]: row[1] for row in rows}
-    finally:
-        release_connection(conn)
 
 
-# Gerar relatórios segmentados por distrito
+def _client_prompt(data, fmt=JSON):
+    return f"""
+    Client meetings:
+    {_data_block(encode_records(data, fmt), fmt)}
+    Act as a strategic assistant for a sales representative in the agrochemical sector, preparing the next visit to this client. The data includes every meeting with the client: descriptions, sales outcomes, products, quantities, prices and dates.
 
+    1. **Relationship Summary:** Purchase history, meeting frequency and trend; whether the client is high-potential or at churn risk, and why.
+    2. **Needs & Objections:** Crops, pests and problems mentioned; recurring objections and reasons for no sale; competitor mentions.
+    3. **Product Opportunities:** Products to propose next (repeat, cross-sell, seasonal), with expected timing.
+    4. **Next Visit Plan:** Concrete talking points, offers and the best moment to visit.
 
-def analyze_districts(district_data):
-    def analyze_district(district, data):
-        prompt = f"""
-        Region: {district}
-        ```json
-        {json.dumps(data, ensure_ascii=False)}
-        ```
-        Act as a strategic assistant for a sales representative in the agrochemical sector, analyzing CRM data for a specific region. The data includes meeting descriptions, sales outcomes, product details, timestamps, and customer IDs.
+    > Write concisely in bullet points and section headers. Use markdown formatting. Avoid redundancy. Write in professional, fluent Portuguese (PT-PT).
+    """
 
-        Provide a structured and quantified analysis for the selected region, focusing on the following:
 
-        1. **Customer Profile:** Identify customers with high purchasing potential (e.g., frequent interactions, past purchases, positive interest) and those at high risk of churn (e.g., multiple “no sale” entries, absence of recent purchases, or recurring objections). Quantify how many customers fall into each category and briefly explain why.
+def analyze_client(
+    data, *, model: str = DEFAULT_MODEL, fmt: str = JSON, max_tokens: int = 1024
+):
+    """Report for a single client from all of its meetings."""
+    return call_groq(_client_prompt(data, fmt), model=model, max_tokens=max_tokens)
 
-        2. **Product Strategy Insights:** Highlight cross-selling opportunities based on patterns in product discussions and customer needs. Identify promising new market areas from topics found in the meeting descriptions. Quantify key opportunities and match them to customer IDs.
 
-        3. **Sales Team Performance:** Evaluate the frequency and quality of meetings. Identify high-performing interactions (e.g., those that result in sales or show positive sentiment) and suggest areas of improvement. Include metrics such as the percentage of meetings that led to sales.
+def fetch_historicos_clientes(max_reunioes=10, apenas_alterados=True):
+    """
+    Recent meetings of every client, in one query, ordered by client and date.
 
-        4. **Sentiment & NLP Analysis:** Conduct a sentiment analysis of the meeting descriptions. Identify recurring topics (e.g., crops, pests, concerns), sentiment trends (positive/neutral/negative), and specific mentions of competitors or rival brands. Provide a concise breakdown of frequency and tone.
+    Keeps the last `max_reunioes` meetings per client. With `apenas_alterados`,
+    clients whose latest stored suggestion is newer than their last meeting
+    change are skipped. Returns (records, {cliente_id: numero_cliente}).
+    """
+    sql = f"""
+    WITH ultima AS (
+        SELECT numero_cliente_norm AS numero_cliente, MAX(created_at) AS criado_em
+        FROM sugestoes_para_clientes_by_llm
+        GROUP BY 1
+    ), historico AS (
+        SELECT r.cliente_id, c.numero_cliente::text AS numero_cliente, c.name AS client_name,
+               c.distrito, c.cultura, c.area_culturas, r.data_reuniao, r.descricao,
+               r.houve_venda, p.ref AS product_name, r.quantidade_vendida,
+               r.preco_vendido AS preco_unitario, r.razao_nao_venda,
+               ROW_NUMBER() OVER (PARTITION BY r.cliente_id
+                                  ORDER BY r.data_reuniao DESC, r.id DESC) AS n,
+               MAX({_MARCA_SQL}) OVER (PARTITION BY r.cliente_id) AS marca
+        FROM reunioes r
+        JOIN clientes c ON c.id = r.cliente_id
+        JOIN produtos p ON p.produto_id = r.produto_id
+    )
+    SELECT h.cliente_id, h.numero_cliente, h.client_name, h.distrito, h.cultura,
+           h.area_culturas, h.data_reuniao, h.descricao, h.houve_venda, h.product_name,
+           h.quantidade_vendida, h.preco_unitario, h.razao_nao_venda
+    FROM historico h
+    LEFT JOIN ultima u ON u.numero_cliente = h.numero_cliente
+    WHERE h.n <= %(max_reunioes)s
+      AND (NOT %(apenas_alterados)s OR u.criado_em IS NULL OR u.criado_em < h.marca)
+    ORDER BY h.cliente_id, h.data_reuniao, h.n DESC;
+    """
+    registos, numeros = [], {}
+    for lote in iterar_lotes(
+        sql,
+        {"max_reunioes": max_reunioes, "apenas_alterados": apenas_alterados},
+        formato="registos",
+    ):
+        for reg in lote:
+            numeros[reg["cliente_id"]] = reg.pop("numero_cliente")
+            registos.append(reg)
+    return registos, numeros
+
+
+def _suggestion_prompt(payload, fmt=COMPACT):
+    return f"""
+    Recent meetings of several clients:
+    {_data_block(payload, fmt)}
+    Act as a sales assistant for a field representative in the agrochemical sector (crop protection/fertilizers). For EACH client in the data, write one concrete sales suggestion for the next visit: which products to propose and why, the best timing, and how to address past objections. Base it on the client's crops, area, purchase history and meeting descriptions.
+
+    Answer ONLY with a JSON object mapping every `cliente_id` (as a string) to its suggestion, e.g. {{"12": "..."}}. Each suggestion is at most 120 words of professional, fluent Portuguese (PT-PT).
+    """
 
-        5. **Predictive Insights:** Forecast future customer needs or risks based on description patterns, seasonality, and frequently mentioned challenges. Recommend actionable engagement strategies for each insight.
 
-        Format the output clearly using markdown with sections, bullet points, and tables where helpful. Use professional, concise English. Structure your writing in a way that makes the results ready to be integrated into dashboards or shared in business updates.
+def suggestion_budget(model: str = DEFAULT_MODEL, fmt: str = COMPACT) -> int:
+    """Token budget for the client data of one suggestions prompt."""
+    prompt_tokens = len(ENC.encode(_suggestion_prompt("", fmt)))
+    reserved = SUGGESTION_TOKENS * MAX_CLIENTS_PER_PROMPT
+    return max(1, _request_window(model) - prompt_tokens - reserved)
 
-        **My Communication Style Summary:**
 
-        * Analytical, structured, and action-oriented.
-        * Prefers clear, quantifiable insights over vague summaries.
-        * Uses natural but professional language.
-        * Prioritizes practical outputs for commercial use in sales planning.
-        > Write concisely in bullet points and section headers. Use markdown formatting. Avoid redundancy. Deliver actionable insights ready to inform sales strategy. Write in professional, fluent Portuguese (PT-PT).
-        """
-        return call_groq(prompt)
+def parse_suggestions(answer):
+    """{cliente_id: suggestion} from a suggestions answer (reasoning and fences ignored)."""
+    if "</think>" in answer:
+        answer = answer.rsplit("</think>", 1)[1]
+    start, end = answer.find("{"), answer.rfind("}")
+    if start < 0 or end < start:
+        raise ValueError("No JSON object in the answer")
+    parsed = json.loads(answer[start : end + 1])
+    return {int(k): str(v).strip() for k, v in parsed.items() if str(v).strip()}
 
-    results = {}
-    with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+
+def suggest_for_clients(
+    payloads, n_clients, *, model: str = DEFAULT_MODEL, fmt: str = COMPACT
+):
+    """
+    Generate the suggestions for every payload concurrently (bounded by the
+    rate-limit budget). `n_clients[i]` is how many clients payload i holds.
+
+    Returns one entry per payload, in order: {cliente_id: suggestion}, or None
+    if that payload failed (the failure is reported with st.error).
+    """
+    prompts = [_suggestion_prompt(p, fmt) for p in payloads]
+    if not prompts:
+        return []
+
+    results = [None] * len(prompts)
+    errors = {}
+    workers = _segment_workers(prompts, SUGGESTION_TOKENS * MAX_CLIENTS_PER_PROMPT)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
         futures = {
-            executor.submit(analyze_district, district, data): district
-            for district, data in district_data.items()
+            executor.submit(
+                call_groq,
+                prompt,
+                model=model,
+                max_tokens=SUGGESTION_TOKENS * n,
+                temperature=0.4,
+            ): i
+            for i, (prompt, n) in enumerate(zip(prompts, n_clients))
         }
         for future in concurrent.futures.as_completed(futures):
-            district = futures[future]
+            i = futures[future]
+            try:
+                results[i] = parse_suggestions(future.result())
+            except Exception as e:
+                errors[i] = e
+
+    # st.* must be called from the script thread, not from the workers
+    for i, e in sorted(errors.items()):
+        st.error(f"Error generating suggestions for batch {i + 1}: {e}")
+    return results
+
+
+# Gerar relatórios segmentados por distrito
+
+
+def _district_prompt(district, data, fmt=JSON):
+    return f"""
+    Region: {district}
+    {_data_block(encode_records(data, fmt), fmt)}
+    Act as a strategic assistant for a sales representative in the agrochemical sector, analyzing CRM data for a specific region. The data includes meeting descriptions, sales outcomes, product details, timestamps, and customer IDs.
+
+    Provide a structured and quantified analysis for the selected region, focusing on the following:
+
+    1. **Customer Profile:** Identify customers with high purchasing potential (e.g., frequent interactions, past purchases, positive interest) and those at high risk of churn (e.g., multiple “no sale” entries, absence of recent purchases, or recurring objections). Quantify how many customers fall into each category and briefly explain why.
+
+    2. **Product Strategy Insights:** Highlight cross-selling opportunities based on patterns in product discussions and customer needs. Identify promising new market areas from topics found in the meeting descriptions. Quantify key opportunities and match them to customer IDs.
+
+    3. **Sales Team Performance:** Evaluate the frequency and quality of meetings. Identify high-performing interactions (e.g., those that result in sales or show positive sentiment) and suggest areas of improvement. Include metrics such as the percentage of meetings that led to sales.
+
+    4. **Sentiment & NLP Analysis:** Conduct a sentiment analysis of the meeting descriptions. Identify recurring topics (e.g., crops, pests, concerns), sentiment trends (positive/neutral/negative), and specific mentions of competitors or rival brands. Provide a concise breakdown of frequency and tone.
+
+    5. **Predictive Insights:** Forecast future customer needs or risks based on description patterns, seasonality, and frequently mentioned challenges. Recommend actionable engagement strategies for each insight.
+
+    Format the output clearly using markdown with sections, bullet points, and tables where helpful. Use professional, concise English. Structure your writing in a way that makes the results ready to be integrated into dashboards or shared in business updates.
+
+    **My Communication Style Summary:**
+
+    * Analytical, structured, and action-oriented.
+    * Prefers clear, quantifiable insights over vague summaries.
+    * Uses natural but professional language.
+    * Prioritizes practical outputs for commercial use in sales planning.
+    > Write concisely in bullet points and section headers. Use markdown formatting. Avoid redundancy. Deliver actionable insights ready to inform sales strategy. Write in professional, fluent Portuguese (PT-PT).
+    """
+
+
+async def _iter_district_analyses(
+    aclient, district_data, *, model, concurrency, fmt, on_delta=None
+):
+    """Yield (district, report, error) as each district finishes."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def analyze_district(district, data):
+        async with semaphore:
             try:
-                insights = future.result()
-                results[district] = insights
+                report = await call_groq_async(
+                    aclient,
+                    _district_prompt(district, data, fmt),
+                    model=model,
+                    on_delta=(
+                        (lambda text: on_delta(district, text))
+                        if on_delta is not None
+                        else None
+                    ),
+                )
+                return district, report, None
             except Exception as e:
-                st.error(f"Erro na análise do distrito {district}: {e}")
+                return district, None, e
+
+    tasks = [analyze_district(d, data) for d, data in district_data.items()]
+    for next_done in asyncio.as_completed(tasks):
+        yield await next_done
+
+
+def analyze_districts(
+    district_data,
+    *,
+    model: str = DEFAULT_MODEL,
+    concurrency: int = MAX_DISTRICT_CONCURRENCY,
+    on_result=None,
+    fmt: str = JSON,
+    on_delta=None,
+):
+    """
+    Analyze every district concurrently on the asyncio engine.
+
+    `on_result(district, report)` runs in the calling (Streamlit script) thread as
+    soon as each district finishes, so pages can render results progressively.
+    `fmt` picks the payload format of the prompts (JSON or COMPACT).
+    With `on_delta(district, text_so_far)` the completions are streamed and the
+    callback runs (also in the calling thread) as each district's tokens arrive.
+    Returns {district: report} for the districts that succeeded.
+    """
+    results = {}
+
+    async def run():
+        async with AsyncGroq(
+            api_key=os.environ.get("GROQ_API_KEY"), max_retries=0
+        ) as aclient:
+            async for district, report, error in _iter_district_analyses(
+                aclient,
+                district_data,
+                model=model,
+                concurrency=concurrency,
+                fmt=fmt,
+                on_delta=on_delta,
+            ):
+                if error is not None:
+                    st.error(f"Erro na análise do distrito {district}: {error}")
+                    continue
+                results[district] = report
+                if on_result is not None:
+                    on_result(district, report)
+
+    if district_data:
+        asyncio.run(run())
     return results
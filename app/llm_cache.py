@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+DEFAULT_PATH = os.getenv(
+    "LLM_CACHE_PATH",
+    os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), ".cache", "llm_responses.sqlite"
+    ),
+)
+DEFAULT_TTL_SECS = int(os.getenv("LLM_CACHE_TTL_SECS", 30 * 24 * 3600))
+DEFAULT_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 200 * 1024 * 1024))
+
+
+def make_key(prompt: str, model: str, temperature: float, max_tokens: int) -> str:
+    """Content address of a completion request."""
+    payload = json.dumps(
+        {
+            "prompt": prompt,
+            "model": model,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent LLM response cache in a local SQLite file.
+
+    • Entries expire after `ttl_secs`.
+    • When the stored responses exceed `max_bytes`, the least recently used
+      entries are evicted until the cache is back to ~90% of the limit. The total
+      size is kept in `cache_stats` by triggers, so a write never sums the table.
+    • One SQLite connection per thread (WAL mode), so the report thread pools
+      can read and write concurrently.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_PATH,
+        ttl_secs: int = DEFAULT_TTL_SECS,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.path = path
+        self.ttl_secs = ttl_secs
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._conn() as conn:
+            # One writer at a time sets up the schema and seeds the running total
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_access_idx ON responses (last_access)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_created_at_idx ON responses (created_at)"
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cache_stats (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    total_bytes INTEGER NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO cache_stats (id, total_bytes)
+                SELECT 0, COALESCE(SUM(size), 0) FROM responses
+                """
+            )
+            for name, event, delta in (
+                ("insert", "INSERT", "NEW.size"),
+                ("delete", "DELETE", "-OLD.size"),
+                ("update", "UPDATE OF size", "NEW.size - OLD.size"),
+            ):
+                conn.execute(
+                    f"""
+                    CREATE TRIGGER IF NOT EXISTS responses_size_{name}
+                    AFTER {event} ON responses
+                    BEGIN
+                        UPDATE cache_stats SET total_bytes = total_bytes + {delta} WHERE id = 0;
+                    END
+                    """
+                )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._conn() as conn:
+            row = conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            response, created_at = row
+            if now - created_at > self.ttl_secs:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (now, key)
+            )
+            return response
+
+    def put(self, key: str, response: str) -> None:
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._conn() as conn:
+            # An upsert rather than INSERT OR REPLACE: REPLACE's implicit delete
+            # does not fire the size triggers
+            conn.execute(
+                """
+                INSERT INTO responses (key, response, size, created_at, last_access)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    response = excluded.response,
+                    size = excluded.size,
+                    created_at = excluded.created_at,
+                    last_access = excluded.last_access
+                """,
+                (key, response, size, now, now),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_secs,))
+        total = conn.execute(
+            "SELECT total_bytes FROM cache_stats WHERE id = 0"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - int(self.max_bytes * 0.9)
+        # Oldest-accessed first, until enough bytes are freed
+        conn.execute(
+            """
+            DELETE FROM responses WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, size, SUM(size) OVER (ORDER BY last_access, key) AS running
+                    FROM responses
+                ) WHERE running - size < ?
+            )
+            """,
+            (excess,),
+        )
+
+    def clear(self) -> None:
+        with self._conn() as conn:
+            conn.execute("DELETE FROM responses")
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,132 @@
+"""
+Tarefas de manutenção da base de dados, para correr fora do Streamlit.
+
+Uso:
+    python manutencao.py reconstruir-resumo
+    python manutencao.py importar reunioes historico.csv
+    python manutencao.py worker
+    python manutencao.py enfileirar geral --formato compact
+    python manutencao.py snapshot [reunioes clientes ...] [--completo]
+
+Relatórios noturnos (cron), sem depender de um worker permanente:
+    0 2 * * * cd app && python manutencao.py enfileirar geral && python manutencao.py enfileirar regional && python manutencao.py enfileirar sugestoes && python manutencao.py worker --uma-vez
+
+Snapshots Parquet para as leituras analíticas (USAR_SNAPSHOTS=1 no Streamlit):
+    */15 * * * * cd app && python manutencao.py snapshot
+"""
+
+import argparse
+
+from chunker import FORMATS, JSON
+from db import rebuild_resumo_mensal
+from importacao import ENTIDADES, TAMANHO_BLOCO, importar
+
+
+def _reconstruir_resumo(args):
+    linhas = rebuild_resumo_mensal()
+    print(f"Resumo mensal reconstruído: {linhas} linhas.")
+
+
+def _importar(args):
+    resultado = importar(
+        args.entidade,
+        args.ficheiro,
+        tamanho_bloco=args.bloco,
+        progresso=lambda n: print(f"  {n} linhas lidas…"),
+    )
+    print(
+        f"{resultado['lidas']} linhas lidas, {resultado['validas']} válidas, "
+        f"{resultado['inseridas']} inseridas, {resultado['n_erros']} com erros."
+    )
+    for erro in resultado["erros"]:
+        print(f"  {erro}")
+
+
+def _worker(args):
+    # Importado aqui: só as tarefas LLM precisam do cliente Groq
+    from tarefas import worker
+
+    print("Worker de tarefas LLM a correr (Ctrl+C para parar).")
+    worker(uma_vez=args.uma_vez)
+
+
+def _enfileirar(args):
+    from llm import DEFAULT_MODEL
+    from tarefas import enfileirar
+
+    parametros = {"modelo": args.modelo or DEFAULT_MODEL}
+    if args.tipo == "sugestoes":
+        parametros["apenas_alterados"] = not args.todos
+    else:
+        parametros["formato"] = args.formato
+    if args.tipo == "cliente":
+        if args.cliente_id is None:
+            raise SystemExit("--cliente-id é obrigatório para relatórios de cliente")
+        parametros["cliente_id"] = args.cliente_id
+    tarefa_id = enfileirar(args.tipo, **parametros)
+    print(f"Tarefa {tarefa_id} enfileirada.")
+
+
+def _snapshot(args):
+    # Importado aqui: só os snapshots precisam do pyarrow
+    from snapshots import atualizar
+
+    try:
+        atualizar(args.tabelas or None, completo=args.completo)
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tarefas de manutenção")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p = sub.add_parser(
+        "reconstruir-resumo",
+        help="Reconstrói o resumo mensal de vendas a partir de `reunioes`",
+    )
+    p.set_defaults(func=_reconstruir_resumo)
+
+    p = sub.add_parser("importar", help="Importa um ficheiro CSV/Excel em massa")
+    p.add_argument("entidade", choices=sorted(ENTIDADES))
+    p.add_argument("ficheiro")
+    p.add_argument("--bloco", type=int, default=TAMANHO_BLOCO, help="Linhas por bloco")
+    p.set_defaults(func=_importar)
+
+    p = sub.add_parser("worker", help="Executa as tarefas LLM enfileiradas")
+    p.add_argument(
+        "--uma-vez", action="store_true", help="Termina quando a fila ficar vazia"
+    )
+    p.set_defaults(func=_worker)
+
+    p = sub.add_parser("enfileirar", help="Enfileira a geração de um relatório LLM")
+    p.add_argument("tipo", choices=["geral", "regional", "cliente", "sugestoes"])
+    p.add_argument("--cliente-id", type=int)
+    p.add_argument("--modelo", help="Modelo Groq (por omissão o do llm.py)")
+    p.add_argument("--formato", choices=FORMATS, default=JSON)
+    p.add_argument(
+        "--todos",
+        action="store_true",
+        help="Sugestões: regenera todos os clientes, não só os alterados",
+    )
+    p.set_defaults(func=_enfileirar)
+
+    p = sub.add_parser(
+        "snapshot", help="Atualiza os snapshots Parquet locais das tabelas de factos"
+    )
+    p.add_argument(
+        "tabelas",
+        nargs="*",
+        help="reunioes, vendas, clientes e/ou produtos (por omissão todas)",
+    )
+    p.add_argument(
+        "--completo", action="store_true", help="Reexporta tudo, não só o alterado"
+    )
+    p.set_defaults(func=_snapshot)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
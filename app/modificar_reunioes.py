@@ -1,7 +1,6 @@
 import streamlit as st
 import pandas as pd
 from db import (
-    get_clientes,
     get_produtos,
     get_ultimas_reunioes,
     add_cliente,
@@ -9,23 +8,16 @@ from db import (
     add_reuniao,
     get_max_cliente,
     update_reuniao,
-    get_connection,
     get_ultimas_reunioes_geral,
     get_all_reunioes,
 )
 import datetime as dt
 from streamlit_calendar import calendar
 
+from diretorio import seletor_cliente
 
-clientes_p2 = get_clientes()
-nomes_clientes_p2 = [c[1] for c in clientes_p2]
-cliente_selecionado_nome_p2 = st.selectbox("Selecione um cliente:", nomes_clientes_p2)
 
-cliente_id_selecionado_p2 = None
-for cliente in clientes_p2:
-    if cliente[1] == cliente_selecionado_nome_p2:
-        cliente_id_selecionado_p2 = cliente[0]
-        break
+cliente_id_selecionado_p2 = seletor_cliente(chave="cliente_modificar")
 
 reunioes_p2 = get_ultimas_reunioes(cliente_id_selecionado_p2)
 
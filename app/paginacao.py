@@ -0,0 +1,140 @@
+"""
+Paginação e renderização limitada de listas de cartões no Streamlit.
+
+Cada rerun envia ao browser um número limitado de elementos:
+• `estado_paginacao` / `controlos_paginacao` guardam a página atual (offset e
+  cursores de keyset) em st.session_state, para paginar no servidor;
+• `mostrar_cartoes` pagina um DataFrame já carregado e, acima de `limite_cartoes`
+  linhas, mostra-o como uma única tabela (virtualizada pelo st.dataframe), com a
+  opção de ver os cartões página a página.
+"""
+
+import math
+
+import streamlit as st
+
+POR_PAGINA = 20
+OPCOES_POR_PAGINA = (10, 20, 50, 100)
+LIMITE_CARTOES = 12
+
+
+def estado_paginacao(chave, filtros=()):
+    """
+    Estado da paginação `chave`: {"pagina": n, "cursores": [...]}.
+
+    `cursores` guarda, para keyset, o último id de cada página anterior. O estado
+    volta à primeira página quando `filtros` (qualquer valor comparável) muda.
+    """
+    estado = st.session_state.get(f"paginacao_{chave}")
+    if estado is None or estado["filtros"] != filtros:
+        estado = {"chave": chave, "filtros": filtros, "pagina": 0, "cursores": []}
+        st.session_state[f"paginacao_{chave}"] = estado
+    return estado
+
+
+def cursor(estado):
+    """Cursor de keyset da página atual (None na primeira página)."""
+    return estado["cursores"][-1] if estado["cursores"] else None
+
+
+def offset(estado, por_pagina):
+    return estado["pagina"] * por_pagina
+
+
+def seletor_por_pagina(
+    chave, rotulo="Por página", opcoes=OPCOES_POR_PAGINA, onde=st, padrao=POR_PAGINA
+):
+    """Selectbox do tamanho da página (`onde` pode ser, p.ex., st.sidebar)."""
+    return onde.selectbox(
+        rotulo,
+        opcoes,
+        index=opcoes.index(padrao) if padrao in opcoes else 0,
+        key=f"por_pagina_{chave}",
+    )
+
+
+def controlos_paginacao(
+    estado, tem_seguinte, ultimo_id=None, total=None, por_pagina=None
+):
+    """
+    Botões Anterior/Seguinte e indicação da página.
+
+    Para keyset, passe `ultimo_id` (id da última linha mostrada); para offset,
+    basta `tem_seguinte`. Com `total` e `por_pagina` mostra "Página x de y".
+    """
+    col_ant, col_info, col_seg = st.columns([1, 4, 1])
+    pagina = estado["pagina"]
+    if total is not None and por_pagina:
+        paginas = max(1, math.ceil(total / por_pagina))
+        col_info.caption(f"Página {pagina + 1} de {paginas}")
+    else:
+        col_info.caption(f"Página {pagina + 1}")
+
+    if col_ant.button(
+        "⬅️ Anterior", disabled=pagina == 0, key=f"paginacao_{estado['chave']}_ant"
+    ):
+        estado["pagina"] -= 1
+        if estado["cursores"]:
+            estado["cursores"].pop()
+        st.rerun()
+    if col_seg.button(
+        "Seguinte ➡️", disabled=not tem_seguinte, key=f"paginacao_{estado['chave']}_seg"
+    ):
+        estado["pagina"] += 1
+        if ultimo_id is not None:
+            estado["cursores"].append(ultimo_id)
+        st.rerun()
+
+
+def mostrar_cartoes(
+    df,
+    desenhar,
+    chave,
+    por_pagina=POR_PAGINA,
+    limite_cartoes=LIMITE_CARTOES,
+    por_linha=1,
+    colunas_tabela=None,
+):
+    """
+    Mostra as linhas de `df` como cartões (`desenhar(linha)`), `por_linha` por linha.
+
+    Até `limite_cartoes` linhas mostra todos os cartões; acima disso mostra uma
+    tabela (`colunas_tabela`, por omissão todas) e, se o utilizador preferir, os
+    cartões paginados `por_pagina` de cada vez.
+    """
+    if df.empty:
+        return
+
+    if len(df) > limite_cartoes:
+        como_cartoes = st.toggle(
+            f"Ver como cartões ({len(df)} itens)", key=f"cartoes_{chave}"
+        )
+        if not como_cartoes:
+            st.dataframe(
+                df[colunas_tabela] if colunas_tabela else df,
+                hide_index=True,
+                use_container_width=True,
+            )
+            return
+        estado = estado_paginacao(chave, (len(df), por_pagina))
+        inicio = offset(estado, por_pagina)
+        pagina = df.iloc[inicio : inicio + por_pagina]
+    else:
+        estado, pagina = None, df
+
+    for inicio_linha in range(0, len(pagina), por_linha):
+        linhas = pagina.iloc[inicio_linha : inicio_linha + por_linha]
+        if por_linha == 1:
+            desenhar(linhas.iloc[0])
+            continue
+        for col, (_, linha) in zip(st.columns(por_linha), linhas.iterrows()):
+            with col:
+                desenhar(linha)
+
+    if estado is not None:
+        controlos_paginacao(
+            estado,
+            tem_seguinte=inicio + por_pagina < len(df),
+            total=len(df),
+            por_pagina=por_pagina,
+        )
@@ -0,0 +1,206 @@
+"""
+Dados do dashboard de vendas.
+
+`carregar(ano, mes, dia)` faz as consultas do dashboard em paralelo (cada uma com
+a sua conexão do pool) e devolve a `base`: o resumo mensal num único DataFrame
+tipado (atributos como category, contagens inteiras, chaves de período já
+calculadas), construído uma vez e partilhado em cache. As secções derivam dela
+com consultas DuckDB (analitica.py); nenhuma a copia nem a altera.
+
+Com USAR_SNAPSHOTS=1 e snapshots exportados (`manutencao.py snapshot`), a base é
+calculada a partir dos ficheiros Parquet locais, sem ir à base de dados.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+import snapshots
+from analitica import consultar, snapshot
+from cache import cached
+from db import get_metricas_mes_a_mes, iterar_resumo_mensal
+
+COLUNAS_BASE = [
+    "mes",
+    "cliente_id",
+    "name",
+    "produto_id",
+    "ref",
+    "distrito",
+    "cultura",
+    "responsavel_principal",
+    "visitas",
+    "conversoes",
+    "receita",
+]
+CATEGORICAS = ("name", "ref", "distrito", "cultura", "responsavel_principal")
+
+
+def em_paralelo(**consultas):
+    """
+    Corre as funções `consultas` (nome → função sem argumentos) em threads.
+
+    As threads herdam o contexto do script, para que `st.*` dentro das consultas
+    continue a funcionar. Devolve {nome: resultado}.
+    """
+    ctx = get_script_run_ctx()
+
+    def correr(funcao):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return funcao()
+
+    with ThreadPoolExecutor(max_workers=len(consultas)) as executor:
+        futuros = {nome: executor.submit(correr, f) for nome, f in consultas.items()}
+        return {nome: futuro.result() for nome, futuro in futuros.items()}
+
+
+@cached(ttl=300, tags=("reunioes",))
+def base_resumo():
+    """
+    O resumo mensal como DataFrame tipado (partilhado: não alterar).
+
+    Lido em streaming: cada lote é reduzido aos tipos finais antes de se juntar
+    aos outros, pelo que o resultado nunca existe inteiro como tuplos Python.
+    """
+    if snapshots.USAR_SNAPSHOTS and snapshots.disponivel(*_TABELAS_SNAPSHOT):
+        return _base_de_snapshots()
+    lotes = [_tipar(lote) for lote in iterar_resumo_mensal()]
+    base = (
+        pd.concat(lotes, ignore_index=True)
+        if lotes
+        else _tipar(pd.DataFrame(columns=COLUNAS_BASE))
+    )
+    # As categorias só podem ser fixadas sobre o conjunto completo
+    return base.astype({coluna: "category" for coluna in CATEGORICAS})
+
+
+_TABELAS_SNAPSHOT = ("reunioes", "clientes", "produtos")
+
+
+def _base_de_snapshots():
+    """A mesma base, agregada (como o resumo mensal) a partir dos snapshots."""
+    resumo = consultar(f"""
+        SELECT
+            date_trunc('month', r.data_reuniao) AS mes,
+            r.cliente_id,
+            c.name,
+            r.produto_id,
+            p.ref,
+            c.distrito,
+            c.cultura,
+            c.responsavel_principal,
+            COUNT(r.houve_venda) AS visitas,
+            COUNT(*) FILTER (WHERE r.houve_venda = 'Sim') AS conversoes,
+            COALESCE(SUM(r.quantidade_vendida * r.preco_vendido), 0) AS receita
+        FROM {snapshot("reunioes")} r
+        JOIN {snapshot("clientes")} c ON c.id = r.cliente_id
+        LEFT JOIN {snapshot("produtos")} p ON p.produto_id = r.produto_id
+        -- As linhas do resumo mensal: mês × cliente × produto × distrito × distribuidor
+        GROUP BY 1, r.cliente_id, r.produto_id, c.distrito, r.supplier_id,
+                 c.name, c.cultura, c.responsavel_principal, p.ref
+        """)
+    return _tipar(resumo).astype({coluna: "category" for coluna in CATEGORICAS})
+
+
+def _tipar(lote):
+    # As reuniões sem data ficam com mes/ano nulos: contam nos totais, não nos meses
+    lote["mes"] = pd.to_datetime(lote["mes"])
+    lote["ano"] = lote["mes"].dt.year.astype("Int16")
+    lote["mes_numero"] = lote["mes"].dt.month.astype("Int8")
+    return lote.astype(
+        {"visitas": "int32", "conversoes": "int32", "receita": "float64"}
+    )
+
+
+def carregar(ano, mes, dia):
+    """
+    Carrega, em paralelo, a base e as métricas mês a mês (que precisam do corte
+    ao dia e por isso não saem do resumo). Devolve (base, metricas_mes_a_mes).
+    """
+    dados = em_paralelo(
+        base=base_resumo,
+        mes_a_mes=lambda: get_metricas_mes_a_mes(ano, mes, dia),
+    )
+    return dados["base"], dados["mes_a_mes"]
+
+
+# ---------------------------- Secções ---------------------------------
+# Cada secção é uma consulta DuckDB sobre `base`; as colunas que podem ser
+# escolhidas por parâmetro são validadas antes de entrarem no SQL
+_COLUNAS_TOP = {"name", "ref"}
+_COLUNAS_FUNIL = {"cultura", "responsavel_principal", "distrito"}
+
+
+def totais(base):
+    """(receita, visitas, visitas convertidas) de sempre."""
+    receita, visitas, conversoes = consultar(
+        """
+        SELECT COALESCE(SUM(receita), 0), COALESCE(SUM(visitas), 0), COALESCE(SUM(conversoes), 0)
+        FROM base
+        """,
+        base=base,
+    ).iloc[0]
+    return float(receita), int(visitas), int(conversoes)
+
+
+def conversao_por_distrito(base):
+    """Visitas e conversões por distrito (incluindo os distritos sem conversões)."""
+    return consultar(
+        """
+        SELECT
+            distrito::VARCHAR AS distrito,
+            SUM(visitas)::INTEGER AS numero_de_visitas,
+            SUM(conversoes)::INTEGER AS numero_de_visitas_convertidas
+        FROM base
+        WHERE distrito IS NOT NULL
+        GROUP BY 1
+        ORDER BY 1
+        """,
+        base=base,
+    )
+
+
+def top_por_mes(base, coluna):
+    """Para cada ano/mês, o valor de `coluna` (name, ref) com maior receita."""
+    if coluna not in _COLUNAS_TOP:
+        raise ValueError(f"Coluna inválida: {coluna}")
+    return consultar(
+        f"""
+        SELECT ano, mes_numero, {coluna}, total_vendido,
+               strftime(make_date(ano, mes_numero, 1), '%B') AS mes
+        FROM (
+            SELECT ano::INTEGER AS ano, mes_numero::INTEGER AS mes_numero,
+                   {coluna}::VARCHAR AS {coluna}, SUM(receita) AS total_vendido
+            FROM base
+            WHERE {coluna} IS NOT NULL AND ano IS NOT NULL
+            GROUP BY ALL
+        )
+        QUALIFY row_number() OVER (
+            PARTITION BY ano, mes_numero ORDER BY total_vendido DESC, {coluna}
+        ) = 1
+        ORDER BY ano, mes_numero
+        """,
+        base=base,
+    )
+
+
+def funil_por(base, coluna):
+    """Visitas, vendas e receita por `coluna` (cultura, responsavel_principal, distrito)."""
+    if coluna not in _COLUNAS_FUNIL:
+        raise ValueError(f"Coluna de agregação inválida: {coluna}")
+    return consultar(
+        f"""
+        SELECT
+            {coluna}::VARCHAR AS {coluna},
+            SUM(visitas)::INTEGER AS visitas,
+            SUM(conversoes)::INTEGER AS vendas,
+            SUM(receita) AS receita
+        FROM base
+        WHERE {coluna} IS NOT NULL
+        GROUP BY 1
+        ORDER BY 1
+        """,
+        base=base,
+    )
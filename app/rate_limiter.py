@@ -0,0 +1,112 @@
+import asyncio
+import time
+from threading import Lock
+from typing import Optional
+
+
+class Reservation:
+    """Tokens booked by one request, to be reconciled with the real usage later."""
+
+    __slots__ = ("tokens",)
+
+    def __init__(self, tokens: int):
+        self.tokens = tokens
+
+
+class TokenBucketLimiter:
+    """
+    Token-bucket limiter for a per-minute token budget and a per-minute request budget.
+
+    • Both buckets refill continuously (budget / 60 per second), so capacity freed
+      by finished requests is usable immediately instead of at a window boundary.
+    • The lock is only held to do the arithmetic; callers sleep outside it, so
+      a waiting thread never blocks the others.
+    • `reconcile` credits back reserved-but-unused tokens (or charges the overrun)
+      once the real `usage` is known (0 for a request that failed without output);
+      `penalize` honours a server `retry-after`.
+    • `acquire` is for threads, `acquire_async` for asyncio; both share the state.
+    """
+
+    def __init__(self, tokens_per_min: int, reqs_per_min: int):
+        self.token_capacity = float(tokens_per_min)
+        self.req_capacity = float(reqs_per_min)
+        self._token_rate = tokens_per_min / 60.0
+        self._req_rate = reqs_per_min / 60.0
+        self._tokens = self.token_capacity
+        self._reqs = self.req_capacity
+        self._last = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._last
+        self._last = now
+        self._tokens = min(self.token_capacity, self._tokens + elapsed * self._token_rate)
+        self._reqs = min(self.req_capacity, self._reqs + elapsed * self._req_rate)
+
+    def _booked(self, tokens: int) -> int:
+        """Tokens actually debited for a request of `tokens`."""
+        # A request larger than the whole budget can only run from a full bucket
+        return min(tokens, int(self.token_capacity))
+
+    def _try_take(self, tokens: int) -> float:
+        """Book the request if possible; otherwise return how long to wait (seconds)."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            if self._tokens >= tokens and self._reqs >= 1:
+                self._tokens -= tokens
+                self._reqs -= 1
+                return 0.0
+            wait_tokens = max(0.0, tokens - self._tokens) / self._token_rate
+            wait_reqs = max(0.0, 1 - self._reqs) / self._req_rate
+            return max(wait_tokens, wait_reqs)
+
+    def acquire(self, tokens: int) -> Reservation:
+        """Block (without holding the lock) until the request fits in both budgets."""
+        tokens = self._booked(tokens)
+        while True:
+            wait = self._try_take(tokens)
+            if wait <= 0:
+                return Reservation(tokens)
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int) -> Reservation:
+        """asyncio flavour of `acquire`; waits with asyncio.sleep."""
+        tokens = self._booked(tokens)
+        while True:
+            wait = self._try_take(tokens)
+            if wait <= 0:
+                return Reservation(tokens)
+            await asyncio.sleep(wait)
+
+    def reconcile(self, reservation: Reservation, actual_tokens: Optional[int]) -> None:
+        """Adjust the bucket once the real token usage of a request is known."""
+        if actual_tokens is None:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(
+                self.token_capacity,
+                self._tokens + reservation.tokens - actual_tokens,
+            )
+
+    def penalize(self, retry_after: float) -> None:
+        """Stop handing out capacity for `retry_after` seconds (server said so)."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """Seconds from a `retry-after` header, or None if absent/unparseable."""
+    if headers is None:
+        return None
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
@@ -0,0 +1,299 @@
+"""
+Geração incremental dos relatórios LLM (geral e por região).
+
+Cada análise parcial (segmento de reuniões ou distrito) fica guardada em
+`llm_analises_parciais` com a marca da última alteração (`data_criacao_linha` /
+`ultima_atualizacao`) e o nº de reuniões que cobria. Numa nova execução só são
+enviados ao LLM os segmentos/distritos com reuniões novas, alteradas ou apagadas;
+os restantes reutilizam a análise guardada antes de `aggregate_reports`.
+
+Os segmentos do relatório geral são intervalos contíguos de `reunioes.id`: as
+reuniões novas (id acima do último intervalo) formam novos segmentos e um
+intervalo alterado é reanalisado (e eventualmente repartido) por inteiro.
+"""
+
+import bisect
+from collections import defaultdict
+
+import pandas as pd
+
+from chunker import JSON, chunk_records
+from db import (
+    get_analises_parciais,
+    guardar_analises_parciais,
+    insert_llm_general_report,
+    insert_llm_regional_report,
+)
+from llm import (
+    DEFAULT_MODEL,
+    INTERNAL_COLUMNS,
+    aggregate_reports,
+    analyze_client,
+    analyze_districts,
+    analyze_segments,
+    chunk_budget,
+    fetch_marcas_intervalos,
+    fetch_marcas_por_distrito,
+    fetch_reunioes,
+    fetch_reunioes_por_cliente,
+    fetch_reunioes_por_distrito,
+)
+from sentimento import preprocess_sentiment
+
+
+def _contexto(model, formato=JSON):
+    """Configuração com que as análises foram geradas; outra configuração não as reutiliza."""
+    return f"{model}|{formato}"
+
+
+def _chave(intervalo):
+    return f"{intervalo[0]}-{intervalo[1]}"
+
+
+def _intervalo(chave):
+    ini, fim = chave.split("-")
+    return int(ini), int(fim)
+
+
+def _marca(registos):
+    marcas = [r["marca"] for r in registos if r["marca"] is not None]
+    return max(marcas) if marcas else None
+
+
+def _payload(registos):
+    return [{k: v for k, v in r.items() if k not in INTERNAL_COLUMNS} for r in registos]
+
+
+def _partir(ini, fim, registos, orcamento, formato=JSON):
+    """
+    Divide os registos de um intervalo de ids em segmentos dentro do orçamento de tokens.
+
+    Devolve [(intervalo, registos, texto)]; os intervalos cobrem [ini, fim] sem buracos
+    (daí a estratégia sequencial, que mantém a ordem dos ids).
+    """
+    if not registos:
+        return []
+    chunks = chunk_records(_payload(registos), orcamento, fmt=formato)
+    grupos = [c.indices for c in chunks]
+    segmentos = []
+    for k, grupo in enumerate(grupos):
+        seg_ini = ini if k == 0 else registos[grupo[0]]["reuniao_id"]
+        seg_fim = (
+            fim
+            if k == len(grupos) - 1
+            else registos[grupos[k + 1][0]]["reuniao_id"] - 1
+        )
+        segmentos.append(
+            (
+                (seg_ini, seg_fim),
+                [registos[i] for i in grupo],
+                chunks[k].text,
+            )
+        )
+    return segmentos
+
+
+def gerar_relatorio_geral(
+    model=DEFAULT_MODEL, formato=JSON, on_segment=None, render=None
+):
+    """
+    Gera e grava o relatório geral, reanalisando apenas os segmentos alterados.
+    `formato` é o formato dos dados nos prompts (JSON ou COMPACT).
+
+    `on_segment(indice, feitos, total, analise)` é chamado à medida que cada
+    segmento reanalisado termina, pela ordem em que terminam (`indice` é a posição
+    do segmento, a partir de 0). Com `render`, o relatório final é pedido em
+    streaming e `render(iterador_de_texto)` tem de o mostrar e devolver o texto
+    completo (ex.: `st.write_stream`); as análises dos segmentos já estão gravadas
+    antes disso.
+
+    Devolve {"relatorio", "segmentos", "reanalisados", "falhados"}, ou None se
+    nenhum segmento tiver análise disponível.
+    """
+    contexto = _contexto(model, formato)
+    guardados = {
+        _intervalo(chave): valor
+        for chave, valor in get_analises_parciais("segmento", contexto).items()
+    }
+    estado = fetch_marcas_intervalos(list(guardados))
+    alterados = sorted(
+        iv for iv, (marca, n, _) in guardados.items() if estado.get(iv) != (marca, n)
+    )
+    ultimo_id = max((fim for _, fim in guardados), default=0)
+
+    # 1) Só as reuniões dos intervalos alterados e as novas. Lidas aos lotes, mas
+    #    classificadas de uma só vez, já com o cursor fechado: um pool de processos
+    #    e uma ida a reunioes_sentimento para todas, não uma por lote
+    registos = fetch_reunioes(intervalos=alterados, desde_id=ultimo_id)
+    if registos:
+        registos = preprocess_sentiment(pd.DataFrame(registos)).to_dict(
+            orient="records"
+        )
+
+    inicios = [ini for ini, _ in alterados]
+    por_intervalo = defaultdict(list)
+    cauda = []
+    for reg in registos:
+        rid = reg["reuniao_id"]
+        if rid > ultimo_id:
+            cauda.append(reg)
+        else:
+            por_intervalo[alterados[bisect.bisect_right(inicios, rid) - 1]].append(reg)
+
+    # 2) Novos segmentos: (intervalo de origem ou None para a cauda, intervalo, registos, texto)
+    orcamento = chunk_budget(model, fmt=formato)
+    novos = []
+    for origem in alterados:
+        novos += [
+            (origem, *seg)
+            for seg in _partir(*origem, por_intervalo[origem], orcamento, formato)
+        ]
+    if cauda:
+        novos += [
+            (None, *seg)
+            for seg in _partir(
+                ultimo_id + 1, cauda[-1]["reuniao_id"], cauda, orcamento, formato
+            )
+        ]
+
+    chunks = [texto for _, _, _, texto in novos]
+    feitos = 0
+
+    def segmento_feito(indice, analise):
+        nonlocal feitos
+        feitos += 1
+        if on_segment is not None:
+            on_segment(indice, feitos, len(chunks), analise)
+
+    analises = (
+        analyze_segments(chunks, model=model, fmt=formato, on_result=segmento_feito)
+        if chunks
+        else []
+    )
+
+    # 3) Gravar; uma origem só substitui a análise antiga se todas as partes tiverem sucesso,
+    #    caso contrário fica como está e volta a ser detetada como alterada na próxima execução
+    por_origem = defaultdict(list)
+    for (origem, iv, regs, _), analise in zip(novos, analises):
+        por_origem[origem].append((iv, regs, analise))
+
+    linhas = []
+    # Intervalos cujas reuniões foram todas apagadas
+    remover = {_chave(iv) for iv in alterados if not por_intervalo[iv]}
+    for origem, segmentos in por_origem.items():
+        if any(analise is None for _, _, analise in segmentos):
+            continue
+        linhas += [
+            (_chave(iv), _marca(regs), len(regs), a) for iv, regs, a in segmentos
+        ]
+        if origem is not None:
+            remover.add(_chave(origem))
+    guardar_analises_parciais("segmento", contexto, linhas, remover)
+
+    # 4) Agregar, pela ordem dos ids, as análises reutilizadas e as novas
+    reanalisados = set(alterados)
+    atuais = {iv: a for iv, (_, _, a) in guardados.items() if iv not in reanalisados}
+    atuais.update({iv: a for (_, iv, _, _), a in zip(novos, analises) if a is not None})
+    if not atuais:
+        return None
+
+    ordenadas = [atuais[iv] for iv in sorted(atuais)]
+    if render is None:
+        final_report = aggregate_reports(ordenadas, model=model)
+    else:
+        final_report = render(aggregate_reports(ordenadas, model=model, stream=True))
+    insert_llm_general_report(final_report)
+    return {
+        "relatorio": final_report,
+        "segmentos": len(atuais),
+        "reanalisados": sum(a is not None for a in analises),
+        "falhados": sum(a is None for a in analises),
+    }
+
+
+def relatorio_regional_markdown(relatorios):
+    """Junta os relatórios por distrito num único documento markdown."""
+    return "\n\n---\n\n".join(
+        f"## 📍 Região: {distrito}\n\n{relatorio}"
+        for distrito, relatorio in relatorios.items()
+    )
+
+
+def gerar_relatorio_regional(
+    model=DEFAULT_MODEL, on_district=None, formato=JSON, on_partial=None
+):
+    """
+    Gera e grava o relatório por região, reanalisando apenas os distritos alterados.
+
+    `on_district(distrito, relatorio)` é chamado para cada distrito disponível: logo
+    para os reutilizados e à medida que cada distrito reanalisado termina. Com
+    `on_partial(distrito, texto_ate_agora)` as análises são pedidas em streaming e o
+    texto parcial de cada distrito é entregue à medida que chega.
+
+    Devolve {"relatorios": {distrito: relatorio}, "reanalisados", "falhados"}.
+    """
+    contexto = _contexto(model, formato)
+    guardados = get_analises_parciais("distrito", contexto)
+    # Marcas lidas antes dos dados: uma alteração entretanto fica para a próxima execução
+    marcas = fetch_marcas_por_distrito()
+    alterados = [
+        d
+        for d, marca in marcas.items()
+        if d not in guardados or guardados[d][:2] != marca
+    ]
+
+    if on_district is not None:
+        for distrito in sorted(set(marcas) & set(guardados) - set(alterados)):
+            on_district(distrito, guardados[distrito][2])
+
+    novos = (
+        analyze_districts(
+            fetch_reunioes_por_distrito(alterados),
+            model=model,
+            on_result=on_district,
+            fmt=formato,
+            on_delta=on_partial,
+        )
+        if alterados
+        else {}
+    )
+
+    guardar_analises_parciais(
+        "distrito",
+        contexto,
+        [(d, *marcas[d], analise) for d, analise in novos.items()],
+        remover=[d for d in guardados if d not in marcas],
+    )
+
+    relatorios = {}
+    for distrito in sorted(marcas):
+        if distrito in novos:
+            relatorios[distrito] = novos[distrito]
+        elif distrito not in alterados:
+            relatorios[distrito] = guardados[distrito][2]
+
+    if relatorios:
+        insert_llm_regional_report(relatorio_regional_markdown(relatorios))
+    return {
+        "relatorios": relatorios,
+        "reanalisados": len(novos),
+        "falhados": len(alterados) - len(novos),
+    }
+
+
+def gerar_relatorio_cliente(cliente_id, model=DEFAULT_MODEL, formato=JSON):
+    """
+    Gera e grava (tipo `cliente:<id>`) o relatório de um cliente.
+
+    Devolve o relatório, ou None se o cliente não tiver reuniões.
+    """
+    registos = [
+        reg
+        for lista in fetch_reunioes_por_cliente(cliente_id).values()
+        for reg in lista
+    ]
+    if not registos:
+        return None
+    relatorio = analyze_client(registos, model=model, fmt=formato)
+    insert_llm_general_report(relatorio, report_type=f"cliente:{cliente_id}")
+    return relatorio
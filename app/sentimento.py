@@ -0,0 +1,87 @@
+"""
+Classificação de sentimento das descrições das reuniões.
+
+Cada descrição é analisada uma única vez (uma só passagem do TextBlob), as
+descrições vazias/None ficam "Neutral", e para volumes grandes o trabalho é
+repartido por um pool de processos. Os resultados ficam guardados em
+`reunioes_sentimento`, por `reunioes.id` + marca da última alteração, pelo que
+uma reunião que não mudou nunca volta a ser classificada.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from textblob import TextBlob
+
+from db import get_sentimentos, guardar_sentimentos
+
+POSITIVE_THRESHOLD = 0.2
+NEGATIVE_THRESHOLD = -0.2
+
+# Abaixo disto o custo de arrancar processos não compensa
+PARALLEL_THRESHOLD = 2_000
+
+
+def classify(texto):
+    """Sentimento ("Positive", "Negative" ou "Neutral") de um texto."""
+    if texto is None or (isinstance(texto, float) and pd.isna(texto)):
+        return "Neutral"
+    texto = str(texto).strip()
+    if not texto:
+        return "Neutral"
+    polarity = TextBlob(texto).sentiment.polarity
+    if polarity > POSITIVE_THRESHOLD:
+        return "Positive"
+    if polarity < NEGATIVE_THRESHOLD:
+        return "Negative"
+    return "Neutral"
+
+
+def classify_many(textos):
+    """Classifica uma lista de textos, em paralelo quando são muitos."""
+    textos = list(textos)
+    if len(textos) < PARALLEL_THRESHOLD:
+        return [classify(t) for t in textos]
+    workers = os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(
+            executor.map(
+                classify, textos, chunksize=max(1, len(textos) // (workers * 4))
+            )
+        )
+
+
+def preprocess_sentiment(df):
+    """
+    Acrescenta a coluna `sentiment` a um DataFrame de reuniões.
+
+    Se o DataFrame tiver `reuniao_id` e `marca`, reutiliza as classificações
+    guardadas e só classifica (e guarda) as reuniões novas ou alteradas.
+    """
+    if df.empty:
+        df["sentiment"] = pd.Series(dtype="object")
+        return df
+
+    if "reuniao_id" not in df.columns or "marca" not in df.columns:
+        df["sentiment"] = classify_many(df["descricao"])
+        return df
+
+    ids = [int(i) for i in df["reuniao_id"]]
+    guardados = get_sentimentos(ids)
+    sentimentos = [
+        guardados[i][1] if i in guardados and guardados[i][0] == marca else None
+        for i, marca in zip(ids, df["marca"])
+    ]
+
+    em_falta = [pos for pos, s in enumerate(sentimentos) if s is None]
+    if em_falta:
+        novos = classify_many(df["descricao"].iloc[em_falta])
+        for pos, sentimento in zip(em_falta, novos):
+            sentimentos[pos] = sentimento
+        guardar_sentimentos(
+            [(ids[pos], df["marca"].iloc[pos], sentimentos[pos]) for pos in em_falta]
+        )
+
+    df["sentiment"] = sentimentos
+    return df
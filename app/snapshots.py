@@ -0,0 +1,257 @@
+"""
+Snapshots locais em Parquet das tabelas de factos, para leituras analíticas.
+
+`atualizar()` exporta `reunioes` e `vendas` (partições mensais hive, `mes=AAAA-MM`,
+pela data da reunião/venda) e `clientes` e `produtos` (um só ficheiro) para
+SNAPSHOT_DIR. A atualização é incremental: para cada partição compara o nº de
+linhas e a última alteração (`data_criacao_linha` / `ultima_atualizacao`; nas
+tabelas sem essas colunas, um md5 das linhas) com os da exportação anterior e só
+volta a escrever as partições diferentes, removendo as que deixaram de existir.
+Cada ficheiro é escrito aos lotes (cursor no servidor) e substituído atomicamente.
+
+`ler()` lê um snapshot com predicate pushdown: só abre as partições dentro de
+`desde`/`ate` e aplica `filtros` aos row groups. Com USAR_SNAPSHOTS=1 o
+dashboard lê daqui em vez de ir à base de dados.
+"""
+
+import json
+import os
+import shutil
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from db import conexao, iterar_lotes
+
+SNAPSHOT_DIR = os.getenv(
+    "SNAPSHOT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "snapshots"),
+)
+USAR_SNAPSHOTS = os.getenv("USAR_SNAPSHOTS", "").lower() in ("1", "true", "sim")
+
+# tabela -> coluna de data das partições mensais (None: um só ficheiro)
+TABELAS = {
+    "reunioes": "data_reuniao",
+    "vendas": "data",
+    "clientes": None,
+    "produtos": None,
+}
+
+COLUNA_PARTICAO = "mes"
+# Partição das linhas sem data; o pyarrow lê-a como `mes` nulo
+SEM_DATA = "__HIVE_DEFAULT_PARTITION__"
+TODAS = "todas"  # chave da única "partição" das tabelas não particionadas
+
+_COLUNAS_MARCA = ("data_criacao_linha", "ultima_atualizacao")
+_ESTADO = "_estado.json"  # começa por "_": o pyarrow ignora-o ao ler o dataset
+_FICHEIRO = "dados.parquet"
+_PARTICOES = ds.partitioning(pa.schema([(COLUNA_PARTICAO, pa.string())]), flavor="hive")
+
+# OID do tipo PostgreSQL -> tipo Arrow; os restantes são exportados como texto
+_TIPOS_ARROW = {
+    16: pa.bool_(),
+    20: pa.int64(),
+    21: pa.int16(),
+    23: pa.int32(),
+    700: pa.float64(),
+    701: pa.float64(),
+    1700: pa.float64(),  # numeric: exportado como float8
+    1082: pa.date32(),
+    1114: pa.timestamp("us"),
+    1184: pa.timestamp("us", tz="UTC"),
+}
+_TIPOS_TEXTO = {25, 1042, 1043}
+
+
+def _esquema(descricao):
+    """(lista do SELECT, esquema Arrow) a partir de cursor.description."""
+    selecao, campos = [], []
+    for coluna in descricao:
+        nome, oid = coluna[0], coluna[1]
+        if oid == 1700:
+            selecao.append(f'"{nome}"::float8 AS "{nome}"')
+        elif oid in _TIPOS_ARROW or oid in _TIPOS_TEXTO:
+            selecao.append(f'"{nome}"')
+        else:
+            selecao.append(f'"{nome}"::text AS "{nome}"')
+        campos.append(pa.field(nome, _TIPOS_ARROW.get(oid, pa.string())))
+    return selecao, pa.schema(campos)
+
+
+def _impressoes(cur, tabela, coluna_data, colunas):
+    """{partição: [nº de linhas, última alteração ou md5]} da tabela na base de dados."""
+    marcas = [c for c in _COLUNAS_MARCA if c in colunas]
+    if marcas:
+        agregado = (
+            f"to_char(MAX(GREATEST({', '.join(marcas)})), 'YYYY-MM-DD HH24:MI:SS.US')"
+        )
+    else:
+        agregado = "md5(string_agg(t::text, '|' ORDER BY t::text))"
+    if coluna_data is None:
+        cur.execute(f"SELECT COUNT(*), {agregado} FROM {tabela} t;")
+        n, marca = cur.fetchone()
+        return {TODAS: [n, marca]} if n else {}
+    cur.execute(f"""SELECT to_char({coluna_data}, 'YYYY-MM'), COUNT(*), {agregado}
+            FROM {tabela} t
+            GROUP BY 1;""")
+    return {(mes or SEM_DATA): [n, marca] for mes, n, marca in cur.fetchall()}
+
+
+def _caminho(tabela, particao=None):
+    if particao is None or particao == TODAS:
+        return os.path.join(SNAPSHOT_DIR, tabela)
+    return os.path.join(SNAPSHOT_DIR, tabela, f"{COLUNA_PARTICAO}={particao}")
+
+
+def _ler_estado(tabela):
+    try:
+        with open(os.path.join(_caminho(tabela), _ESTADO), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _gravar_estado(tabela, estado):
+    caminho = os.path.join(_caminho(tabela), _ESTADO)
+    with open(caminho + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(estado, f)
+    os.replace(caminho + ".tmp", caminho)
+
+
+def _exportar_particao(tabela, coluna_data, particao, selecao, esquema):
+    """Escreve uma partição, lote a lote, e substitui o ficheiro anterior de uma vez."""
+    where, params = "", None
+    if particao == SEM_DATA:
+        where = f"WHERE {coluna_data} IS NULL"
+    elif particao != TODAS:
+        where = (
+            f"WHERE {coluna_data} >= %(inicio)s::date "
+            f"AND {coluna_data} < %(inicio)s::date + INTERVAL '1 month'"
+        )
+        params = {"inicio": f"{particao}-01"}
+
+    pasta = _caminho(tabela, particao)
+    os.makedirs(pasta, exist_ok=True)
+    # Começa por ".": um leitor nunca vê o ficheiro a meio
+    temporario = os.path.join(pasta, f".{_FICHEIRO}.tmp")
+    tipos = [campo.type for campo in esquema]
+    with pq.ParquetWriter(temporario, esquema, compression="zstd") as writer:
+        for linhas in iterar_lotes(
+            f"SELECT {', '.join(selecao)} FROM {tabela} {where};", params
+        ):
+            colunas = zip(*linhas)
+            writer.write_table(
+                pa.Table.from_arrays(
+                    [pa.array(valores, type=t) for valores, t in zip(colunas, tipos)],
+                    schema=esquema,
+                )
+            )
+    os.replace(temporario, os.path.join(pasta, _FICHEIRO))
+
+
+def atualizar(tabelas=None, completo=False, log=print):
+    """
+    Atualiza os snapshots de `tabelas` (por omissão todas as de TABELAS).
+
+    Só reescreve as partições alteradas desde a última exportação (todas, com
+    `completo` ou se as colunas da tabela mudaram). As impressões são lidas antes
+    dos dados: uma escrita entretanto é apanhada na execução seguinte.
+    Devolve {tabela: {"exportadas": n, "removidas": n}}.
+    """
+    tabelas = list(tabelas or TABELAS)
+    desconhecidas = set(tabelas) - set(TABELAS)
+    if desconhecidas:
+        raise ValueError(f"Tabelas sem snapshot: {', '.join(sorted(desconhecidas))}")
+
+    metadados = {}
+    with conexao() as conn:
+        with conn.cursor() as cur:
+            for tabela in tabelas:
+                cur.execute("SELECT to_regclass(%s);", (tabela,))
+                if cur.fetchone()[0] is None:
+                    log(f"{tabela}: tabela inexistente, ignorada.")
+                    continue
+                cur.execute(f"SELECT * FROM {tabela} LIMIT 0;")
+                descricao = cur.description
+                colunas = [coluna[0] for coluna in descricao]
+                metadados[tabela] = (
+                    _esquema(descricao),
+                    colunas,
+                    _impressoes(cur, tabela, TABELAS[tabela], colunas),
+                )
+        conn.rollback()
+
+    resultado = {}
+    for tabela, ((selecao, esquema), colunas, impressoes) in metadados.items():
+        coluna_data = TABELAS[tabela]
+        anterior = _ler_estado(tabela)
+        if completo or anterior is None or anterior["colunas"] != colunas:
+            if os.path.isdir(_caminho(tabela)):
+                shutil.rmtree(_caminho(tabela))
+            anterior = {"colunas": colunas, "particoes": {}}
+        os.makedirs(_caminho(tabela), exist_ok=True)
+
+        estado = {"colunas": colunas, "particoes": dict(anterior["particoes"])}
+        alteradas = [
+            p
+            for p, impressao in impressoes.items()
+            if anterior["particoes"].get(p) != impressao
+        ]
+        removidas = [p for p in anterior["particoes"] if p not in impressoes]
+
+        for particao in removidas:
+            if particao == TODAS:
+                os.remove(os.path.join(_caminho(tabela), _FICHEIRO))
+            else:
+                shutil.rmtree(_caminho(tabela, particao), ignore_errors=True)
+            del estado["particoes"][particao]
+        for particao in sorted(alteradas):
+            _exportar_particao(tabela, coluna_data, particao, selecao, esquema)
+            estado["particoes"][particao] = impressoes[particao]
+            # Gravado a cada partição: uma interrupção não obriga a recomeçar
+            _gravar_estado(tabela, estado)
+        _gravar_estado(tabela, estado)
+
+        resultado[tabela] = {"exportadas": len(alteradas), "removidas": len(removidas)}
+        log(
+            f"{tabela}: {len(alteradas)} partições exportadas, "
+            f"{len(removidas)} removidas, {len(impressoes)} no total."
+        )
+    return resultado
+
+
+def disponivel(*tabelas):
+    """Se já existe snapshot de todas as `tabelas`."""
+    return all(_ler_estado(tabela) is not None for tabela in tabelas)
+
+
+def ler(tabela, colunas=None, filtros=None, desde=None, ate=None):
+    """
+    Lê o snapshot de `tabela` como DataFrame.
+
+    `colunas` limita as colunas lidas. `filtros` são filtros pyarrow em DNF, p.ex.
+    [("houve_venda", "==", "Sim")], avaliados nos ficheiros (row groups cujas
+    estatísticas os excluem nem são lidos). `desde`/`ate` ("AAAA-MM", inclusivos)
+    restringem as partições mensais abertas; as linhas sem data ficam de fora.
+    """
+    particionada = TABELAS[tabela] is not None
+    if not particionada and (desde or ate):
+        raise ValueError(f"O snapshot de {tabela} não é particionado por mês")
+    if _ler_estado(tabela) is None:
+        raise FileNotFoundError(f"Sem snapshot de {tabela} em {SNAPSHOT_DIR}")
+
+    dataset = ds.dataset(
+        _caminho(tabela),
+        format="parquet",
+        partitioning=_PARTICOES if particionada else None,
+    )
+    condicoes = [pq.filters_to_expression(filtros)] if filtros else []
+    if desde:
+        condicoes.append(ds.field(COLUNA_PARTICAO) >= desde)
+    if ate:
+        condicoes.append(ds.field(COLUNA_PARTICAO) <= ate)
+    expressao = None
+    for condicao in condicoes:
+        expressao = condicao if expressao is None else expressao & condicao
+    return dataset.to_table(columns=colunas, filter=expressao).to_pandas()
@@ -1,34 +1,60 @@
 import streamlit as st
 import pandas as pd
-from db import get_sugestao_de_vendas
+from db import contar_sugestoes, get_filtros_sugestoes, get_sugestoes
+from paginacao import (
+    controlos_paginacao,
+    cursor,
+    estado_paginacao,
+    offset,
+    seletor_por_pagina,
+)
 
+COLUNAS = ["ID", "Timestamp", "Cliente", "Local", "Cultura", "Área", "Sugestão"]
 
-# 1️⃣ Sidebar filters
-st.sidebar.header("🔍 Filtros")
-sugestoes = get_sugestao_de_vendas()
-df = pd.DataFrame(
-    sugestoes,
-    columns=["ID", "Timestamp", "Cliente", "Local", "Cultura", "Área", "Sugestão"],
-)
 
-clients = df["Cliente"].unique().tolist()
-selected_client = st.sidebar.multiselect("Cliente", options=clients, default=clients)
+# 1️⃣ Sidebar filters (applied in the database; empty = all)
+st.sidebar.header("🔍 Filtros")
+clientes, distritos = get_filtros_sugestoes()
+nomes_clientes = dict(clientes)
 
-districts = df["Local"].unique().tolist()
+selected_client = st.sidebar.multiselect(
+    "Cliente",
+    options=list(nomes_clientes),
+    format_func=lambda i: nomes_clientes[i],
+    placeholder="Todos",
+)
 selected_district = st.sidebar.multiselect(
-    "Local", options=districts, default=districts
+    "Local", options=distritos, placeholder="Todos"
+)
+por_pagina = seletor_por_pagina(
+    "sugestoes", rotulo="Sugestões por página", onde=st.sidebar
 )
 
-filtered = df[df["Cliente"].isin(selected_client) & df["Local"].isin(selected_district)]
+# Keyset pagination in the database; back to page 1 when the filters change
+pagina = estado_paginacao(
+    "sugestoes", (tuple(selected_client), tuple(selected_district), por_pagina)
+)
+sugestoes = get_sugestoes(
+    clientes=selected_client,
+    distritos=selected_district,
+    antes_de=cursor(pagina),
+    limite=por_pagina + 1,
+)
+tem_seguinte = len(sugestoes) > por_pagina
+df = pd.DataFrame(sugestoes[:por_pagina], columns=COLUNAS)
+total = contar_sugestoes(selected_client, selected_district)
 
 # 2️⃣ Main title
 st.title("📊 Sugestões de Vendas por Cliente")
-st.write(f"Mostrando **{len(filtered)}** sugestões")
+inicio = offset(pagina, por_pagina)
+st.write(
+    f"Mostrando **{inicio + 1 if len(df) else 0}–{inicio + len(df)}** de **{total}** sugestões"
+)
 
 # 3️⃣ Render each suggestion in an expander
-for idx, row in filtered.iterrows():
+for pos, row in df.iterrows():
     with st.expander(
-        f"🧾 Sugestão {idx + 1} • Cliente: {row['Cliente']} • Local: {row['Local']}"
+        f"🧾 Sugestão {inicio + pos + 1} • Cliente: {row['Cliente']} • Local: {row['Local']}"
     ):
         col1, col2 = st.columns(2)
         col1.markdown(f"**ID:** {row['ID']}")
@@ -39,10 +65,18 @@ for idx, row in filtered.iterrows():
         st.write(row["Sugestão"])
         st.markdown("---")
 
+controlos_paginacao(
+    pagina,
+    tem_seguinte,
+    ultimo_id=int(df["ID"].iloc[-1]) if len(df) else None,
+    total=total,
+    por_pagina=por_pagina,
+)
+
 # 4️⃣ Optional: show raw table
-with st.expander("📋 Ver todas as sugestões (tabela bruta)"):
-    st.dataframe(filtered.reset_index(drop=True))
+with st.expander("📋 Ver sugestões desta página (tabela bruta)"):
+    st.dataframe(df)
 
 # 5️⃣ Graceful empty state
-if filtered.empty:
+if df.empty:
     st.info("Nenhuma sugestão disponível para os filtros selecionados.")
@@ -0,0 +1,81 @@
+"""
+Geração em lote das sugestões de venda (`sugestoes_para_clientes_by_llm`).
+
+O histórico recente de todos os clientes vem numa só query; os clientes são
+agrupados (formato compacto, vários clientes por prompt até ao orçamento de
+tokens), os prompts correm em paralelo sob o rate limiter partilhado e as
+sugestões são gravadas de uma vez. Por omissão só são gerados os clientes com
+reuniões novas/alteradas desde a última sugestão.
+"""
+
+from chunker import COMPACT, GROUPED, chunk_records
+from db import guardar_sugestoes
+from llm import (
+    DEFAULT_MODEL,
+    MAX_CLIENTS_PER_PROMPT,
+    fetch_historicos_clientes,
+    suggest_for_clients,
+    suggestion_budget,
+)
+
+# Reuniões mais recentes de cada cliente enviadas ao LLM
+MAX_REUNIOES_POR_CLIENTE = 10
+
+
+def gerar_sugestoes(
+    model=DEFAULT_MODEL,
+    apenas_alterados=True,
+    max_reunioes=MAX_REUNIOES_POR_CLIENTE,
+    progresso=None,
+):
+    """
+    Gera e grava as sugestões de venda.
+
+    `progresso(mensagem)` é chamado em cada etapa. Devolve
+    {"clientes", "lotes", "geradas", "falhadas"}.
+    """
+    registos, numeros = fetch_historicos_clientes(max_reunioes, apenas_alterados)
+    if not registos:
+        return {"clientes": 0, "lotes": 0, "geradas": 0, "falhadas": 0}
+
+    chunks = chunk_records(
+        registos,
+        suggestion_budget(model, COMPACT),
+        strategy=GROUPED,
+        key="cliente_id",
+        max_keys=MAX_CLIENTS_PER_PROMPT,
+        fmt=COMPACT,
+    )
+    clientes_por_lote = [
+        list(dict.fromkeys(registos[i]["cliente_id"] for i in c.indices))
+        for c in chunks
+    ]
+    if progresso is not None:
+        progresso(f"{len(numeros)} clientes em {len(chunks)} lotes")
+
+    resultados = suggest_for_clients(
+        [c.text for c in chunks],
+        [len(clientes) for clientes in clientes_por_lote],
+        model=model,
+        fmt=COMPACT,
+    )
+
+    # Um cliente grande demais para um lote aparece em vários; fica a sugestão do
+    # último, que tem as reuniões mais recentes
+    sugestoes = {}
+    for clientes, resultado in zip(clientes_por_lote, resultados):
+        for cliente_id in clientes:
+            if resultado is not None and cliente_id in resultado:
+                sugestoes[cliente_id] = resultado[cliente_id]
+
+    geradas = guardar_sugestoes(
+        [(numeros[cliente_id], texto) for cliente_id, texto in sugestoes.items()]
+    )
+    if progresso is not None:
+        progresso(f"{geradas} sugestões gravadas")
+    return {
+        "clientes": len(numeros),
+        "lotes": len(chunks),
+        "geradas": geradas,
+        "falhadas": len(numeros) - len(sugestoes),
+    }
@@ -0,0 +1,223 @@
+"""
+Fila de tarefas LLM em segundo plano.
+
+As páginas só enfileiram (`enfileirar`) e acompanham o progresso; quem gera os
+relatórios é um processo worker separado (`python manutencao.py worker`), por isso
+fechar o separador ou recarregar a página não perde o trabalho. Pedidos iguais
+(mesmo tipo e parâmetros) enquanto um está pendente/em curso juntam-se a esse, em vez
+de gastarem tokens duas vezes. O progresso fica em `llm_tarefas_progresso` (com o
+texto de cada segmento/distrito concluído) e os relatórios em `llm_reports`.
+O texto que ainda está a chegar (o relatório final, as análises dos distritos)
+fica em `llm_tarefas.parcial`, para a página o mostrar enquanto é escrito.
+"""
+
+import threading
+import time
+import traceback
+
+from chunker import JSON
+from db import (
+    TAREFA_ATIVA,
+    concluir_tarefa,
+    enfileirar_tarefa,
+    manter_tarefa_viva,
+    registar_parcial,
+    registar_progresso,
+    reservar_tarefa,
+)
+from llm import DEFAULT_MODEL
+from relatorios import (
+    gerar_relatorio_cliente,
+    gerar_relatorio_geral,
+    gerar_relatorio_regional,
+)
+from sugestoes import gerar_sugestoes
+
+# Segundos entre consultas à fila quando não há trabalho
+INTERVALO_POLL = 2
+
+# Uma tarefa em curso sem sinal de vida há mais do que isto volta à fila
+PRAZO_MINUTOS = 15
+
+# Segundos entre gravações do texto parcial (a página consulta a cada 2 s)
+INTERVALO_PARCIAL = 1
+
+
+class _Parcial:
+    """
+    Texto a chegar do LLM numa tarefa, por título, gravado em `llm_tarefas.parcial`
+    no máximo a cada INTERVALO_PARCIAL segundos.
+
+    `partes` é a lista dos pedaços recebidos até agora; só é juntada ao gravar.
+    """
+
+    def __init__(self, tarefa_id):
+        self.tarefa_id = tarefa_id
+        self._partes = {}
+        self._gravado_em = 0.0
+        self._lock = threading.Lock()
+
+    def atualizar(self, titulo, partes):
+        with self._lock:
+            self._partes[titulo] = partes
+            self._gravar(forcar=False)
+
+    def terminar(self, titulo):
+        with self._lock:
+            if self._partes.pop(titulo, None) is not None:
+                self._gravar(forcar=True)
+
+    def _gravar(self, forcar):
+        agora = time.monotonic()
+        if not forcar and agora - self._gravado_em < INTERVALO_PARCIAL:
+            return
+        self._gravado_em = agora
+        registar_parcial(
+            self.tarefa_id,
+            {titulo: "".join(partes) for titulo, partes in self._partes.items()},
+        )
+
+
+TITULO_FINAL = "Relatório final"
+
+
+def _executar_geral(tarefa_id, modelo=DEFAULT_MODEL, formato=JSON):
+    def segmento(indice, feitos, total, analise):
+        registar_progresso(
+            tarefa_id,
+            "Segmento analisado",
+            feitos,
+            total,
+            titulo=f"Segmento {indice + 1}",
+            conteudo=analise,
+        )
+
+    parcial = _Parcial(tarefa_id)
+
+    def render(texto):
+        partes = []
+        for pedaco in texto:
+            partes.append(pedaco)
+            parcial.atualizar(TITULO_FINAL, partes)
+        parcial.terminar(TITULO_FINAL)
+        return "".join(partes)
+
+    registar_progresso(tarefa_id, "A analisar segmentos")
+    resultado = gerar_relatorio_geral(
+        modelo, formato, on_segment=segmento, render=render
+    )
+    if resultado is None:
+        raise RuntimeError("Nenhum segmento foi analisado com sucesso.")
+    registar_progresso(tarefa_id, "Relatório geral gravado")
+    return {k: resultado[k] for k in ("segmentos", "reanalisados", "falhados")}
+
+
+def _executar_regional(tarefa_id, modelo=DEFAULT_MODEL, formato=JSON):
+    feitos = 0
+    parcial = _Parcial(tarefa_id)
+
+    def distrito(nome, relatorio):
+        nonlocal feitos
+        feitos += 1
+        registar_progresso(
+            tarefa_id, "Distrito analisado", feitos, titulo=nome, conteudo=relatorio
+        )
+        parcial.terminar(nome)
+
+    registar_progresso(tarefa_id, "A analisar distritos")
+    resultado = gerar_relatorio_regional(
+        modelo,
+        on_district=distrito,
+        formato=formato,
+        on_partial=lambda nome, texto: parcial.atualizar(nome, [texto]),
+    )
+    registar_progresso(tarefa_id, "Relatório regional gravado")
+    return {
+        "distritos": len(resultado["relatorios"]),
+        "reanalisados": resultado["reanalisados"],
+        "falhados": resultado["falhados"],
+    }
+
+
+def _executar_cliente(tarefa_id, cliente_id, modelo=DEFAULT_MODEL, formato=JSON):
+    registar_progresso(tarefa_id, "A analisar as reuniões do cliente")
+    relatorio = gerar_relatorio_cliente(cliente_id, modelo, formato)
+    if relatorio is None:
+        raise RuntimeError("O cliente não tem reuniões.")
+    registar_progresso(tarefa_id, "Relatório do cliente gravado")
+    return {"cliente_id": cliente_id}
+
+
+def _executar_sugestoes(tarefa_id, modelo=DEFAULT_MODEL, apenas_alterados=True):
+    return gerar_sugestoes(
+        modelo,
+        apenas_alterados=apenas_alterados,
+        progresso=lambda mensagem: registar_progresso(tarefa_id, mensagem),
+    )
+
+
+TIPOS = {
+    "geral": _executar_geral,
+    "regional": _executar_regional,
+    "cliente": _executar_cliente,
+    "sugestoes": _executar_sugestoes,
+}
+
+
+def enfileirar(tipo, **parametros):
+    """
+    Enfileira um relatório (`geral`, `regional`, `cliente`) ou a geração das
+    sugestões de venda (`sugestoes`) e devolve o id da tarefa.
+    """
+    if tipo not in TIPOS:
+        raise ValueError(f"Tipo de tarefa desconhecido: {tipo}")
+    return enfileirar_tarefa(tipo, parametros)
+
+
+def ativa(tarefa):
+    return tarefa is not None and tarefa["estado"] in TAREFA_ATIVA
+
+
+def tipo_relatorio(tarefa):
+    """Tipo (`llm_reports.type`) do relatório que a tarefa grava."""
+    if tarefa["tipo"] == "cliente":
+        return f"cliente:{tarefa['parametros']['cliente_id']}"
+    return {"geral": "general", "regional": "regional"}.get(tarefa["tipo"])
+
+
+def executar(tarefa_id, tipo, parametros):
+    """Executa uma tarefa reservada e regista o resultado (ou o erro)."""
+    parar = threading.Event()
+    sinal = threading.Thread(
+        target=manter_tarefa_viva, args=(tarefa_id, parar), daemon=True
+    )
+    sinal.start()
+    try:
+        resultado = TIPOS[tipo](tarefa_id, **parametros)
+    except Exception as e:
+        traceback.print_exc()
+        concluir_tarefa(tarefa_id, erro=str(e) or type(e).__name__)
+        return False
+    finally:
+        parar.set()
+        sinal.join()
+    concluir_tarefa(tarefa_id, resultado=resultado)
+    return True
+
+
+def worker(uma_vez=False, intervalo=INTERVALO_POLL, log=print):
+    """
+    Executa tarefas da fila, uma de cada vez (o limite de tokens é partilhado).
+    Com `uma_vez`, termina quando a fila estiver vazia (útil para cron).
+    """
+    while True:
+        tarefa = reservar_tarefa(PRAZO_MINUTOS)
+        if tarefa is None:
+            if uma_vez:
+                return
+            time.sleep(intervalo)
+            continue
+        tarefa_id, tipo, parametros = tarefa
+        log(f"Tarefa {tarefa_id} ({tipo}) iniciada…")
+        ok = executar(tarefa_id, tipo, parametros)
+        log(f"Tarefa {tarefa_id} {'concluída' if ok else 'falhou'}.")